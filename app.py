@@ -109,12 +109,14 @@ if __name__ == "__main__":
     multiprocessing.freeze_support()
 
     from common import utils
+    from common.startup_timer import startup_stage
 
     utils.get_cfg_dir(create=True)
 
-    from common.application import Application
-    from application.application_impl import ApplicationImpl
-    from common.logging_setup import logging_setup
+    with startup_stage('gui', 'imports'):
+        from common.application import Application
+        from application.application_impl import ApplicationImpl
+        from common.logging_setup import logging_setup
 
     args = sys.argv[1:]
     # Parse command line arguments
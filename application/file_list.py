@@ -59,6 +59,8 @@ class GuiFileList(QObject):
         self._mime_icons = self._build_mime_icons()
         self._ui = self._parent.get_ui()
         self._files = dict()
+        # file list items shown in rows
+        self._rows = list()
         self._shared_files = set()
 
         self._ui.file_list.setFocusPolicy(Qt.NoFocus)
@@ -88,6 +90,7 @@ class GuiFileList(QObject):
 
     def clear(self, clear_ui=True):
         self._files.clear()
+        self._rows = list()
         if clear_ui:
             self._ui.file_list.clear()
 
@@ -98,6 +101,7 @@ class GuiFileList(QObject):
             self._ui.file_list_views.setCurrentWidget(self._ui.welcome_label)
             self._ui.file_list.clear()
             self._files.clear()
+            self._rows = list()
             self._service.file_list_ready()
             self._file_list_changing = False
             return
@@ -107,7 +111,10 @@ class GuiFileList(QObject):
              for (rel_path, is_dir, created_time, was_updated) in file_list])
         old_list = set(self._files.keys())
         removed = old_list.difference(new_list)
-        added = new_list
+        # only rows which content is changed are rebuilt
+        added = set(
+            [FilePath(file[0]) for i, file in enumerate(file_list)
+             if i >= len(self._rows) or self._rows[i] != file])
 
         self._get_icons_info(file_list, added, removed)
 
@@ -176,6 +183,8 @@ class GuiFileList(QObject):
 
             del item
 
+        self._rows = list(file_list)
+
         if self._ui.file_list_views.currentWidget() == self._ui.welcome_label:
             self._ui.file_list_views.setCurrentWidget(self._ui.file_list)
 
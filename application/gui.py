@@ -36,8 +36,8 @@ from PySide2.QtWidgets \
 from PySide2.QtGui import QFont, QFontDatabase, QIcon
 
 from common.application import Application
-from .lost_folder_dialog import LostFolderDialog
 from common.async_qt import wait_signal, qt_run
+from common.startup_timer import startup_ready
 
 from common.constants import FREE_LICENSE
 from common.constants import PASSWORD_REMINDER_URI, HELP_URI, REGULAR_URI
@@ -61,17 +61,13 @@ from __update_branch import __update_branch__
 
 import pvtbox_main
 from .system_tray import SystemTrayIcon
-from .settings import Settings
 from .utils import elided, qt_open_path, open_link, service_cleanup
 from common.translator import tr
-from .device_list_dialog import DeviceListDialog
 from common.service_proxy import ServiceProxy
 from common.service_client import ServiceClient
 from .app_config import Config, load_config
 from .updater_worker import UpdaterWorker
-from .tutorial_dialog import TutorialDialog
 from .transfers_dialog import TransfersInfo
-from .about_dialog import AboutDialog
 from .file_list import GuiFileList
 from .notifications_dialog import Notifications
 from .support_dialog import SupportDialog
@@ -143,6 +139,7 @@ class GUI(QObject):
     final_exit = pyqtSignal()
     service_started = pyqtSignal()
     offline_dirs = pyqtSignal(list)
+    metrics = pyqtSignal(list)
 
     close_about_dialog = pyqtSignal()
     _show_auth_page_signal = pyqtSignal(bool, bool)
@@ -486,6 +483,8 @@ class GUI(QObject):
             QTimer.singleShot(200, self._show_lost_folder_dialog)
 
     def show_intro(self):
+        # dialogs are imported on first use to speed up startup
+        from .tutorial_dialog import TutorialDialog
         dialog = TutorialDialog(self._window, self._dp)
         dialog.show()
 
@@ -830,6 +829,7 @@ class GUI(QObject):
         self._tray.menu.aboutToShow.connect(on_show_menu)
 
         self._tray.show()
+        startup_ready('gui')
 
     def _set_welcome_label(self):
         label_text = tr("""<html><head/><body><p align="center"><span
@@ -890,6 +890,7 @@ class GUI(QObject):
             return
 
         self._about_dialog_opened = True
+        from .about_dialog import AboutDialog
         dialog = AboutDialog(
             self._window, self, self._updater, self._updater_worker,
             self._config, self._dp)
@@ -1380,6 +1381,7 @@ class GUI(QObject):
         if not dialog_finished:
             dialog_finished = self._service.dialog_finished
         logger.info('Showing lost folder dialog to user')
+        from .lost_folder_dialog import LostFolderDialog
         dialog = LostFolderDialog(
             self._window,
             path=path,
@@ -1561,6 +1563,7 @@ class GUI(QObject):
         def on_logging_disabled_changed(logging_disabled):
             self._logging_disabled_changed.emit(logging_disabled)
 
+        from .settings import Settings
         settings_form = Settings(self._config,
                                  self._main_cfg,
                                  self.start_service,
@@ -1606,6 +1609,7 @@ class GUI(QObject):
         if self.dialogs_opened() or self._devices_list_dialog:
             return
 
+        from .device_list_dialog import DeviceListDialog
         self._devices_list_dialog = DeviceListDialog(
             initial_data=self._main_cfg.devices,
             disk_usage=self._sync_dir_size,
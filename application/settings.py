@@ -41,7 +41,6 @@ from common.utils \
 import settings
 from .utils import msgbox
 from common.translator import tr
-from application.smart_sync_dialog import SmartSyncDialog
 from common.signal import Signal
 from common.file_path import FilePath
 from common.errors import ExpectedError
@@ -347,6 +346,8 @@ class Settings(object):
     def _on_smart_sync_button_clicked(self):
         self._get_offline_dirs()
         root = str(self._ui.location_edit.text())
+        # smart sync tree is heavy, so it is imported on first use
+        from application.smart_sync_dialog import SmartSyncDialog
         self._smart_sync_dialog = SmartSyncDialog(self._dialog)
         offline, online = self._smart_sync_dialog.show(
             root_path=root,
@@ -29,7 +29,8 @@ from uuid import uuid4
 from common.signal import Signal
 from common.utils import get_data_dir, get_cfg_filename, xor_with_key, is_portable
 from common.utils import get_default_lang, get_device_name
-from common.constants import UNKNOWN_LICENSE, REGULAR_URI
+from common.constants import UNKNOWN_LICENSE, REGULAR_URI, \
+    PATCH_CHUNKING_FIXED, PATCH_CHUNKING_CDC
 from common.file_path import FilePath
 
 # Setup logging
@@ -118,10 +119,18 @@ class ConfigLoader:
             max_relpath_len=3096,
             sync_dir_size=0,
             copies_logging=True,
+            copies_chunk_store=False,  # keep old copies deduplicated
             excluded_dirs_applied=(),  # List of excluded dirs, applied in DB
             host=REGULAR_URI,
             tracking_address='https://tracking.pvtbox.net:443/1/',
+            # send stats in gzip POST batches, server has to confirm
+            # them by X-Tracking-Accepted header. Applied on restart
+            tracking_batches=False,
             smart_sync=True,
+            patch_chunking=PATCH_CHUNKING_FIXED,  # or PATCH_CHUNKING_CDC
+            metrics_port=0,     # localhost metrics endpoint, 0 - disabled
+            max_share_downloads=2,  # shares downloaded concurrently
+            wipe_passes=1,  # overwrite passes on remote wipe
         )
 
     def refresh(self, check=True):
@@ -228,6 +237,9 @@ class ConfigLoader:
         assert isinstance(
             self.config.get('copies_logging'), bool), \
             'copies_logging'
+        assert isinstance(
+            self.config.get('copies_chunk_store'), bool), \
+            'copies_chunk_store'
         assert isinstance(
             self.config.get('excluded_dirs_applied'), (list, tuple)), \
             'excluded_dirs_applied'
@@ -237,9 +249,26 @@ class ConfigLoader:
         assert isinstance(
             self.config.get('tracking_address'), str), \
             'tracking_address'
+        assert isinstance(
+            self.config.get('tracking_batches'), bool), \
+            'tracking_batches'
         assert isinstance(
             self.config.get('smart_sync'), bool), \
             'smart_sync'
+        assert self.config.get('patch_chunking') in (
+            PATCH_CHUNKING_FIXED, PATCH_CHUNKING_CDC), \
+            'patch_chunking'
+        assert isinstance(
+            self.config.get('metrics_port'), int), \
+            'metrics_port'
+        assert isinstance(
+            self.config.get('max_share_downloads'), int) and \
+            self.config.get('max_share_downloads') > 0, \
+            'max_share_downloads'
+        assert isinstance(
+            self.config.get('wipe_passes'), int) and \
+            self.config.get('wipe_passes') > 0, \
+            'wipe_passes'
 
         # if new key is added to config, it's mandatory to use 'get(key)'
         # here, not pure  self.config[key]
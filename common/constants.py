@@ -122,6 +122,18 @@ inst.DOWNLOAD_PART_SIZE = 1024*1024
 inst.SIGNATURE_BLOCK_SIZE = inst.DOWNLOAD_PART_SIZE
 
 inst.PATCH_WAIT_TIMEOUT = 5 * 60
+
+# Patch chunking modes and corresponding patch format versions
+inst.PATCH_CHUNKING_FIXED = 'fixed'
+inst.PATCH_CHUNKING_CDC = 'cdc'
+inst.PATCH_FORMAT_VERSION_FIXED = 1
+inst.PATCH_FORMAT_VERSION_CDC = 2
+inst.PATCH_FORMAT_VERSIONS_SUPPORTED = (
+    inst.PATCH_FORMAT_VERSION_FIXED, inst.PATCH_FORMAT_VERSION_CDC)
+# Content defined chunking sizes (avg must be power of 2)
+inst.CDC_MIN_CHUNK_SIZE = 256 * 1024
+inst.CDC_AVG_CHUNK_SIZE = 1024 * 1024
+inst.CDC_MAX_CHUNK_SIZE = 4 * 1024 * 1024
 inst.RETRY_DOWNLOAD_TIMEOUT = 1 * 60.0
 inst.CONNECTIVITY_ALIVE_TIMEOUT = 30  # seconds
 
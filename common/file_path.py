@@ -25,9 +25,15 @@ from common.utils import normpath
 
 
 class FilePath(str):
+    __slots__ = ()
+
     long_path_windows_prefix = "\\\\?\\"
 
     def __new__(cls, value):
+        if type(value) is cls:
+            # already normalized, share it instead of copying
+            return value
+
         value = normpath(value)
         system = platform.system()
         if system == 'Windows':
@@ -26,6 +26,10 @@ from PySide2.QtCore import Signal
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# Websocket subprotocol offered by clients able to receive coalesced updates
+# in batches, one JSON list of [action, data] per frame
+BATCH_SUBPROTOCOL = 'pvtbox-gui-batch'
+
 
 class GuiProtocol(object):
     def __init__(self, receivers, verbose=False):
@@ -66,6 +70,34 @@ class GuiProtocol(object):
 
         return action, data
 
+    def parse_messages(self, encoded):
+        '''
+        Parses message or batch of updates received from websocket
+
+        @param encoded JSON encoded message or batch [string]
+        @return Parsed messages in the form (action, data) [list]
+        @raise ValueError
+        @raise KeyError
+        '''
+
+        if not encoded.startswith('['):
+            return [self.parse_message(encoded)]
+
+        try:
+            decoded = json.loads(encoded)
+            messages = [(action, data) for action, data in decoded]
+        except (ValueError, TypeError) as e:
+            logger.error("Failed to decode batch: '%s' (%s)", encoded, e)
+            raise ValueError(e)
+
+        if self._verbose:
+            try:
+                logger.verbose("Received batch %s", messages)
+            except AttributeError:
+                pass
+
+        return messages
+
     def call(self, action, *args):
         '''
         Calls callable corresponding to action received
@@ -109,5 +141,18 @@ class GuiProtocol(object):
 
         return json.dumps(result)
 
+    @staticmethod
+    def create_batch(updates):
+        '''
+        Packs actions into single compact message
+
+        @param updates Actions in the form (action, data) [iterable]
+        @return JSON encoded batch [string]
+        '''
+
+        return json.dumps(
+            [[action, data] for action, data in updates],
+            separators=(',', ':'))
+
     def add_receiver(self, receiver):
         self._receivers.add(receiver)
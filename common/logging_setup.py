@@ -26,9 +26,11 @@ import os
 import sys
 import time
 import errno
-from threading import RLock
+from collections import deque
+from threading import RLock, Lock, Condition, Thread, current_thread
 from os.path import split, join
 
+from common.metrics import counter
 from common.utils import make_dirs, get_bases_filename
 from common.config import load_config
 from __update_branch import __update_branch__
@@ -43,6 +45,22 @@ console_logging_disabled = False
 
 set_verbose = __update_branch__ != 'release'
 
+# Loggers of hot paths and records per second allowed for each call site
+# of them. Records above the rate and below WARNING are dropped
+SAMPLED_LOGGERS = {
+    'service.network.download_task.download_task': 20,
+    'service.monitor.actions.fs_event_actions': 20,
+    'service.sync_mechanism.event_queue_processor': 20,
+}
+
+# argument types safe to be formatted later in writer thread
+_IMMUTABLE_TYPES = (str, bytes, int, float, type(None))
+
+_dropped = counter(
+    'log_records_dropped', 'Log records dropped because of full queue')
+_sampled = counter(
+    'log_records_sampled', 'Log records of hot paths dropped by sampling')
+
 
 class VerboseLogger(logging.getLoggerClass()):
     def __init__(self, name, level=logging.NOTSET):
@@ -74,6 +92,43 @@ class EconoRotatingFileHandler(RotatingFileHandler):
         if self._enabled:
             RotatingFileHandler.emit(self, record)
 
+    def emit_batch(self, records):
+        """
+        Writes records with single flush. Unlike emit,
+        file size is not requested for every record
+        """
+        if not self._enabled:
+            return
+
+        self.acquire()
+        try:
+            size = None
+            for record in records:
+                try:
+                    msg = self.format(record) + self.terminator
+                    if self.stream is None:
+                        self.stream = self._open()
+                        size = None
+                    if size is None:
+                        self.stream.seek(0, 2)
+                        size = self.stream.tell()
+                    if self.maxBytes > 0 and size + len(msg) >= self.maxBytes:
+                        self.doRollover()
+                        if self.stream is None:
+                            self.stream = self._open()
+                        self.stream.seek(0, 2)
+                        size = self.stream.tell()
+                    self.stream.write(msg)
+                    size += len(msg)
+                except RecursionError:
+                    raise
+                except Exception:
+                    self.handleError(record)
+            if self.stream is not None:
+                self.flush()
+        finally:
+            self.release()
+
     def flush(self):
         try:
             RotatingFileHandler.flush(self)
@@ -138,6 +193,196 @@ class EconoRotatingFileHandler(RotatingFileHandler):
             pass
 
 
+class AsyncHandler(logging.Handler):
+    """
+    Passes records to target handlers in dedicated writer thread,
+    so logging threads do not wait for console and disk writes.
+    Records are written in batches. Queue is bounded, records below WARNING
+    are dropped when it is full. Records of sampled loggers below WARNING
+    are rate limited per call site.
+    Messages with immutable arguments only are formatted in writer thread
+    """
+
+    MAX_QUEUE_SIZE = 10000
+    # pause between batches to let records accumulate
+    BATCH_INTERVAL = 0.02
+    CLOSE_TIMEOUT = 5.
+
+    def __init__(self, handlers, sampled_loggers=None):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self._sampled_loggers = dict(sampled_loggers or {})
+        # (logger name, line number) <> [allowance, last time, suppressed]
+        self._sites = dict()
+        self._queue = deque()
+        self._condition = Condition(Lock())
+        self._writer_idle = False
+        self._dropped = 0
+        self._closed = False
+        self._writer = Thread(target=self._write_worker,
+                              name='LogWriter', daemon=True)
+        self._writer.start()
+
+    def handle(self, record):
+        # emit synchronizes itself, handler lock is not needed
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        with self._condition:
+            if record.levelno < logging.WARNING:
+                if not self._is_sampled(record):
+                    return
+
+                if len(self._queue) >= self.MAX_QUEUE_SIZE:
+                    self._dropped += 1
+                    _dropped.inc()
+                    return
+
+            closed = self._closed
+
+        try:
+            self._prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        if closed:
+            self._write_records([record])
+            return
+
+        with self._condition:
+            self._queue.append(record)
+            if self._writer_idle or record.levelno >= logging.ERROR:
+                self._condition.notify()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+
+            self._closed = True
+            self._condition.notify()
+        if self._writer is not current_thread():
+            self._writer.join(self.CLOSE_TIMEOUT)
+        logging.Handler.close(self)
+
+    def _is_sampled(self, record):
+        rate = self._sampled_loggers.get(record.name)
+        if not rate:
+            return True
+
+        key = (record.name, record.lineno)
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = [rate, record.created, 0]
+        allowance, last_time, suppressed = site
+        allowance = min(rate, allowance + (record.created - last_time) * rate)
+        site[1] = record.created
+        if allowance < 1:
+            site[0] = allowance
+            site[2] = suppressed + 1
+            _sampled.inc()
+            return False
+
+        site[0] = allowance - 1
+        if suppressed:
+            site[2] = 0
+            record.msg = '{} [{} similar records suppressed]'.format(
+                record.msg, suppressed)
+        return True
+
+    def _prepare(self, record):
+        args = record.args
+        if args and not (isinstance(args, tuple) and
+                         all(isinstance(arg, _IMMUTABLE_TYPES)
+                             for arg in args)):
+            # arguments may change until written, format them now
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # do not keep traceback frames alive in queue
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+            record.exc_info = None
+
+    def _write_worker(self):
+        while True:
+            with self._condition:
+                self._writer_idle = True
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                self._writer_idle = False
+                if not self._queue and self._closed:
+                    return
+
+                records = list(self._queue)
+                self._queue.clear()
+                dropped = self._dropped
+                self._dropped = 0
+
+            if dropped:
+                records.append(logging.makeLogRecord(dict(
+                    name=__name__, levelno=logging.WARNING,
+                    levelname=logging.getLevelName(logging.WARNING),
+                    msg="%s log records dropped, logging queue is full",
+                    args=(dropped,))))
+            self._write_records(records)
+
+            with self._condition:
+                if not self._closed:
+                    self._condition.wait(self.BATCH_INTERVAL)
+
+    def _write_records(self, records):
+        for handler in self.handlers:
+            try:
+                handler_records = [r for r in records
+                                   if r.levelno >= handler.level]
+                emit_batch = getattr(handler, 'emit_batch', None)
+                if emit_batch:
+                    handler_records = list(
+                        filter(handler.filter, handler_records))
+                    if handler_records:
+                        emit_batch(handler_records)
+                else:
+                    for record in handler_records:
+                        handler.handle(record)
+            except Exception:
+                self.handleError(records[-1])
+
+
+def queue_handlers(logger, sampled_loggers=None):
+    """
+    Moves handlers of logger behind AsyncHandler
+
+    @param logger Logger to move handlers of [logging.Logger]
+    @param sampled_loggers Names of hot path loggers and records
+        per second allowed for each call site of them [dict]
+    """
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(AsyncHandler(handlers, sampled_loggers))
+
+
+def _file_handlers(logger, use_root=True):
+    loggers = [logger, logger.root] if use_root else [logger]
+    handlers = []
+    for each in loggers:
+        for handler in each.handlers:
+            for target in getattr(handler, 'handlers', (handler,)):
+                if isinstance(target, EconoRotatingFileHandler) and \
+                        target not in handlers:
+                    handlers.append(target)
+    return handlers
+
+
 class ConsoleFilter(logging.Filter):
 
     def filter(self, record):
@@ -145,77 +390,35 @@ class ConsoleFilter(logging.Filter):
 
 
 def set_economode(logger, use_root=True):
-    for handler in logger.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.set_economode()
-    if not use_root:
-        return
-
-    for handler in logger.root.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.set_economode()
+    for handler in _file_handlers(logger, use_root):
+        handler.set_economode()
 
 
 def disable_file_logging(logger, use_root=True, clear_old=True):
-    for handler in logger.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.disable_logging(clear_old)
-            handler.close()
-    if not use_root:
-        return
-
-    for handler in logger.root.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.disable_logging(clear_old)
-            handler.close()
+    for handler in _file_handlers(logger, use_root):
+        handler.disable_logging(clear_old)
+        handler.close()
 
 
 def enable_file_logging(logger, use_root=True):
-    for handler in logger.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.enable_logging()
-    if not use_root:
-        return
-
-    for handler in logger.root.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.enable_logging()
+    for handler in _file_handlers(logger, use_root):
+        handler.enable_logging()
 
 
 def set_max_log_size_mb(logger, size, use_root=True):
-    for handler in logger.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.set_max_bytes(size * 1024 * 1024)
-    if not use_root:
-        return
-
-    for handler in logger.root.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.set_max_bytes(size * 1024 * 1024)
+    for handler in _file_handlers(logger, use_root):
+        handler.set_max_bytes(size * 1024 * 1024)
 
 
 def clear_old_logs(logger, use_root=True):
-    for handler in logger.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.clear_old_logs()
-    if not use_root:
-        return
-
-    for handler in logger.root.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.clear_old_logs()
+    for handler in _file_handlers(logger, use_root):
+        handler.clear_old_logs()
 
 
 def do_rollover(logger, use_root=True):
-    for handler in logger.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.doRollover()
-    if not use_root:
-        return
+    for handler in _file_handlers(logger, use_root):
+        handler.doRollover()
 
-    for handler in logger.root.handlers:
-        if isinstance(handler, EconoRotatingFileHandler):
-            handler.doRollover()
 
 def set_root_directory(new_root):
     from common.file_path import FilePath
@@ -324,3 +527,7 @@ def logging_setup(loglevel, logfilename=None, copies_logging=True):
     logging.raiseExceptions = False
 
     logging.config.dictConfig(cfg)
+
+    queue_handlers(logging.getLogger(), SAMPLED_LOGGERS)
+    if copies_logging:
+        queue_handlers(logging.getLogger('copies_logger'))
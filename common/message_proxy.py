@@ -30,6 +30,10 @@ logger.addHandler(logging.NullHandler())
 class MessageProxy(QObject):
     _message_received = Signal(str)
 
+    # Progress actions superseded by newer ones of the same name,
+    # socket client coalesces them and sends latest state only
+    coalesced_actions = frozenset()
+
     def __init__(self, parent=None, receivers=(),
                  socket_client=None, verbose=False):
         QObject.__init__(self, parent=parent)
@@ -61,6 +65,10 @@ class MessageProxy(QObject):
             logger.debug("Send: Message proxy is deaf")
             return
 
+        if action in self.coalesced_actions:
+            self._socket_client.send_gui_update(action, data)
+            return
+
         if data:
             message = self._protocol.create_action(action, data)
         else:
@@ -76,15 +84,16 @@ class MessageProxy(QObject):
             return
 
         try:
-            action, data = self._protocol.parse_message(encoded)
+            messages = self._protocol.parse_messages(encoded)
         except Exception as e:
             logger.warning("Can't parse message %s. Reason: %s", encoded, e)
             return
 
-        try:
-            if data:
-                self._protocol.call(action, *data)
-            else:
-                self._protocol.call(action)
-        except ValueError:
-            logger.warning("Invalid action %s, data %s", action, data)
+        for action, data in messages:
+            try:
+                if data:
+                    self._protocol.call(action, *data)
+                else:
+                    self._protocol.call(action)
+            except ValueError:
+                logger.warning("Invalid action %s, data %s", action, data)
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+# Setup logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class Counter(object):
+    """
+    Monotonically increasing value
+    """
+    type_name = 'counter'
+
+    def __init__(self, name, labels, help_text=''):
+        self.name = name
+        self.labels = labels
+        self.help = help_text
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, value=1):
+        with self._lock:
+            self._value += value
+
+    def get(self):
+        return self._value
+
+    def samples(self):
+        yield self.name, self.labels, self._value
+
+
+class Gauge(Counter):
+    """
+    Value which can go up and down
+    """
+    type_name = 'gauge'
+
+    def dec(self, value=1):
+        with self._lock:
+            self._value -= value
+
+    def set(self, value):
+        self._value = value
+
+
+class Histogram(object):
+    """
+    Latency histogram with HDR-style log-linear buckets.
+    Values are recorded in microseconds, each power of 2 range is split
+    into sub_buckets linear buckets, so relative error is
+    below 1 / sub_buckets for any value
+    """
+    type_name = 'histogram'
+
+    # 8 linear sub buckets, observe() relies on this value
+    sub_bucket_bits = 3
+    sub_buckets = 1 << sub_bucket_bits
+
+    def __init__(self, name, labels, help_text=''):
+        self.name = name
+        self.labels = labels
+        self.help = help_text
+        self._counts = dict()
+        self._sum = 0.
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _bucket_index(cls, value_us):
+        if value_us < cls.sub_buckets:
+            return value_us
+
+        shift = value_us.bit_length() - cls.sub_bucket_bits - 1
+        return ((shift + 1) << cls.sub_bucket_bits) + \
+            (value_us >> shift) - cls.sub_buckets
+
+    @classmethod
+    def _bucket_upper_bound(cls, index):
+        """
+        Returns exclusive upper bound of bucket in microseconds
+        """
+        if index < cls.sub_buckets:
+            return index + 1
+
+        shift = (index >> cls.sub_bucket_bits) - 1
+        sub_bucket = (index & (cls.sub_buckets - 1)) + cls.sub_buckets
+        return (sub_bucket + 1) << shift
+
+    def observe(self, value):
+        """
+        Records value given in seconds
+        """
+        # _bucket_index inlined to keep observation cheap
+        value_us = int(value * 1000000)
+        if value_us < 8:
+            index = value_us if value_us > 0 else 0
+        else:
+            shift = value_us.bit_length() - 4
+            index = ((shift + 1) << 3) + (value_us >> shift) - 8
+        counts = self._counts
+        with self._lock:
+            counts[index] = counts.get(index, 0) + 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def get_count(self):
+        with self._lock:
+            return sum(self._counts.values())
+
+    def get_sum(self):
+        return self._sum
+
+    def _sorted_buckets(self):
+        with self._lock:
+            counts = sorted(self._counts.items())
+        return [(self._bucket_upper_bound(index) / 1000000., count)
+                for index, count in counts]
+
+    def quantile(self, q):
+        """
+        Returns upper bound (seconds) of bucket containing q-quantile
+        """
+        buckets = self._sorted_buckets()
+        total = sum(count for _, count in buckets)
+        if not total:
+            return 0.
+
+        rank = q * total
+        accumulated = 0
+        for upper_bound, count in buckets:
+            accumulated += count
+            if accumulated >= rank:
+                return upper_bound
+        return buckets[-1][0]
+
+    def samples(self):
+        accumulated = 0
+        for upper_bound, count in self._sorted_buckets():
+            accumulated += count
+            labels = dict(self.labels)
+            labels['le'] = repr(upper_bound)
+            yield self.name + '_bucket', labels, accumulated
+        labels = dict(self.labels)
+        labels['le'] = '+Inf'
+        yield self.name + '_bucket', labels, accumulated
+        yield self.name + '_sum', self.labels, self._sum
+        yield self.name + '_count', self.labels, accumulated
+
+
+class MetricsRegistry(object):
+    """
+    Registry of named metrics. Metrics are created on first request
+    and cached, so callers should keep returned metric objects
+    instead of looking them up on hot paths
+    """
+
+    def __init__(self):
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_cls, name, help_text, labels):
+        labels = labels or {}
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is not None:
+            return metric
+
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = metric_cls(name, labels, help_text)
+                self._metrics[key] = metric
+        if not isinstance(metric, metric_cls):
+            raise TypeError("Metric {} is already registered as {}"
+                            .format(name, metric.type_name))
+        return metric
+
+    def counter(self, name, help_text='', labels=None):
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', labels=None):
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text='', labels=None):
+        return self._get_or_create(Histogram, name, help_text, labels)
+
+    def _sorted_metrics(self):
+        with self._lock:
+            metrics = list(self._metrics.items())
+        return [metric for _, metric in sorted(metrics, key=lambda m: m[0])]
+
+    def render_prometheus(self):
+        """
+        Returns metrics in Prometheus text exposition format
+        """
+        lines = []
+        described = set()
+        for metric in self._sorted_metrics():
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help:
+                    lines.append('# HELP {} {}'.format(
+                        metric.name, metric.help))
+                lines.append('# TYPE {} {}'.format(
+                    metric.name, metric.type_name))
+            for name, labels, value in metric.samples():
+                if labels:
+                    labels_str = ','.join(
+                        '{}="{}"'.format(
+                            k, str(v).replace('\\', '\\\\')
+                            .replace('"', '\\"'))
+                        for k, v in sorted(labels.items()))
+                    lines.append('{}{{{}}} {}'.format(
+                        name, labels_str, value))
+                else:
+                    lines.append('{} {}'.format(name, value))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def snapshot(self):
+        """
+        Returns JSON serializable metrics summary
+        """
+        result = []
+        for metric in self._sorted_metrics():
+            info = dict(name=metric.name,
+                        type=metric.type_name,
+                        labels=metric.labels)
+            if isinstance(metric, Histogram):
+                info.update(count=metric.get_count(),
+                            sum=metric.get_sum(),
+                            p50=metric.quantile(0.5),
+                            p90=metric.quantile(0.9),
+                            p99=metric.quantile(0.99))
+            else:
+                info['value'] = metric.get()
+            result.append(info)
+        return result
+
+
+registry = MetricsRegistry()
+
+
+def counter(name, help_text='', labels=None):
+    return registry.counter(name, help_text, labels)
+
+
+def gauge(name, help_text='', labels=None):
+    return registry.gauge(name, help_text, labels)
+
+
+def histogram(name, help_text='', labels=None):
+    return registry.histogram(name, help_text, labels)
+
+
+class MetricsServer(object):
+    """
+    Serves registry metrics in Prometheus text format over HTTP
+    on localhost only
+    """
+
+    def __init__(self, port, metrics_registry=registry):
+        self._port = port
+        self._registry = metrics_registry
+        self._server = None
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+        metrics_registry = self._registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = metrics_registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        try:
+            self._server = Server(('127.0.0.1', self._port), Handler)
+        except OSError as e:
+            logger.warning("Can't start metrics server on port %s (%s)",
+                           self._port, e)
+            return False
+
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info("Metrics server started at http://127.0.0.1:%s/metrics",
+                    self._port)
+        return True
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
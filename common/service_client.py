@@ -36,6 +36,7 @@ from common import async_utils
 from common.utils import get_cfg_dir, get_service_start_command, \
     get_platform, ensure_unicode, get_bases_filename, kill_all_services
 from common.config import load_config
+from common.gui_protocol import BATCH_SUBPROTOCOL
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -280,7 +281,7 @@ class ServiceClient(object):
     @asyncio.coroutine
     def _connect(self, port):
         self._factory = WebSocketClientFactory(
-            "ws://127.0.0.1:{}".format(port))
+            "ws://127.0.0.1:{}".format(port), protocols=[BATCH_SUBPROTOCOL])
         self._factory.protocol = ServiceClientProtocol
         self._factory.service_client = self
         coro = self._loop.create_connection(self._factory, '127.0.0.1', port)
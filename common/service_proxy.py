@@ -91,3 +91,6 @@ class ServiceProxy(MessageProxy):
 
     def set_offline_dirs(self, offline_dirs, online_dirs):
         self.send_message("set_offline_dirs", [offline_dirs, online_dirs])
+
+    def get_metrics(self):
+        self.send_message("get_metrics")
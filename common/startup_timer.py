@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from common.metrics import gauge
+
+# Setup logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Time the interpreter reached first import of this module.
+# It is imported by serv.py right after logging setup and by app.py
+# at the start of main(), so time of interpreter start and of
+# these few imports is not included
+_process_start = time.time()
+
+_lock = threading.Lock()
+_stages = []
+
+
+def process_start_time():
+    return _process_start
+
+
+def record_stage(process, stage, duration):
+    """
+    Records duration of startup stage
+
+    @param process Process name (e.g. 'gui', 'service') [str]
+    @param stage Stage name [str]
+    @param duration Stage duration in seconds [float]
+    """
+    with _lock:
+        _stages.append((process, stage, duration))
+    gauge('startup_stage_seconds',
+          'Duration of startup stages',
+          labels=dict(process=process, stage=stage)).set(duration)
+    logger.debug("Startup stage '%s' of %s took %.3f s",
+                 stage, process, duration)
+
+
+@contextmanager
+def startup_stage(process, stage):
+    """
+    Context manager measuring duration of startup stage
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_stage(process, stage, time.time() - start)
+
+
+def startup_ready(process):
+    """
+    Records time elapsed from process start till process is ready
+    (tray icon shown for gui, sync started for service).
+    Only the first call per process is recorded
+    """
+    with _lock:
+        if any(p == process and s == 'ready' for p, s, _ in _stages):
+            return
+    duration = time.time() - _process_start
+    record_stage(process, 'ready', duration)
+    logger.info("%s ready in %.3f s, stages: %s",
+                process, duration, startup_stages(process))
+
+
+def startup_stages(process):
+    """
+    Returns list of (stage, duration) for given process in order
+    stages were completed
+    """
+    with _lock:
+        return [(s, round(d, 3)) for p, s, d in _stages if p == process]
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+import os.path as op
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+# Setup logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class TreeWalker(object):
+    """
+    Walks directory tree scanning directories with os.scandir
+    in bounded thread pool.
+    Excluded directories are pruned before descending into them.
+    Results are yielded in batches of (path, is_dir, stat) tuples,
+    stat is taken from cached DirEntry data (None if not requested)
+    """
+
+    workers_count = min(max(multiprocessing.cpu_count(), 1) * 2, 16)
+    batch_size = 1000
+
+    def __init__(self, root, exclude_dirs=(), exclude_files=(),
+                 follow_symlinks=True, with_stat=False, recursive=True,
+                 workers_count=None, batch_size=None, is_active=None):
+        """
+        Constructor
+
+        @param root Root directory to walk (absolute) [unicode]
+        @param exclude_dirs
+            Directories not to descend into (relative to root) [iterable]
+        @param exclude_files File names to be skipped [iterable]
+        @param follow_symlinks Flag to descend into symlinked dirs [bool]
+        @param with_stat Flag to return entries stat results [bool]
+        @param recursive Flag to descend into subdirectories [bool]
+        @param is_active
+            Callable returning False when walk should be interrupted
+        """
+        self._root = root
+        self._exclude_dirs = {
+            op.normcase(op.normpath(op.join(root, d))) for d in exclude_dirs}
+        self._exclude_files = set(exclude_files)
+        self._follow_symlinks = follow_symlinks
+        self._with_stat = with_stat
+        self._recursive = recursive
+        self._workers_count = workers_count or self.workers_count
+        self._batch_size = batch_size or self.batch_size
+        self._is_active = is_active if is_active else lambda: True
+
+    def _is_excluded_dir(self, path):
+        return op.normcase(op.normpath(path)) in self._exclude_dirs
+
+    def _scan_dir(self, path):
+        entries = []
+        subdirs = []
+        try:
+            with scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir(
+                            follow_symlinks=self._follow_symlinks)
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if self._is_excluded_dir(entry.path):
+                            continue
+                        if self._recursive and (
+                                self._follow_symlinks or
+                                not entry.is_symlink()):
+                            subdirs.append(entry.path)
+                    elif entry.name in self._exclude_files:
+                        continue
+
+                    stat = None
+                    if self._with_stat:
+                        try:
+                            stat = entry.stat(
+                                follow_symlinks=self._follow_symlinks)
+                        except OSError as e:
+                            logger.debug("Can't stat '%s': %s",
+                                         entry.path, e)
+                            continue
+                    entries.append((entry.path, is_dir, stat))
+        except OSError as e:
+            logger.warning("Can't scan dir '%s': %s", path, e)
+        return entries, subdirs
+
+    def walk(self):
+        """
+        Generator yielding lists of (path, is_dir, stat) tuples
+        for all entries found under root (root itself is not included).
+        Order of batches is not defined
+        """
+        if self._is_excluded_dir(self._root):
+            return
+
+        pending_dirs = deque([self._root])
+        in_flight = set()
+        batch = []
+        # limit scheduled scans to keep memory bounded on huge trees
+        max_in_flight = self._workers_count * 2
+        with ThreadPoolExecutor(max_workers=self._workers_count) as executor:
+            try:
+                while pending_dirs or in_flight:
+                    if not self._is_active():
+                        return
+
+                    while pending_dirs and len(in_flight) < max_in_flight:
+                        in_flight.add(executor.submit(
+                            self._scan_dir, pending_dirs.popleft()))
+
+                    done, in_flight = wait(
+                        in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        entries, subdirs = future.result()
+                        pending_dirs.extend(subdirs)
+                        batch.extend(entries)
+                        if len(batch) >= self._batch_size:
+                            yield batch
+                            batch = []
+                if batch:
+                    yield batch
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def __iter__(self):
+        for batch in self.walk():
+            for item in batch:
+                yield item
+
+
+def walk_tree(root, exclude_dirs=(), exclude_files=(), **kwargs):
+    """
+    Shortcut for TreeWalker(...).walk()
+    """
+    return TreeWalker(root, exclude_dirs, exclude_files, **kwargs).walk()
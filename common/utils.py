@@ -67,6 +67,11 @@ class Singleton(type):
 
 def benchmark(f):
     import time, functools
+    from common.metrics import histogram
+
+    duration = histogram(
+        'function_duration_seconds', 'Benchmarked functions duration',
+        labels={'function': '{0}.{1}'.format(f.__module__, f.__name__)})
 
     @functools.wraps(f)
     def _benchmark(*args, **kw):
@@ -77,6 +82,7 @@ def benchmark(f):
             raise
         finally:
             t = time.time() - t
+            duration.observe(t)
             logger.debug('{0}.{1} time elapsed {2:.8f}'.format(f.__module__, f.__name__, t))
         return rez
     return _benchmark
@@ -939,29 +945,28 @@ def get_dir_list(root_dir, exclude_dirs=()):
 
 
 @benchmark
-def get_files_dir_list(root_dir, exclude_dirs=(), exclude_files=()):
+def get_files_dir_list(root_dir, exclude_dirs=(), exclude_files=(),
+                       is_active=None):
     from common.file_path import FilePath
+    from common.tree_walker import walk_tree
 
-    exclude_dirs = map(ensure_unicode, exclude_dirs)
+    exclude_dirs = list(map(ensure_unicode, exclude_dirs))
     exclude_files = list(map(ensure_unicode, exclude_files))
     root_dir = FilePath(root_dir).longpath
-    exclude_dirs = list(map(lambda p: FilePath(op.join(root_dir, p)).longpath,
-                            exclude_dirs))
     logger.debug("exclude_dirs %s", exclude_dirs)
 
     dirs = list()
     filelist = list()
 
-    for fullpath, directory, files in os.walk(root_dir, followlinks=True):
-        exclude_dirs_status = map(
-            lambda ed: FilePath(fullpath) in FilePath(ed), exclude_dirs)
-        if any(exclude_dirs_status):
-            continue
-
-        filelist.extend([FilePath(op.join(fullpath, f)).longpath
-                         for f in files if f not in exclude_files])
-        if fullpath != root_dir:
-            dirs.append(FilePath(fullpath).longpath)
+    for batch in walk_tree(root_dir,
+                           exclude_dirs=exclude_dirs,
+                           exclude_files=exclude_files,
+                           is_active=is_active):
+        for path, is_dir, _ in batch:
+            if is_dir:
+                dirs.append(FilePath(path).longpath)
+            else:
+                filelist.append(FilePath(path).longpath)
 
     return dirs, filelist
 
@@ -1706,6 +1711,44 @@ def copy_file(src, dst, buffer_size=10485760, preserve_file_date=False):
     os.chmod(dst, stat.S_IRWXU)
 
 
+# ioctl request to clone file content (Linux btrfs, xfs etc.)
+_FICLONE = 0x40049409
+
+
+def clone_file(src, dst):
+    '''
+    Makes copy-on-write clone (reflink) of src file at dst
+    if platform and filesystem support it. No data is copied.
+    @param src:    Source File
+    @param dst:    Destination File (not file path)
+    @return True if clone is made, False otherwise
+    '''
+
+    if get_platform() != 'Linux':
+        return False
+
+    import fcntl
+    src = ensure_unicode(src)
+    dst = ensure_unicode(dst)
+    dst_created = False
+    try:
+        with open(src, 'rb') as fsrc:
+            with open(dst, 'wb') as fdst:
+                dst_created = True
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    except (OSError, IOError) as e:
+        logger.debug("Can't clone '%s' to '%s' (%s)", src, dst, e)
+        if dst_created:
+            try:
+                os.remove(dst)
+            except Exception:
+                pass
+        return False
+
+    os.chmod(dst, stat.S_IRWXU)
+    return True
+
+
 def get_relative_root_folder(relative_path):
     if not relative_path:
         return None
@@ -22,7 +22,7 @@ import json
 import logging
 import traceback
 from hashlib import sha512
-from threading import current_thread
+from threading import current_thread, Lock
 from uuid import uuid4
 import os.path as op
 
@@ -93,6 +93,7 @@ class Client_API(QObject):
         self.cfg = cfg
         self.node_sign = None
         self._ip_lock = QMutex(parent=self)
+        self._sign_lock = Lock()
         self._os_name, self._is_server = get_os_name_and_is_server()
 
     def emit_loggedIn(self,
@@ -291,6 +292,17 @@ class Client_API(QObject):
         self.update_ip()
         self.node_sign = self.generate_node_sign()
 
+    def _refresh_node_sign(self, used_node_sign):
+        """
+        Updates node sign after request with given sign was rejected,
+        unless it was already updated by concurrent request
+
+        @param used_node_sign Node sign request was made with [str]
+        """
+        with self._sign_lock:
+            if self.node_sign == used_node_sign:
+                self.update_node_sign()
+
     def change_password(self, old_password, new_password):
         data = {
             'old_password': old_password,
@@ -399,6 +411,7 @@ class Client_API(QObject):
         data = {} if not data else data
         encoded = self.get_request_data(action, data) \
             if enrich_data else data
+        node_sign = self.node_sign
 
         try:
             response = self.make_post(url=server_addr, data=encoded,
@@ -417,7 +430,7 @@ class Client_API(QObject):
                 tb = traceback.format_list(traceback.extract_stack())
                 self._tracker.error(tb, 'Result not in response')
             if recurse_max > 0:
-                self.update_node_sign()
+                self._refresh_node_sign(node_sign)
                 return self._create_request(
                     action=action,
                     server_addr=server_addr,
@@ -435,7 +448,7 @@ class Client_API(QObject):
                     response.get('debug', ""))
                 self._tracker.error(tb, error)
             if info == 'flst' and recurse_max > 0:
-                self.update_node_sign()
+                self._refresh_node_sign(node_sign)
                 return self._create_request(
                     action=action,
                     server_addr=server_addr,
@@ -443,7 +456,7 @@ class Client_API(QObject):
                     recurse_max=recurse_max - 1)
             if errcode in ('SIGNATURE_INVALID', 'NODE_SIGN_NOT_FOUND') and \
                     recurse_max > 0:
-                self.update_node_sign()
+                self._refresh_node_sign(node_sign)
                 return self._create_request(
                     action=action,
                     server_addr=server_addr,
@@ -0,0 +1,100 @@
+"""add pending_files
+
+Revision ID: 5cbf44888310
+Revises: a3ff5124c7fb
+Create Date: 2026-10-18 22:40:12.518204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5cbf44888310'
+down_revision = 'a3ff5124c7fb'
+branch_labels = None
+depends_on = None
+
+
+# Frozen copy of service.events_db.pending_files schema at this revision
+_PENDING_CONDITION = """
+    exists (
+        select 1 from events e
+        where e.file_id = f.id
+        and (
+            e.state in ('occured', 'conflicted')
+            or (
+                e.server_event_id is not null
+                and e.id > max(ifnull(f.event_id, 0),
+                               ifnull(f.last_skipped_event_id, 0))
+            )
+        )
+    )
+"""
+
+
+def _refresh_file(file_id):
+    return """
+        delete from pending_files where file_id = {0};
+        insert into pending_files (file_id)
+            select f.id from files f
+            where f.id = {0}
+            and {1};
+    """.format(file_id, _PENDING_CONDITION)
+
+
+def upgrade():
+    op.execute("""
+        create table if not exists pending_files (
+            file_id integer not null primary key
+        )
+        """)
+    op.execute("""
+        create trigger if not exists pending_files_event_insert
+        after insert on events
+        begin
+            {}
+        end
+        """.format(_refresh_file('new.file_id')))
+    op.execute("""
+        create trigger if not exists pending_files_event_update
+        after update of state, server_event_id, file_id on events
+        begin
+            {}
+            {}
+        end
+        """.format(_refresh_file('old.file_id'),
+                   _refresh_file('new.file_id')))
+    op.execute("""
+        create trigger if not exists pending_files_event_delete
+        after delete on events
+        begin
+            {}
+        end
+        """.format(_refresh_file('old.file_id')))
+    op.execute("""
+        create trigger if not exists pending_files_file_update
+        after update of event_id, last_skipped_event_id on files
+        begin
+            {}
+        end
+        """.format(_refresh_file('new.id')))
+    op.execute("""
+        create trigger if not exists pending_files_file_delete
+        after delete on files
+        begin
+            delete from pending_files where file_id = old.id;
+        end
+        """)
+    op.execute("""
+        insert or ignore into pending_files (file_id)
+            select f.id from files f where {}
+        """.format(_PENDING_CONDITION))
+
+
+def downgrade():
+    op.execute("drop trigger if exists pending_files_event_insert")
+    op.execute("drop trigger if exists pending_files_event_update")
+    op.execute("drop trigger if exists pending_files_event_delete")
+    op.execute("drop trigger if exists pending_files_file_update")
+    op.execute("drop trigger if exists pending_files_file_delete")
+    op.execute("drop table if exists pending_files")
@@ -29,13 +29,14 @@ import argparse
 import sys
 import multiprocessing
 import os
-from webrtc import WebRtc
 
-from common.application import Application
-from __version import __version__
-from service.service_impl import ApplicationService
-from common.logging_setup import logging_setup
-from common.utils import get_platform
+from common.startup_timer import startup_stage
+with startup_stage('service', 'imports'):
+    from common.application import Application
+    from __version import __version__
+    from service.service_impl import ApplicationService
+    from common.logging_setup import logging_setup
+    from common.utils import get_platform
 
 webrtc_loglevels = (
     'SENSITIVE', 'VERBOSE', 'INFO', 'WARNING', 'ERROR', 'NONE')
@@ -132,6 +133,7 @@ if __name__ == "__main__":
             raise SystemExit(0)
 
         # Set webrtc loglevel
+        from webrtc import WebRtc
         loglevel = getattr(WebRtc, args['webrtc_loglevel'])
         WebRtc.set_log_level(loglevel)
     # To terminate from console with Ctrl+C
@@ -19,9 +19,8 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #   
 ###############################################################################
-from threading import RLock, Event
+from threading import RLock, Condition
 from collections import deque
-import time
 import logging
 
 # Setup logging
@@ -39,54 +38,78 @@ class Daque(object):
     Double added queue.
 
     Simulates simplified standard Queue behaviour.
-    Makes it possible to add objects to the beginning of queue
+    Makes it possible to add objects to the beginning of queue.
+    Items for which is_io returns True are processed in separate lane
+    limited by max_io_workers, so slow network bound tasks
+    do not occupy all workers.
+    Each lane is kept in its own deque of (order number, item),
+    so next item is found in constant time
     """
 
-    _small_timeout = 0.1
-
-    def __init__(self, max_workers=0):
+    def __init__(self, max_workers=0, max_io_workers=0, is_io=None):
         super(Daque, self).__init__()
         self._deque = deque()
-        # self._added = Event() wait for Python 3
+        self._io_deque = deque()
+        # order numbers of items added to the end and to the beginning
+        self._last_no = 0
+        self._first_no = 1
         self._lock = RLock()
+        self._changed = Condition(self._lock)
 
         self._max_workers = max_workers
+        self._max_io_workers = max_io_workers
+        self._is_io = is_io if max_io_workers else None
         self._tasks_in_processing = 0
+        self._io_tasks_in_processing = 0
         self._enabled = True
         self._postponed = False
 
     def get(self, block=True, timeout=0, to_process=False):
-        tries = int(max(timeout, 0) / self._small_timeout) + 1
-        to_wait = timeout == 0
-        count = 0
         logger.debug("Starting getting item from daque")
-        while count < tries or to_wait:
-            try:
-                with self._lock:
-                    count += 1
-                    if not self._postponed and (
-                            not self._max_workers or not to_process or
-                            (to_process and
-                            self._tasks_in_processing < self._max_workers)):
-                        item = self._deque.popleft()
-                        if to_process:
-                            self._tasks_in_processing += 1
-                        return item
-                    else:
-                        raise IndexError
-            except IndexError:
-                if not block:
-                    break
-                time.sleep(self._small_timeout)
-                # self._added.wait(self._small_timeout) wait for Python 3
-            except Exception as e:
-                logger.error("Error getting item from daque %s", e)
-            # finally:
-                # self._added.clear()   wait for Python 3
+        with self._changed:
+            if block:
+                # timeout 0 means wait forever
+                if not self._changed.wait_for(
+                        lambda: self._find_lane(to_process) is not None,
+                        timeout if timeout > 0 else None):
+                    logger.debug("Daque get timeout")
+                    raise Empty
+            elif self._find_lane(to_process) is None:
+                raise Empty
+
+            return self._pop_item(to_process)
+
+    def _find_lane(self, to_process):
+        """
+        Returns deque to take next item from, None if no item can be taken
+        """
+        if self._postponed:
+            return None
+
+        if to_process and self._max_workers:
+            free = self._tasks_in_processing < self._max_workers
+            free_io = self._io_tasks_in_processing < self._max_io_workers
         else:
-            logger.debug("Daque get timeout")
-
-        raise Empty
+            free = free_io = True
+        lane = self._deque if free and self._deque else None
+        if free_io and self._io_deque and (
+                lane is None or self._io_deque[0][0] < lane[0][0]):
+            lane = self._io_deque
+        return lane
+
+    def _pop_item(self, to_process):
+        lane = self._find_lane(to_process)
+        _, item = lane.popleft()
+        if to_process and self._max_workers:
+            if lane is self._io_deque:
+                self._io_tasks_in_processing += 1
+            else:
+                self._tasks_in_processing += 1
+        return item
+
+    def _get_lane(self, item):
+        return self._io_deque if self._is_io and self._is_io(item) \
+            else self._deque
 
     def get_nowait(self, to_process=False):
         return self.get(block=False, to_process=to_process)
@@ -95,31 +118,40 @@ class Daque(object):
         if not self._enabled:
             return
 
-        with self._lock:
-            self._deque.append(item)
-            # self._added.set() wait for Python 3
+        with self._changed:
+            self._last_no += 1
+            self._get_lane(item).append((self._last_no, item))
+            self._changed.notify()
 
     def putleft(self, item):
         if not self._enabled:
             return
 
-        with self._lock:
-            self._deque.appendleft(item)
-            # self._added.set() wait for Python 3
+        with self._changed:
+            self._first_no -= 1
+            self._get_lane(item).appendleft((self._first_no, item))
+            self._changed.notify()
 
     def empty(self):
         with self._lock:
-            return not len(self._deque)
+            return not self._deque and not self._io_deque
 
-    def task_done(self, future):
-        with self._lock:
+    def task_done(self, future, item=None):
+        with self._changed:
             if not self._max_workers:
                 return
 
-            self._tasks_in_processing -= 1
-            if self._tasks_in_processing < 0:
+            if self._is_io and item is not None and self._is_io(item):
+                self._io_tasks_in_processing -= 1
+            else:
+                self._tasks_in_processing -= 1
+            if self._tasks_in_processing < 0 or \
+                    self._io_tasks_in_processing < 0:
                 logger.debug("Processed more tasks, than items got")
-                self._tasks_in_processing = 0
+                self._tasks_in_processing = max(self._tasks_in_processing, 0)
+                self._io_tasks_in_processing = max(
+                    self._io_tasks_in_processing, 0)
+            self._changed.notify()
 
     def enable(self):
         self._enabled = True
@@ -130,10 +162,12 @@ class Daque(object):
     def clear(self):
         with self._lock:
             self._deque.clear()
+            self._io_deque.clear()
             self._tasks_in_processing = 0
-            # self._added.clear()   wait for Python 3
+            self._io_tasks_in_processing = 0
 
     def set_postponed(self, postponed=True):
-        with self._lock:
+        with self._changed:
             self._postponed = postponed
             logger.debug("Daque postponed mode is %s", self._postponed)
+            self._changed.notify()
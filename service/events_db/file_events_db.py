@@ -39,17 +39,26 @@ import re
 from service.events_db.base import Base
 from service.events_db.event import Event
 from service.events_db.file import File
+from service.events_db.pending_files import create_pending_files, \
+    verify_pending_files
 
 from service.network.browser_sharing import ProtoError
 
 from common.constants import MIN_DIFF_SIZE, DB_PAGE_SIZE
 from common.signal import Signal
 from common.utils import is_db_or_disk_full, benchmark, log_sequence
+from common.metrics import counter, histogram
 from common.file_path import FilePath
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+_session_duration = histogram(
+    'db_session_seconds', 'DB session lifetime', labels={'db': 'events'})
+_session_rollbacks = counter(
+    'db_session_rollbacks_total', 'DB sessions rolled back',
+    labels={'db': 'events'})
+
 
 class FileEventsDBError(Exception):
     """
@@ -157,6 +166,7 @@ class FileEventsDB(object):
 
         self._db_file = filename
         logger.info("Opening event DB from '%s'...", filename)
+        new_db_file = filename == ':memory:' or not exists(filename)
 
         conn_string = 'sqlite:///{}'.format(FilePath(filename))
         try:
@@ -169,6 +179,9 @@ class FileEventsDB(object):
             self._Session = sessionmaker(bind=self._engine)
             # Create DB schema if necessary
             Base.metadata.create_all(self._engine, checkfirst=True)
+            if new_db_file:
+                # existing db gets pending files by migration
+                create_pending_files(self._engine)
         except Exception as e:
             logger.critical(
                 "Failed to open event DB from '%s' (%s)", filename, e)
@@ -177,14 +190,27 @@ class FileEventsDB(object):
     def clean(self):
         assert self._Session is not None, 'DB has not been opened'
         try:
-            self._engine.execute("delete from events")
+            # files first, so pending files triggers on events
+            # have nothing to recalculate
             self._engine.execute("delete from files")
+            self._engine.execute("delete from events")
             logger.info("Cleaned events data base")
         except Exception as e:
             logger.error("Failed to clean DB (%s)", e)
             if not self.db_file_exists():
                 raise e
 
+    def verify_pending_files(self, repair=False):
+        """
+        Checks that maintained pending files table matches events
+
+        @param repair Flag to rebuild table if inconsistent [bool]
+        @return (missing files ids, extra files ids) [tuple(set, set)]
+        """
+        assert self._Session is not None, 'DB has not been opened'
+        with self._engine.begin() as connection:
+            return verify_pending_files(connection, repair=repair)
+
     @contextmanager
     def create_session(self,
                        expire_on_commit=True,
@@ -213,6 +239,7 @@ class FileEventsDB(object):
         if self._count_sessions:
             with self._sessions_count_lock:
                 self._sessions_count += 1
+        session_start = time.perf_counter()
         session = self._Session()
         session.expire_on_commit = expire_on_commit
         session.autoflush = False
@@ -269,6 +296,7 @@ class FileEventsDB(object):
                     pass
                 logger.debug("DB session %s rolled back (%s)",
                              hex(id(session)), e)
+            _session_rollbacks.inc()
             if is_db_or_disk_full(e):
                 self.db_or_disk_full.emit()
             else:
@@ -279,9 +307,11 @@ class FileEventsDB(object):
                 session.rollback()
                 logger.debug("DB session %s rolled back (%s)",
                              hex(id(session)), e)
+            _session_rollbacks.inc()
             raise
         finally:
             session.close()
+            _session_duration.observe(time.perf_counter() - session_start)
             if self._count_sessions:
                 with self._sessions_count_lock:
                     self._sessions_count -= 1
@@ -1317,6 +1347,62 @@ class FileEventsDB(object):
             statuses.append(file.is_offline)
         return statuses
     
+    @with_session
+    def get_existing_files_statuses(self, session=None):
+        """
+        Returns (id, folder_id, name, uuid, is_folder, is_offline) tuples
+        for files and folders having not deleted last event
+        """
+        return session.query(
+            File.id, File.folder_id, File.name, File.uuid,
+            File.is_folder, File.is_offline) \
+            .join(Event, File.event_id == Event.id) \
+            .filter(Event.type != 'delete') \
+            .all()
+
+    @with_session
+    def get_subtree_statuses(self, relative_path, session=None):
+        """
+        Returns (id, folder_id, name, uuid, is_folder, is_offline) tuples
+        for file or folder with relative path given and files and folders
+        inside it, having not deleted last event
+        """
+        files = self.find_files_by_relative_path(
+            relative_path, on_not_found=lambda path: [], session=session)
+        if not files:
+            return []
+
+        return session.execute(sql_text("""
+            with recursive
+                subtree (id, folder_id, name, uuid, is_folder, is_offline) as (
+                    select f.id, f.folder_id, f.name, f.uuid,
+                        f.is_folder, f.is_offline
+                    from files f
+                    inner join events e on f.event_id = e.id
+                    where f.id in ({})
+                    and e.type <> 'delete'
+                    union all
+                    select f.id, f.folder_id, f.name, f.uuid,
+                        f.is_folder, f.is_offline
+                    from files f
+                    inner join subtree s on f.folder_id = s.id
+                    inner join events e on f.event_id = e.id
+                    where e.type <> 'delete'
+                )
+            select * from subtree
+            """.format(','.join(str(f.id) for f in files)))).fetchall()
+
+    @with_session
+    def get_file_path_by_uuid(self, uuid, session=None):
+        """
+        Returns relative path of existing file or folder with uuid given,
+        None if there is no such file
+        """
+        file = session.query(File) \
+            .filter(File.uuid == uuid) \
+            .one_or_none()
+        return file.path if file and file.is_existing else None
+
     @with_session
     def has_online(self, session=None):
         count = session.query(func.count()) \
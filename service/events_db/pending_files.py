@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+"""
+Maintained table of files having events to be processed.
+
+Table is updated transactionally by triggers on events and files tables,
+so events loader can restrict its queries to pending files instead of
+scanning all events on every loading cycle.
+File is pending if it has local event to register ('occured'
+or 'conflicted') or remote event newer than both applied and
+last skipped events of the file.
+Table and triggers are added to existing databases by events_db migration
+5cbf44888310 (which keeps its own frozen copy of the schema)
+and created by create_pending_files for new ones.
+Schema changes here need a new migration
+"""
+import logging
+import time
+
+from sqlalchemy.sql import text as sql_text
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+PENDING_FILES_TABLE = 'pending_files'
+
+_PENDING_CONDITION = """
+    exists (
+        select 1 from events e
+        where e.file_id = f.id
+        and (
+            e.state in ('occured', 'conflicted')
+            or (
+                e.server_event_id is not null
+                and e.id > max(ifnull(f.event_id, 0),
+                               ifnull(f.last_skipped_event_id, 0))
+            )
+        )
+    )
+"""
+
+
+def _refresh_file(file_id):
+    return """
+        delete from pending_files where file_id = {0};
+        insert into pending_files (file_id)
+            select f.id from files f
+            where f.id = {0}
+            and {1};
+    """.format(file_id, _PENDING_CONDITION)
+
+
+PENDING_FILES_SCHEMA = [
+    """
+    create table if not exists pending_files (
+        file_id integer not null primary key
+    )
+    """,
+    """
+    create trigger if not exists pending_files_event_insert
+    after insert on events
+    begin
+        {}
+    end
+    """.format(_refresh_file('new.file_id')),
+    """
+    create trigger if not exists pending_files_event_update
+    after update of state, server_event_id, file_id on events
+    begin
+        {}
+        {}
+    end
+    """.format(_refresh_file('old.file_id'), _refresh_file('new.file_id')),
+    """
+    create trigger if not exists pending_files_event_delete
+    after delete on events
+    begin
+        {}
+    end
+    """.format(_refresh_file('old.file_id')),
+    """
+    create trigger if not exists pending_files_file_update
+    after update of event_id, last_skipped_event_id on files
+    begin
+        {}
+    end
+    """.format(_refresh_file('new.id')),
+    """
+    create trigger if not exists pending_files_file_delete
+    after delete on files
+    begin
+        delete from pending_files where file_id = old.id;
+    end
+    """,
+]
+
+PENDING_FILES_FILL = """
+    insert or ignore into pending_files (file_id)
+        select f.id from files f where {}
+""".format(_PENDING_CONDITION)
+
+def create_pending_files(engine):
+    """
+    Creates pending files table with its triggers and fills it.
+    To be called for new database only, existing ones are migrated
+
+    @param engine Events db engine
+    """
+    with engine.begin() as connection:
+        for statement in PENDING_FILES_SCHEMA:
+            connection.execute(sql_text(statement))
+        connection.execute(sql_text(PENDING_FILES_FILL))
+
+
+def verify_pending_files(connection, repair=False):
+    """
+    Compares pending files table with pending files calculated from
+    events and files tables
+
+    @param connection Events db connection or session
+    @param repair Flag to fix table if inconsistent [bool]
+    @return (missing files ids, extra files ids) [tuple(set, set)]
+    """
+    start_time = time.time()
+    expected = set(row[0] for row in connection.execute(sql_text(
+        "select f.id from files f where {}".format(_PENDING_CONDITION))))
+    actual = set(row[0] for row in connection.execute(sql_text(
+        "select file_id from pending_files")))
+    missing = expected - actual
+    extra = actual - expected
+    logger.debug("pending files verified in %s sec, "
+                 "%s pending, %s missing, %s extra",
+                 time.time() - start_time, len(expected),
+                 len(missing), len(extra))
+    if (missing or extra) and repair:
+        logger.warning("Pending files inconsistent, %s missing, %s extra. "
+                       "Repairing", len(missing), len(extra))
+        connection.execute(sql_text("delete from pending_files"))
+        connection.execute(sql_text(PENDING_FILES_FILL))
+    return missing, extra
@@ -20,7 +20,6 @@
 import logging
 from os.path import join
 
-from itertools import chain
 from collections import defaultdict
 from PySide2.QtCore import QObject, Signal, Qt
 
@@ -30,6 +29,9 @@ from common.file_path import FilePath
 from common.utils import get_platform
 from common.path_converter import PathConverter
 
+from service.path_status_index import PathStatusIndex, \
+    IGNORED, DISK_ERROR, INDEXING, DOWNLOADING
+
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
@@ -46,11 +48,10 @@ class FileStatusManager(QObject):
         self._cfg = cfg
         self._status = "syncing"
         self._sync_resuming = True
-        self._files_in_indexing = set()
+        # path <> download id
         self._files_in_downloading = dict()
-        self._files_ignored = set()
-        self._files_disk_error = set()
-        self._subscriptions = dict()
+        # path states and clients subscriptions
+        self._index = PathStatusIndex()
         self._not_synced_paths = set()
         self._pc = PathConverter(self._cfg.sync_directory)
         QObject.__init__(self)
@@ -86,13 +87,10 @@ class FileStatusManager(QObject):
                     "Subscription out of sync directory for path %s", path)
                 return
 
-        paths = self._subscriptions.get(client)
-        if paths and path:
-            paths.add(path)
-        elif path:
-            self._subscriptions[client] = {path}
+        if path:
+            self._index.subscribe(client, path)
         else:
-            self._subscriptions[client] = set()
+            self._index.add_client(client)
 
         is_sync_dir = not path or path == self._cfg.sync_directory
         status = self._get_file_status(path) if not is_sync_dir else self._status
@@ -106,20 +104,13 @@ class FileStatusManager(QObject):
     def unsubscribe(self, client, path):
         logger.debug('unsubscribe, client: %s, path: %s', client, path)
         if path:
-            path = FilePath(path)
+            self._index.unsubscribe(client, FilePath(path))
         else:
-            self._subscriptions.pop(client, None)
-            return
-        for client, subscription_paths in self._subscriptions.copy().items():
-            new_subscription_paths = set()
-            for subscription_path in subscription_paths:
-                if not (path == subscription_path or subscription_path in path):
-                    new_subscription_paths.add(subscription_path)
-            self._subscriptions[client] = new_subscription_paths
+            self._index.remove_client(client)
 
     def on_sync_resuming(self):
         self._sync_resuming = True
-        for client, paths in self._subscriptions.items():
+        for client, paths in self._index.clients().items():
             self.files_status.emit(
                 client, [p.shortpath
                          for p in paths] +
@@ -133,21 +124,20 @@ class FileStatusManager(QObject):
         if status is not None:
             self._status = self._convert_sync_status(status)
         if self._status == 'paused':
-            self._files_in_indexing.clear()
+            self._index.clear_state(INDEXING)
         logger.debug('on_global_status, status: %s, was_error_or_pause: %s',
                      self._status, was_error_or_pause)
         self._set_files_ignored()
-        for client, paths in self._subscriptions.items():
+        if self._status == 'synced':
+            self._index.clear_state(INDEXING)
+        for client, paths in self._index.clients().items():
             logger.debug("emit global status: %s", self._status)
             if self._status in ('error', 'paused'):
                 self._not_synced_paths.update(paths)
                 paths = [p.shortpath for p in paths] + \
                         [FilePath(self._cfg.sync_directory).shortpath]
             else:
-                force_check = False
-                if self._status == 'synced':
-                    self._files_in_indexing.clear()
-                    force_check = True
+                force_check = self._status == 'synced'
                 if was_error_or_pause or was_sync_resuming or force_check:
                     self._check_not_synced.emit()
                 paths = [FilePath(self._cfg.sync_directory).shortpath]
@@ -176,9 +166,14 @@ class FileStatusManager(QObject):
                     join(self._cfg.sync_directory, info['target_file_path']))
                 added.add(path)
                 self._files_in_downloading[path] = download_id
+                self._index.add_state(path, DOWNLOADING)
 
-        self._files_in_downloading = {k: v for k, v in self._files_in_downloading.items()
-                                      if v not in set(downloads[2])}
+        removed_ids = set(downloads[2])
+        if removed_ids:
+            for path, download_id in list(self._files_in_downloading.items()):
+                if download_id in removed_ids:
+                    del self._files_in_downloading[path]
+                    self._index.remove_state(path, DOWNLOADING)
 
         for path in added:
             self._on_file_syncing(path)
@@ -186,24 +181,24 @@ class FileStatusManager(QObject):
 
     def _on_file_added_to_indexing(self, path):
         logger.debug('_on_file_added_to_indexing, path: %s', path)
-        self._files_in_indexing.add(path)
+        self._index.add_state(path, INDEXING)
         self._on_file_syncing(path)
 
     def _on_file_syncing(self, path):
         logger.debug("on_file_syncing, path: %s", path)
-        if path in self._files_disk_error:
-            self._files_disk_error.discard(path)
+        if self._index.has_state(path, DISK_ERROR):
+            self._index.remove_state(path, DISK_ERROR)
             # make send file status as 'syncing'
             self._check_not_synced.emit()
 
         clients_paths = defaultdict(list)
-        for client, subscription_paths in self._subscriptions.items():
+        for client, subscription_paths in self._index.subscribers(
+                path).items():
             for subscription_path in subscription_paths:
                 if subscription_path in self._not_synced_paths:
                     continue
-                if path == subscription_path or path in subscription_path:
-                    clients_paths[client].append(subscription_path)
-                    self._not_synced_paths.add(subscription_path)
+                clients_paths[client].append(subscription_path)
+                self._not_synced_paths.add(subscription_path)
         for client, paths in clients_paths.items():
             logger.debug("emit syncing: %s for client %s", paths, client)
             self.files_status.emit(
@@ -211,42 +206,29 @@ class FileStatusManager(QObject):
 
     def _on_file_removed_from_indexing(self, path, path_removed):
         logger.debug('_on_file_removed_from_indexing, path: %s', path)
-        self._files_in_indexing.discard(path)
+        self._index.remove_state(path, INDEXING)
         if path_removed:
             self._path_removed.emit(path)
         self._check_not_synced.emit()
 
     def _on_file_added_to_ignore(self, path):
         logger.debug("_on_file_added_to_ignore, path: %s", path)
-        self._files_ignored.add(path)
-
-        clients_paths = defaultdict(list)
-        for client, subscription_paths in self._subscriptions.items():
-            for subscription_path in subscription_paths:
-                if (path == subscription_path or
-                        path in subscription_path):
-                    clients_paths[client].append(subscription_path)
-                    self._not_synced_paths.add(subscription_path)
-        for client, paths in clients_paths.items():
-            logger.debug("emit error: %s", paths)
-            self.files_status.emit(
-                client, [p.shortpath for p in paths], "error")
+        self._index.add_state(path, IGNORED)
+        self._emit_error(path)
 
     def _on_file_removed_from_ignore(self, path):
-        self._files_ignored.discard(path)
+        self._index.remove_state(path, IGNORED)
         self._check_not_synced.emit()
 
     def _on_file_added_to_disk_error(self, path):
         logger.debug("_on_file_added_to_disk_error, path: %s", path)
-        self._files_disk_error.add(path)
+        self._index.add_state(path, DISK_ERROR)
+        self._emit_error(path)
 
-        clients_paths = defaultdict(list)
-        for client, subscription_paths in self._subscriptions.items():
-            for subscription_path in subscription_paths:
-                if (path == subscription_path or
-                        path in subscription_path):
-                    clients_paths[client].append(subscription_path)
-                    self._not_synced_paths.add(subscription_path)
+    def _emit_error(self, path):
+        clients_paths = self._index.subscribers(path)
+        for paths in clients_paths.values():
+            self._not_synced_paths.update(paths)
         for client, paths in clients_paths.items():
             logger.debug("emit error: %s to client %s", paths, client)
             self.files_status.emit(
@@ -254,57 +236,27 @@ class FileStatusManager(QObject):
 
     def _on_check_not_synced(self):
         logger.debug("_on_check_syncing")
+        # status <> client <> paths
+        statuses_clients_paths = defaultdict(lambda: defaultdict(list))
         synced_paths = set()
-        error_paths = set()
-        syncing_paths = set()
-        online_paths = set()
         for path in self._not_synced_paths:
             status = self._get_file_status(path)
             if status == "synced":
                 synced_paths.add(path)
-            elif status == "online":
-                online_paths.add(path)
-            elif status == "error":
-                error_paths.add(path)
-            elif status == "syncing":
-                syncing_paths.add(path)
+            for client in self._index.path_subscribers(path):
+                statuses_clients_paths[status][client].append(path)
 
         if synced_paths:
-            self._not_synced_paths = self._not_synced_paths.difference(
-                synced_paths)
-
-        for client, paths in self._subscriptions.items():
-            if synced_paths:
-                client_synced_paths = list(paths.intersection(synced_paths))
-                if client_synced_paths:
-                    logger.debug("emit synced: %s to client %s", client_synced_paths, client)
-                    self.files_status.emit(
-                        client, [p.shortpath for p in client_synced_paths],
-                        "synced")
-            if online_paths:
-                client_online_paths = list(paths.intersection(online_paths))
-                if client_online_paths:
-                    logger.debug("emit online: %s to client %s", client_online_paths, client)
-                    self.files_status.emit(
-                        client, [p.shortpath for p in client_online_paths],
-                        "online")
-            if error_paths:
-                client_error_paths = list(paths.intersection(error_paths))
-                if client_error_paths:
-                    logger.debug("emit error: %s to client %s", client_error_paths, client)
-                    self.files_status.emit(
-                        client, [p.shortpath for p in client_error_paths],
-                        "error")
-            if syncing_paths:
-                client_syncing_paths = list(paths.intersection(syncing_paths))
-                if client_syncing_paths:
-                    logger.debug("emit syncing: %s to client %s", client_syncing_paths, client)
-                    self.files_status.emit(
-                        client, [p.shortpath for p in client_syncing_paths],
-                        "syncing")
+            self._not_synced_paths.difference_update(synced_paths)
+
+        for status in ("synced", "online", "error", "syncing"):
+            for client, paths in statuses_clients_paths[status].items():
+                logger.debug("emit %s: %s to client %s", status, paths, client)
+                self.files_status.emit(
+                    client, [p.shortpath for p in paths], status)
 
     def _set_files_ignored(self):
-        self._files_ignored = self._sync.get_long_paths()
+        self._index.set_state_paths(IGNORED, self._sync.get_long_paths())
 
     def _get_file_status(self, path):
         if self._sync_resuming:
@@ -313,22 +265,12 @@ class FileStatusManager(QObject):
         if self._status in ('paused', 'error'):
             return self._status
 
-        if path in self._files_ignored or path in self._files_disk_error:
+        if self._index.has_error(path):
             return "error"
 
-        for error_path in chain(self._files_ignored, self._files_disk_error):
-            if error_path in path:
-                return "error"
-
-        if path in self._files_in_indexing \
-                or path in self._files_in_downloading.keys() \
-                or not self._sync.is_known(path):
+        if self._index.has_syncing(path) or not self._sync.is_known(path):
             return "syncing"
 
-        for syncing_path in chain(self._files_in_indexing, self._files_in_downloading.keys()):
-            if syncing_path in path:
-                return "syncing"
-
         rel_path = self._pc.create_relpath(path)
         if rel_path.endswith(FILE_LINK_SUFFIX) and \
                 rel_path != FILE_LINK_SUFFIX:
@@ -344,8 +286,9 @@ class FileStatusManager(QObject):
 
     def _on_path_removed(self, path):
         path = FilePath(path)
-        for client, paths in self._subscriptions.items():
-            if any(p in path for p in paths):
-                logger.debug("emit clear path: %s", path)
-                self.clear_path.emit(client, path.shortpath)
-                self.unsubscribe(client, path)
+        clients = set(client for client, _ in
+                      self._index.subscriptions_within(path))
+        for client in clients:
+            logger.debug("emit clear path: %s", path)
+            self.clear_path.emit(client, path.shortpath)
+            self._index.unsubscribe(client, path)
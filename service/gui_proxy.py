@@ -44,6 +44,18 @@ class GuiProxy(MessageProxy):
     add_to_sync_folder = Signal(list)
     get_offline_dirs = Signal()
     set_offline_dirs = Signal(list, list)
+    get_metrics = Signal()
+
+    coalesced_actions = frozenset((
+        "download_progress",
+        "downloads_status",
+        "upload_speed_changed",
+        "download_speed_changed",
+        "upload_size_changed",
+        "download_size_changed",
+        "sync_status_changed",
+        "sync_dir_size_changed",
+    ))
 
     def __init__(self, parent=None, receivers=(), socket_client=None):
         self._receivers = list(receivers)
@@ -319,3 +331,6 @@ class GuiProxy(MessageProxy):
 
     def offline_dirs(self, paths):
         self.send_message("offline_dirs", [paths])
+
+    def metrics(self, metrics):
+        self.send_message("metrics", [metrics])
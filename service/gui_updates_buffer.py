@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+from collections import OrderedDict
+
+from common.metrics import counter
+
+# Setup logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_updates = counter(
+    'gui_updates', 'Progress updates queued for gui clients')
+_coalesced = counter(
+    'gui_updates_coalesced',
+    'Progress updates merged into newer ones before sending')
+_frames = counter(
+    'gui_update_frames', 'Frames of progress updates sent to gui clients')
+
+
+def merge_downloads_status(old, new):
+    """
+    Merges two consecutive downloads_status updates into one.
+    Downloads info is sent as delta (added, changed, deleted),
+    so deltas are combined to give same result as applied one by one
+    """
+    old_added, old_changed, old_deleted = old[3]
+    added, changed, deleted = \
+        dict(old_added), dict(old_changed), set(old_deleted)
+    new_added, new_changed, new_deleted = new[3]
+
+    for obj_id in new_deleted:
+        added.pop(obj_id, None)
+        changed.pop(obj_id, None)
+        deleted.add(obj_id)
+    for obj_id, info in new_added.items():
+        changed.pop(obj_id, None)
+        deleted.discard(obj_id)
+        added[obj_id] = info
+    for obj_id, info in new_changed.items():
+        if obj_id in added:
+            added[obj_id] = dict(added[obj_id], **info)
+        else:
+            changed[obj_id] = info
+
+    return list(new[:3]) + [[added, changed, list(deleted)]] + list(new[4:])
+
+
+class GuiUpdatesBuffer(object):
+    """
+    Outbound progress updates buffer for gui clients.
+    Updates are coalesced per action (last write wins, unless action
+    has merger) and sent as one frame on frame interval.
+    Timer is armed by first pending update only, so idle buffer
+    does not wake up event loop.
+    Must be used from event loop thread only
+    """
+
+    FRAME_INTERVAL = 0.2
+
+    mergers = {
+        'downloads_status': merge_downloads_status,
+    }
+
+    def __init__(self, loop, send):
+        """
+        @param loop Event loop to schedule flushes in
+        @param send Callable sending list of (action, data) to clients
+        """
+        self._loop = loop
+        self._send = send
+        # action <> data, in order of last update
+        self._pending = OrderedDict()
+        self._flush_handle = None
+        self._closed = False
+
+    def put(self, action, data):
+        if self._closed:
+            return
+
+        _updates.inc()
+        old = self._pending.pop(action, None)
+        if old is not None:
+            _coalesced.inc()
+            merger = self.mergers.get(action)
+            if merger:
+                data = merger(old, data)
+        self._pending[action] = data
+
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(
+                self.FRAME_INTERVAL, self._on_flush_timeout)
+
+    def flush(self):
+        self._cancel_flush()
+        if self._closed or not self._pending:
+            return
+
+        updates = list(self._pending.items())
+        self._pending.clear()
+        _frames.inc()
+        try:
+            self._send(updates)
+        except Exception as e:
+            logger.warning("Can't send gui updates (%s)", e)
+
+    def close(self):
+        self._closed = True
+        self._cancel_flush()
+        self._pending.clear()
+
+    def _on_flush_timeout(self):
+        self._flush_handle = None
+        self.flush()
+
+    def _cancel_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
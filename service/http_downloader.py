@@ -17,16 +17,21 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #   
 ###############################################################################
+import json
 import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock, RLock
 
-import asyncio
 import requests
-from concurrent.futures import ThreadPoolExecutor
-from service.network.leakybucket import LeakyBucketException
 from requests import Session
 
 from common.constants import NETWORK_HTTP, REGULAR_URI
 from common.ssl_pinning_adapter import SslPinningAdapter
+from common.utils import remove_file
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -43,6 +48,12 @@ class Params(object):
             'download_auth_data_cb': None,
             'get_upload_state_cb': None,
             'http_downloader_workers_count': 2,
+            # parallel ranges (connections) per download task
+            'http_downloader_ranges_count': 4,
+            'range_size': 4 * 1024 * 1024,
+            # files smaller than that are downloaded by single range
+            'parallel_min_size': 8 * 1024 * 1024,
+            'num_tries': 10,
         }
 
     def get(self, name):
@@ -94,15 +105,449 @@ class Params(object):
         return self._params['chunksize']
 
 
+class RangesState(object):
+    """
+    Byte ranges of the file downloaded already.
+    Persisted next to the file on checkpoints, so download is resumed
+    from the offsets reached instead of starting from zero
+    """
+
+    suffix = '.ranges'
+
+    def __init__(self, path):
+        self._filename = path + self.suffix
+        self.size = None
+        # sorted non overlapping [start, end) ranges
+        self.done = []
+        self.loaded = 0
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(path + cls.suffix)
+
+    def load(self):
+        try:
+            with open(self._filename, 'r') as f:
+                state = json.load(f)
+            self.size = state['size']
+            self.done = [[start, end] for start, end in state['done']]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+        self.loaded = sum(end - start for start, end in self.done)
+        return True
+
+    def save(self):
+        tmp_filename = self._filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as f:
+                json.dump(dict(size=self.size, done=self.done), f)
+            os.replace(tmp_filename, self._filename)
+        except OSError as e:
+            logger.warning("Can't save download ranges %s (%s)",
+                           self._filename, e)
+
+    def remove(self):
+        try:
+            remove_file(self._filename)
+        except OSError as e:
+            logger.warning("Can't remove download ranges %s (%s)",
+                           self._filename, e)
+
+    def reset(self, size=None):
+        self.size = size
+        self.done = []
+        self.loaded = 0
+
+    def add(self, start, end):
+        done = self.done
+        i = bisect_left(done, [start])
+        if i and done[i - 1][1] >= start:
+            i -= 1
+        j = i
+        while j < len(done) and done[j][0] <= end:
+            start = min(start, done[j][0])
+            end = max(end, done[j][1])
+            j += 1
+        # ranges loaded again are not counted twice
+        self.loaded += end - start - sum(e - s for s, e in done[i:j])
+        done[i:j] = [[start, end]]
+
+    def first_missing(self):
+        return self.done[0][1] if self.done and self.done[0][0] == 0 else 0
+
+    def gaps(self):
+        gaps = []
+        offset = 0
+        for start, end in self.done:
+            if start > offset:
+                gaps.append([offset, start])
+            offset = end
+        if self.size is None or offset < self.size:
+            gaps.append([offset, self.size])
+        return gaps
+
+
+class HttpDownloadTask(object):
+    """
+    Downloads file by byte ranges. Ranges are loaded in parallel
+    over pooled keep-alive connections and written to the file at their
+    offsets. Dropped ranges are requested again from the offset reached
+    """
+
+    _content_range_re = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+    def __init__(self, downloader, id, url, path,
+                 do_post_request, timeout, proceed):
+        self._downloader = downloader
+        self._params = downloader._params
+        self.id = id
+        self._url = url
+        self._path = path
+        self._do_post_request = do_post_request
+        self._timeout = timeout
+        self._proceed = proceed
+        self._chunk_size = self._params.get_chunk_size()
+        self._range_size = self._params.get('range_size')
+        self._num_tries = self._params.get('num_tries')
+
+        self._state = RangesState(path)
+        self._gaps = []
+        self._lock = RLock()
+        self._write_lock = Lock()
+        self._fd = None
+        self._auth_data = None
+        self._started = 0.
+        self._checkpoint_loaded = 0
+        self._stop_reason = None
+
+    def run(self):
+        """
+        Downloads file
+
+        @return (elapsed, total) [tuple]
+        @raise Exception
+        """
+        self._started = time.time()
+        if self._proceed and not self._state.load():
+            # ranges loaded are unknown, loaded size is not contiguous
+            # prefix of the file, so download is started from zero
+            logger.debug("Download task %s has no ranges state, "
+                         "starting from zero", self.id)
+            self._proceed = None
+        if not self._proceed:
+            self._state.remove()
+        self._checkpoint_loaded = self._state.loaded
+        self._auth_data = self._get_auth_data()
+
+        self._fd = os.open(
+            self._path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+        try:
+            if not self._proceed:
+                os.ftruncate(self._fd, 0)
+            self._download()
+            if self._stop_reason not in (None, 'cancelled'):
+                self._checkpoint()
+        except Exception:
+            self._stop_reason = self._stop_reason or 'failed'
+            self._state.remove()
+            raise
+        finally:
+            os.close(self._fd)
+
+        elapsed = time.time() - self._started
+        if self._stop_reason:
+            logger.debug("Download task %s interrupted. State %s",
+                         self.id, self._stop_reason)
+        if self._stop_reason != 'paused':
+            self._state.remove()
+        return elapsed, self._state.size or self._state.loaded
+
+    def _download(self):
+        gaps = self._state.gaps()
+        if not gaps:
+            return
+
+        # first request must not load again ranges done before
+        start, gap_end = gaps[0]
+        end = start + self._range_size
+        if gap_end is not None:
+            end = min(end, gap_end)
+
+        response = self._request(start, end)
+        if response.status_code == 206:
+            _, end, size = self._parse_content_range(response)
+            if self._state.size != size:
+                if self._state.size is not None:
+                    logger.warning("Download task %s file size changed "
+                                   "from %s to %s, starting from zero",
+                                   self.id, self._state.size, size)
+                    self._state.reset()
+                    self._checkpoint_loaded = 0
+                    if start:
+                        response.close()
+                        return self._download()
+                self._state.size = size
+            os.ftruncate(self._fd, size)
+            with self._lock:
+                self._gaps = self._cut_gaps(start, end)
+            self._load_ranges(start, end, response)
+        else:
+            # server does not support ranges, load whole file at once
+            length = response.headers.get('Content-Length')
+            self._state.reset(int(length) if length is not None else None)
+            self._checkpoint_loaded = 0
+            self._load_range(0, self._state.size, response)
+            if self._state.size is None and not self._stop_reason:
+                self._state.size = self._state.loaded
+
+    def _cut_gaps(self, start, end):
+        gaps = []
+        for gap_start, gap_end in self._state.gaps():
+            if gap_start < start:
+                gaps.append([gap_start, min(gap_end, start)])
+            if gap_end > end:
+                gaps.append([max(gap_start, end), gap_end])
+        return gaps
+
+    def _load_ranges(self, start, end, response):
+        left = self._state.size - self._state.loaded
+        helpers_count = 0
+        if left >= self._params.get('parallel_min_size'):
+            helpers_count = min(
+                self._params.get('http_downloader_ranges_count') - 1,
+                left // self._range_size)
+        futures = [self._downloader._ranges_executor.submit(self._work)
+                   for _ in range(helpers_count)]
+        try:
+            self._load_range(start, end, response)
+            self._work()
+        except Exception:
+            self._stop('failed')
+            raise
+        finally:
+            wait(futures)
+        for future in futures:
+            future.result()
+
+    def _work(self):
+        try:
+            while True:
+                segment = self._next_segment()
+                if not segment:
+                    return
+                self._load_range(*segment)
+        except Exception:
+            self._stop('failed')
+            raise
+
+    def _next_segment(self):
+        with self._lock:
+            if self._stop_reason or not self._gaps:
+                return None
+
+            start, end = self._gaps[0]
+            if end - start > self._range_size:
+                self._gaps[0][0] = start + self._range_size
+                end = start + self._range_size
+            else:
+                self._gaps.pop(0)
+            return start, end
+
+    def _load_range(self, start, end, response=None):
+        tries = 0
+        if end is not None and start >= end and response is not None:
+            response.close()
+        while end is None or start < end:
+            if response is None:
+                response = self._request(start, end)
+                if response.status_code != 206 or \
+                        self._parse_content_range(response)[0] != start:
+                    response.close()
+                    raise Exception("Range request failed")
+            offset = start
+            try:
+                start = self._read(response, start, end)
+            finally:
+                response.close()
+                response = None
+
+            if self._stop_reason or end is None:
+                return
+            if start == offset:
+                tries += 1
+                if tries >= self._num_tries:
+                    raise Exception("Connection error")
+                time.sleep(min(0.1 * 2 ** tries, 5))
+            else:
+                tries = 0
+
+    def _read(self, response, start, end):
+        chunks = response.iter_content(chunk_size=self._chunk_size)
+        while end is None or start < end:
+            if self._is_interrupted():
+                break
+            self._downloader._wait_till_can_download(
+                self._chunk_size if end is None
+                else min(self._chunk_size, end - start))
+            try:
+                chunk = next(chunks, None)
+            except requests.RequestException as e:
+                logger.warning("Download task %s range %s-%s dropped (%s)",
+                               self.id, start, end, e)
+                break
+            if chunk is None:
+                break
+            if end is not None:
+                chunk = chunk[:end - start]
+            if not chunk:
+                continue
+
+            self._write(chunk, start)
+            self._on_loaded(start, start + len(chunk))
+            start += len(chunk)
+        return start
+
+    def _write(self, data, offset):
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                written = os.pwrite(self._fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self._write_lock:
+                os.lseek(self._fd, offset, os.SEEK_SET)
+                while view:
+                    view = view[os.write(self._fd, view):]
+
+    def _on_loaded(self, start, end):
+        with self._lock:
+            self._state.add(start, end)
+            loaded = self._state.loaded
+            if loaded - self._checkpoint_loaded >= self._range_size:
+                self._checkpoint()
+
+        progress_cb = self._params.get('download_progress_cb')
+        if callable(progress_cb):
+            progress_cb(self.id, loaded, self._state.size or 0,
+                        time.time() - self._started)
+        self._downloader._network_speed_calculator.on_data_downloaded(
+            end - start, NETWORK_HTTP)
+
+    def _checkpoint(self):
+        with self._lock:
+            if self._state.size is None:
+                return
+
+            os.fsync(self._fd)
+            self._state.save()
+            self._checkpoint_loaded = self._state.loaded
+
+    def _is_interrupted(self):
+        if self._stop_reason:
+            return True
+
+        if self._downloader._closing:
+            self._stop('paused')
+            return True
+
+        get_upload_state_cb = self._params.get('get_upload_state_cb')
+        if callable(get_upload_state_cb):
+            state = get_upload_state_cb(self.id)
+            if not state:
+                raise Exception("Unknown upload state")
+            elif state in ('cancelled', 'paused'):
+                self._stop(state)
+                return True
+
+        return False
+
+    def _stop(self, reason):
+        with self._lock:
+            if not self._stop_reason:
+                self._stop_reason = reason
+
+    def _request(self, start, end):
+        headers = {'Range': 'bytes={}-{}'.format(
+            start, '' if end is None else end - 1)}
+        for i in range(self._num_tries):
+            try:
+                response = self._downloader._make_request(
+                    self._do_post_request, self._auth_data, self._url,
+                    headers, self._timeout)
+                if response.status_code < 400:
+                    return response
+
+                response.close()
+                if response.status_code == 404:
+                    raise Exception("Not found")
+                elif response.status_code == 416:
+                    # offsets out of date, request whole file
+                    headers = dict()
+                    continue
+                elif response.status_code in (401, 403):
+                    self._auth_data = self._get_auth_data()
+                logger.warning("Http server responded %s",
+                               response.status_code)
+            except requests.Timeout:
+                logger.warning(
+                    "Connection to http server timed out")
+                if i == self._num_tries - 1:
+                    raise Exception("Timeout")
+            except requests.ConnectionError:
+                logger.warning(
+                    "Error connecting to http server")
+                if i == self._num_tries - 1:
+                    raise Exception("Connection error")
+            if self._stop_reason:
+                raise Exception("Download task stopped")
+            time.sleep(min(0.1 * 2 ** i, 5))
+
+        raise Exception("Request to http server failed")
+
+    def _parse_content_range(self, response):
+        match = self._content_range_re.match(
+            response.headers.get('Content-Range', ''))
+        if not match or match.group(3) == '*':
+            raise Exception("Invalid Content-Range")
+
+        return int(match.group(1)), int(match.group(2)) + 1, \
+            int(match.group(3))
+
+    def _get_auth_data(self):
+        if not self._do_post_request:
+            return None
+
+        auth_data = None
+        # Try to obtain auth data for download request
+        download_auth_data_cb = self._params.get('download_auth_data_cb')
+        if callable(download_auth_data_cb):
+            try:
+                auth_data = download_auth_data_cb(self.id)
+            except Exception as e:
+                logger.error("download_auth_data_cb() with exception '%s'",
+                             e)
+            # No auth data obtained
+            if auth_data is None:
+                logger.warning(
+                    "No auth data obtained from download_auth_data_cb()")
+        return auth_data
+
+
 class HttpDownloader(object):
     def __init__(self, download_limiter=None, network_speed_calculator=None):
         self._params = Params()
         self._closing = False
         self._download_limiter = download_limiter
-        self._limit = 1024 if self._download_limiter else 0
         workers_count = self._params.get('http_downloader_workers_count')
+        self._ranges_count = self._params.get('http_downloader_ranges_count')
         self._executor = ThreadPoolExecutor(max_workers=workers_count)
+        # extra ranges are loaded here, first one is loaded by task thread
+        self._ranges_executor = ThreadPoolExecutor(
+            max_workers=max(workers_count * (self._ranges_count - 1), 1))
         self._session = None
+        self._session_lock = Lock()
         self._host = REGULAR_URI
 
         self._network_speed_calculator = network_speed_calculator
@@ -116,180 +561,42 @@ class HttpDownloader(object):
                 id, url, path)
         except AttributeError:
             pass
-        fut = self._executor.submit(
-            self._download_task, id, url, path, do_post_request, timeout,
-            proceed)
+        task = HttpDownloadTask(
+            self, id, url, path, do_post_request, timeout, proceed)
+        fut = self._executor.submit(task.run)
         fut.id = id
         fut.add_done_callback(self._download_task_done_cb)
 
     def close(self, immediately=True):
         self._closing = immediately
         self._executor.shutdown(not immediately)
-
-    def _get_timeout(self, timeout, chunk_size):
-        if self._limit:
-            timeout = max(timeout, chunk_size // self._limit * 2)
-        return timeout
+        self._ranges_executor.shutdown(not immediately)
 
     def set_download_limiter(self, download_speed_limiter):
         self._download_limiter = download_speed_limiter
-        self._limit = 1024 if self._download_limiter else 0
-
-    def _download_task(self, id, url, path, do_post_request, timeout, proceed):
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            loop.set_debug(True)
-            asyncio.set_event_loop(loop)
-        coro = self._download_task_coroutine(id,
-                                             url,
-                                             path,
-                                             do_post_request,
-                                             timeout,
-                                             proceed)
-        try:
-            return loop.run_until_complete(coro)
-        except Exception as e:
-            error_cb = self._params.get('download_error_cb')
-            if callable(error_cb):
-                error_cb(id, str(e))
-
-    @asyncio.coroutine
-    def _download_task_coroutine(self,
-                                 id,
-                                 url,
-                                 path,
-                                 do_post_request,
-                                 timeout,
-                                 proceed):
-
-        chunk_size = self._params.get_chunk_size()
-        headers=dict()
-        offset = 0
-        if proceed:
-            offset, size = proceed
-            headers = {'Range': '{}-{}'.format(offset, size)}
-        coro = self._make_request(do_post_request, id, url, headers)
-
-        num_tries = 10
-        for i in range(num_tries):
-            try:
-                request = yield from asyncio.wait_for(coro, timeout=timeout)
-                if request.status_code < 400:
-                    break
-                elif request.status_code == 404:
-                    raise Exception("Not found")
-            except asyncio.TimeoutError:
-                logger.warning(
-                    "Connection to http server timed out")
-                if i == num_tries - 1:
-                    raise Exception("Timeout")
-            except requests.ConnectionError:
-                logger.warning(
-                    "Error connecting to http server")
-                if i == num_tries - 1:
-                    raise Exception("Connection error")
-            except Exception as e:
-                logger.warning(
-                    "Unexpected error", e)
-                if i == num_tries - 1:
-                    raise
-        else:
-            raise Exception("Request to http server failed")
-
-        loaded = offset
-        started = asyncio.get_event_loop().time()
-        total = int(request.headers.get('Content-Length', 0))
-        chunk_size = chunk_size if chunk_size < total else total
-        try:
-            logger.verbose('http download task started. '
-                        'id: %s, url: %s, length: %s, file: %s',
-                        id, url, total, path)
-        except AttributeError:
-            pass
-        elapsed = 0.0
-        mode = 'wb' if not proceed or offset == 0 else 'ab'
-        with open(path, mode) as f:
-            while True:
-                get_upload_state_cb = \
-                    self._params.get('get_upload_state_cb')
-                if callable(get_upload_state_cb):
-                    state = get_upload_state_cb(id)
-                    if not state:
-                        raise Exception("Unknown upload state")
-                    elif state in ('cancelled', 'paused'):
-                        logger.debug("Download task %s interrupted. State %s",
-                                     id, state)
-                        return elapsed, total
-                coro = self._load_chunk(chunk_size, request)
-                timeout = self._get_timeout(timeout, chunk_size)
-                try:
-                    chunk = yield from asyncio.wait_for(coro, timeout=timeout)
-                except asyncio.TimeoutError:
-                    logger.warning(
-                        "Chunk receiving from http server timed out")
-                    raise Exception("Timeout")
 
-                elapsed = asyncio.get_event_loop().time() - started
-
-                if chunk is None:
-                    return elapsed, total
-
-                loaded_chunk_size = len(chunk)
-                f.write(chunk)
-                loaded += loaded_chunk_size
-                left = total - loaded
-                chunk_size = chunk_size if chunk_size < left else int(left)
-
-                if not chunk_size:
-                    return elapsed, total
-
-                progress_cb = self._params.get('download_progress_cb')
-                if callable(progress_cb):
-                    progress_cb(id, loaded, total, elapsed)
-                self._network_speed_calculator.on_data_downloaded(
-                    loaded_chunk_size, NETWORK_HTTP)
-
-    async def _load_chunk(self, chunk_size, request):
-        await self._wait_till_can_download(chunk_size)
-        for chunk in request.iter_content(chunk_size=chunk_size):
-            if not chunk:
-                continue
-            else:
-                return chunk
-
-    @asyncio.coroutine
-    def _make_request(self, do_post_request, id, url, headers=None):
+    def _get_session(self):
+        with self._session_lock:
+            if self._session is None:
+                self._session = Session()
+                if self._host == REGULAR_URI:
+                    self._session.mount(self._host, SslPinningAdapter(
+                        pool_maxsize=self._ranges_count * self._params.get(
+                            'http_downloader_workers_count')))
+            return self._session
+
+    def _make_request(self, do_post_request, auth_data, url, headers,
+                      timeout):
+        session = self._get_session()
         # Requested using of POST request
-        if self._session is None:
-            self._session = Session()
-            if self._host == REGULAR_URI:
-                self._session.mount(self._host, SslPinningAdapter())
         if do_post_request:
-            auth_data = None
-            # Try to obtain auth data for download request
-            download_auth_data_cb = self._params.get('download_auth_data_cb')
-            if callable(download_auth_data_cb):
-                try:
-                    auth_data = download_auth_data_cb(id)
-                except Exception as e:
-                    logger.error("download_auth_data_cb() with exception '%s'",
-                                 e)
-                # No auth data obtained
-                if auth_data is None:
-                    logger.warning(
-                        "No auth data obtained from download_auth_data_cb()")
-
             # Do HTTP POST request
-            if not headers:
-                headers = dict()
-            r = self._session.post(
-                url, data=auth_data, stream=True, headers=headers)
+            r = session.post(url, data=auth_data, stream=True,
+                             headers=headers, timeout=timeout)
         else:
             # Do HTTP GET request
-            r = self._session.get(
-                url, stream=True)
+            r = session.get(url, stream=True,
+                            headers=headers, timeout=timeout)
         return r
 
     def _download_task_done_cb(self, fut):
@@ -309,15 +616,14 @@ class HttpDownloader(object):
             if callable(completed_cb):
                 completed_cb(id, elapsed, total)
 
-    async def _wait_till_can_download(self, chunk_size):
+    def _wait_till_can_download(self, chunk_size):
         while self._download_limiter is not None:
-            try:
-                self._download_limiter.leak(chunk_size)
+            wait_time = self._download_limiter.consume(chunk_size)
+            if not wait_time:
                 break
-            except LeakyBucketException:
-                logger.debug("Can't download chunk due network limits, "
-                             "waiting...")
-                await asyncio.sleep(0.01)
+            logger.debug("Can't download chunk due network limits, "
+                         "waiting %.3f s...", wait_time)
+            time.sleep(wait_time)
 
     def set_callbacks(self, *args, **kwargs):
         self._params.set_callbacks(*args, **kwargs)
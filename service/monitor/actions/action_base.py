@@ -19,14 +19,21 @@
 #   
 ###############################################################################
 import logging
+import threading
+from time import perf_counter
 
 from common.signal import Signal
+from common.metrics import histogram
 
 from service.monitor.fs_event import FsEvent
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# actions pass events to next ones synchronously, so time spent in nested
+# actions is tracked per thread to record each action's own time only
+_nested_time = threading.local()
+
 
 class ActionBase(object):
     def __init__(self):
@@ -38,6 +45,11 @@ class ActionBase(object):
         self.event_suppressed = Signal(FsEvent)
         self.event_is_processing = Signal(FsEvent)
 
+        self._duration = histogram(
+            'monitor_action_seconds',
+            'Own time spent by monitor actions processing fs events',
+            labels={'action': self.__class__.__name__})
+
         self.event_passed.connect(self._on_event_passed)
         self.event_returned.connect(self._on_event_returned)
         self.event_suppressed.connect(self._on_event_suppressed)
@@ -74,7 +86,15 @@ class ActionBase(object):
                 self.__class__.__name__,
                 fs_event)
             self.event_is_processing(fs_event)
-            self._on_new_event(fs_event)
+            outer_nested_time = getattr(_nested_time, 'value', 0.)
+            _nested_time.value = 0.
+            start = perf_counter()
+            try:
+                self._on_new_event(fs_event)
+            finally:
+                elapsed = perf_counter() - start
+                self._duration.observe(elapsed - _nested_time.value)
+                _nested_time.value = outer_nested_time + elapsed
         else:
             self.event_passed(fs_event)
 
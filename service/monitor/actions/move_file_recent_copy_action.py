@@ -18,15 +18,13 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #   
 ###############################################################################
-from os import stat
-from os.path import join, exists
+from os.path import exists
 
 import shutil
 
 from common.constants import CREATE, MODIFY
 from common.file_path import FilePath
 from service.monitor.actions.action_base import ActionBase
-from common.utils import get_copies_dir
 from common.signal import Signal
 
 
@@ -40,7 +38,8 @@ class MoveFileRecentCopyAction(ActionBase):
 
     def _on_new_event(self, fs_event):
         file_synced_copy_name = FilePath(
-            join(get_copies_dir(self._root), fs_event.new_hash)).longpath
+            self._copies_storage.get_copy_file_path(
+                fs_event.new_hash)).longpath
         file_recent_copy_name = FilePath(fs_event.file_recent_copy).longpath
 
         self._copies_storage.add_copy_reference(
@@ -48,7 +47,8 @@ class MoveFileRecentCopyAction(ActionBase):
             reason="MoveFileRecentCopyAction {}".format(fs_event.src))
 
         if exists(file_recent_copy_name):
-            if not exists(file_synced_copy_name):
+            # copy may be packed into chunk store
+            if not self._copies_storage.copy_exists(fs_event.new_hash):
                 try:
                     shutil.move(file_recent_copy_name,
                                 file_synced_copy_name)
@@ -60,7 +60,8 @@ class MoveFileRecentCopyAction(ActionBase):
                             .format(fs_event.src))
                     self.event_returned(fs_event)
                     return
-                if stat(file_synced_copy_name).st_size != fs_event.file_size:
+                if self._copies_storage.get_copy_size(fs_event.new_hash) != \
+                        fs_event.file_size:
                     self.event_returned(fs_event)
                     return
             fs_event.file_synced_copy = FilePath(file_synced_copy_name)
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import json
+import logging
+import os
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from hashlib import md5
+from os.path import join, getsize
+from threading import RLock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from common.constants import SIGNATURE_BLOCK_SIZE, DB_PAGE_SIZE
+from common.file_path import FilePath
+from common.utils import make_dirs, remove_file
+from service.monitor.rsync import Rsync
+
+from .chunk import Base, Block, Manifest
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class ChunkStore(object):
+    """
+    Deduplicating storage of files copies.
+    Copy is stored as manifest of its signature blocks (the same blocks
+    Rsync.block_checksum computes), blocks are stored once in append-only
+    pack files and reference counted by manifests using them.
+    Files are read and written without lock, lock is held to update index
+    and to reserve space in append pack. Packs being read or written
+    are pinned and are not rewritten or removed by garbage collection
+    """
+
+    PACK_MAX_SIZE = 256 * 1024 * 1024
+    # pack is rewritten when less than this part of it is used
+    PACK_MIN_USAGE = 0.5
+
+    def __init__(self, directory):
+        """
+        @param directory Directory to keep packs and index db in
+        """
+        self._dir = directory
+        make_dirs(join(self._dir, 'chunks.db'))
+        self._engine = create_engine('sqlite:///{}'.format(
+            FilePath(join(self._dir, 'chunks.db'))))
+        self._Session = sessionmaker(bind=self._engine)
+        Base.metadata.create_all(self._engine, checkfirst=True)
+        self._lock = RLock()
+
+        with self._create_session() as session:
+            last_block = session.query(Block) \
+                .order_by(Block.pack.desc()) \
+                .first()
+        self._pack = last_block.pack if last_block else 0
+        # end of space reserved in append pack
+        self._pack_size = self._get_pack_size(self._pack)
+        # pack <> number of readers and writers using it
+        self._pins = Counter()
+
+    @contextmanager
+    def _create_session(self):
+        with self._lock:
+            session = self._Session()
+            session.expire_on_commit = False
+            session.autoflush = False
+            try:
+                yield session
+                session.commit()
+            except:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+    def _pack_path(self, pack):
+        return join(self._dir, 'pack_{}'.format(pack))
+
+    def _get_pack_size(self, pack):
+        try:
+            return getsize(self._pack_path(pack))
+        except OSError:
+            return 0
+
+    def _unpin(self, packs):
+        with self._lock:
+            self._pins.subtract(packs)
+
+    def _new_pack(self):
+        """
+        Returns number of pack not used yet, greater than numbers of
+        append pack and packs on disk (including rewritten ones)
+        """
+        packs = [int(name[len('pack_'):]) for name in os.listdir(self._dir)
+                 if name.startswith('pack_')]
+        return max(packs + [self._pack]) + 1
+
+    def contains(self, hash):
+        with self._create_session() as session:
+            return session.query(Manifest.id) \
+                .filter(Manifest.hash == hash) \
+                .one_or_none() is not None
+
+    def get_size(self, hash):
+        with self._create_session() as session:
+            manifest = session.query(Manifest) \
+                .filter(Manifest.hash == hash) \
+                .one_or_none()
+            return manifest.size if manifest else 0
+
+    def hashes(self):
+        with self._create_session() as session:
+            return {hash for hash, in session.query(Manifest.hash).all()}
+
+    def put(self, hash, path):
+        """
+        Stores file as copy with given hash
+
+        @param hash Copy hash [str]
+        @param path Path of file to store [str]
+        @return Operation success flag [bool]
+        """
+        if self.contains(hash):
+            return True
+
+        blocks_hashes = []
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(SIGNATURE_BLOCK_SIZE)
+                if not data:
+                    break
+
+                blocks_hashes.append(md5(data).hexdigest())
+                size += len(data)
+        if Rsync.hash_from_block_checksum(
+                dict(enumerate(blocks_hashes))) != hash:
+            logger.warning("Can't store copy %s, hash mismatch", hash)
+            return False
+
+        new_blocks, pack = self._reserve_new_blocks(blocks_hashes, size)
+        try:
+            if new_blocks and \
+                    not self._write_blocks(path, new_blocks, pack):
+                # file changed, written data will be collected as garbage
+                logger.warning("Can't store copy %s, file changed", hash)
+                return False
+
+            with self._create_session() as session:
+                if session.query(Manifest.id) \
+                        .filter(Manifest.hash == hash) \
+                        .one_or_none() is not None:
+                    return True
+
+                known = self._get_blocks(session, set(blocks_hashes))
+                if any(block_hash not in known and
+                       block_hash not in new_blocks
+                       for block_hash in blocks_hashes):
+                    logger.warning("Can't store copy %s, blocks "
+                                   "collected while writing", hash)
+                    return False
+
+                session.add_all(block for block_hash, (_, block)
+                                in new_blocks.items()
+                                if block_hash not in known)
+                session.flush()
+                self._change_counts(session, Counter(blocks_hashes))
+                session.add(Manifest(
+                    hash=hash, size=size, blocks=json.dumps(blocks_hashes)))
+        finally:
+            self._unpin([pack])
+        logger.debug("Copy %s stored, size %s, new blocks %s of %s",
+                     hash, size, len(new_blocks), len(blocks_hashes))
+        return True
+
+    def _reserve_new_blocks(self, blocks_hashes, size):
+        """
+        Reserves space in append pack for blocks not stored yet
+        and pins the pack
+
+        @return (dict block hash <> (block index, Block), pack) [tuple]
+        """
+        with self._lock:
+            with self._create_session() as session:
+                known = self._get_blocks(session, set(blocks_hashes))
+            pack = self._pack
+            self._pins[pack] += 1
+            new_blocks = dict()
+            for index, block_hash in enumerate(blocks_hashes):
+                if block_hash in known or block_hash in new_blocks:
+                    continue
+
+                block_size = min(
+                    SIGNATURE_BLOCK_SIZE, size - index * SIGNATURE_BLOCK_SIZE)
+                new_blocks[block_hash] = (index, Block(
+                    hash=block_hash, pack=pack, offset=self._pack_size,
+                    size=block_size, count=0))
+                self._pack_size += block_size
+            if self._pack_size >= self.PACK_MAX_SIZE:
+                self._pack = self._new_pack()
+                self._pack_size = 0
+        return new_blocks, pack
+
+    def _write_blocks(self, path, new_blocks, pack):
+        """
+        Writes new blocks data from file to space reserved in pack
+
+        @return False if file data doesn't match blocks hashes [bool]
+        """
+        blocks = sorted(new_blocks.items(), key=lambda item: item[1][0])
+        pack_path = self._pack_path(pack)
+        # other puts write their blocks to the same pack concurrently
+        open(pack_path, 'ab').close()
+        with open(path, 'rb') as f, open(pack_path, 'r+b') as pack_file:
+            pack_file.seek(blocks[0][1][1].offset)
+            for block_hash, (index, block) in blocks:
+                f.seek(index * SIGNATURE_BLOCK_SIZE)
+                data = f.read(block.size)
+                if md5(data).hexdigest() != block_hash:
+                    return False
+
+                pack_file.write(data)
+            pack_file.flush()
+            os.fsync(pack_file.fileno())
+        return True
+
+    def get(self, hash, path):
+        """
+        Restores copy with given hash into file
+
+        @param hash Copy hash [str]
+        @param path Path of file to write copy to [str]
+        @return Operation success flag [bool]
+        """
+        with self._lock:
+            with self._create_session() as session:
+                manifest = session.query(Manifest) \
+                    .filter(Manifest.hash == hash) \
+                    .one_or_none()
+                if not manifest:
+                    return False
+
+                blocks_hashes = json.loads(manifest.blocks)
+                blocks = self._get_blocks(session, set(blocks_hashes))
+            pinned = set(block.pack for block in blocks.values())
+            self._pins.update(pinned)
+
+        packs = dict()
+        try:
+            with open(path, 'wb') as f:
+                for block_hash in blocks_hashes:
+                    block = blocks[block_hash]
+                    pack = packs.get(block.pack)
+                    if pack is None:
+                        pack = packs[block.pack] = open(
+                            self._pack_path(block.pack), 'rb')
+                    pack.seek(block.offset)
+                    data = pack.read(block.size)
+                    if md5(data).hexdigest() != block_hash:
+                        raise IOError(
+                            "Block {} of copy {} is corrupted".format(
+                                block_hash, hash))
+                    f.write(data)
+        finally:
+            for pack in packs.values():
+                pack.close()
+            self._unpin(pinned)
+        return True
+
+    def remove(self, hashes):
+        """
+        Removes copies manifests and releases their blocks
+
+        @param hashes Copies hashes [iterable]
+        """
+        hashes = list(hashes)
+        if not hashes:
+            return
+
+        with self._create_session() as session:
+            for i in range(0, len(hashes), DB_PAGE_SIZE):
+                manifests = session.query(Manifest) \
+                    .filter(Manifest.hash.in_(hashes[i:i + DB_PAGE_SIZE])) \
+                    .all()
+                released = Counter()
+                for manifest in manifests:
+                    released.update(json.loads(manifest.blocks))
+                    session.delete(manifest)
+                self._change_counts(
+                    session, {h: -c for h, c in released.items()})
+
+    def remove_except(self, hashes):
+        """
+        Removes all copies except ones with given hashes
+        """
+        self.remove(self.hashes() - set(hashes))
+
+    def collect_garbage(self):
+        """
+        Deletes unreferenced blocks and rewrites packs
+        which are used less than PACK_MIN_USAGE
+        """
+        with self._lock:
+            self._collect_garbage()
+
+    def _collect_garbage(self):
+        with self._create_session() as session:
+            deleted = session.query(Block) \
+                .filter(Block.count <= 0) \
+                .delete()
+            used_sizes = defaultdict(int)
+            for pack, size in session.query(Block.pack, Block.size).all():
+                used_sizes[pack] += size
+
+        packs = set(used_sizes)
+        packs.add(self._pack)
+        for name in os.listdir(self._dir):
+            if name.startswith('pack_'):
+                pack = int(name[len('pack_'):])
+                if pack == self._pack or self._pins[pack] > 0:
+                    # being appended to, read or written
+                    continue
+                if pack not in packs:
+                    remove_file(self._pack_path(pack))
+                    continue
+                pack_size = getsize(self._pack_path(pack))
+                if used_sizes[pack] < pack_size * self.PACK_MIN_USAGE:
+                    self._rewrite_pack(pack)
+        logger.debug("Chunk store garbage collected, blocks deleted %s",
+                     deleted)
+
+    def _rewrite_pack(self, pack):
+        with self._create_session() as session:
+            blocks = session.query(Block) \
+                .filter(Block.pack == pack) \
+                .order_by(Block.offset) \
+                .all()
+            new_pack = self._new_pack()
+            with open(self._pack_path(pack), 'rb') as src, \
+                    open(self._pack_path(new_pack), 'wb') as dst:
+                for block in blocks:
+                    src.seek(block.offset)
+                    offset = dst.tell()
+                    dst.write(src.read(block.size))
+                    block.pack = new_pack
+                    block.offset = offset
+                dst.flush()
+                os.fsync(dst.fileno())
+            session.bulk_save_objects(blocks)
+        remove_file(self._pack_path(pack))
+        logger.debug("Pack %s rewritten to pack %s", pack, new_pack)
+
+    def clear(self):
+        with self._lock:
+            with self._create_session() as session:
+                session.query(Manifest).delete()
+                session.query(Block).delete()
+            for name in os.listdir(self._dir):
+                if name.startswith('pack_'):
+                    remove_file(join(self._dir, name))
+            self._pack = 0
+            self._pack_size = 0
+
+    def get_stored_size(self):
+        """
+        Returns size of copies stored and size of packs on disk
+        """
+        with self._create_session() as session:
+            copies_size = sum(
+                size for size, in session.query(Manifest.size).all())
+        packs_size = sum(
+            getsize(join(self._dir, name)) for name in os.listdir(self._dir)
+            if name.startswith('pack_'))
+        return copies_size, packs_size
+
+    def _get_blocks(self, session, hashes):
+        hashes = list(hashes)
+        blocks = dict()
+        for i in range(0, len(hashes), DB_PAGE_SIZE):
+            blocks.update(
+                (block.hash, block) for block in session.query(Block)
+                .filter(Block.hash.in_(hashes[i:i + DB_PAGE_SIZE]))
+                .all())
+        return blocks
+
+    def _change_counts(self, session, deltas):
+        blocks = self._get_blocks(session, deltas.keys())
+        session.bulk_update_mappings(Block, [
+            dict(id=block.id, count=block.count + deltas[block.hash])
+            for block in blocks.values()])
@@ -20,11 +20,14 @@
 import logging
 
 from contextlib import contextmanager
-from os import stat, listdir
+import os
+import re
+from os import stat
+from time import perf_counter, time
 from collections import defaultdict
 
-from os.path import join, exists, getsize, isfile
-from threading import RLock
+from os.path import join, exists, getsize
+from threading import RLock, Timer
 
 from sqlalchemy import create_engine
 from sqlalchemy.exc import OperationalError
@@ -33,24 +36,48 @@ from sqlalchemy.orm import sessionmaker
 from common.signal import Signal
 from common.utils import get_copies_dir, is_db_or_disk_full, remove_file
 from common.file_path import FilePath
+from common.tree_walker import walk_tree
 from common.logging_setup import do_rollover
 from common.constants import DB_PAGE_SIZE
+from common.metrics import counter, histogram
 
 
 from .copy import Base, Copy
+from .chunk_store import ChunkStore
 from db_migrations import upgrade_db, stamp_db
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+_session_duration = histogram(
+    'db_session_seconds', 'DB session lifetime', labels={'db': 'copies'})
+_session_rollbacks = counter(
+    'db_session_rollbacks_total', 'DB sessions rolled back',
+    labels={'db': 'copies'})
+_packed_copies = counter(
+    'copies_packed_total', 'Copies moved to chunk store')
+_restored_copies = counter(
+    'copies_restored_total', 'Copies restored from chunk store')
+
+_copy_name_re = re.compile(r'^[0-9a-f]{32}$')
+
 
 class Copies(object):
     """
     Interface for reference counting of files copies
     """
 
+    # copies not modified for this time (seconds) are moved to chunk store
+    PACK_MIN_AGE = 24 * 60 * 60
+    # reference counts changes are saved to db when this number of copies
+    # is changed or this time (seconds) passed since last save
+    LEDGER_FLUSH_SIZE = 1000
+    LEDGER_FLUSH_INTERVAL = 5
+    # copies without references are deleted after this time (seconds)
+    GC_GRACE_PERIOD = 10 * 60
+
     def __init__(self, root, db_file_created_cb=None, extended_logging=True,
-                 to_upgrade=True):
+                 to_upgrade=True, chunk_store=False):
         self.possibly_sync_folder_is_removed = Signal()
         self.delete_copy = Signal(str,  # copy hash
                                   bool)     # with signature
@@ -98,9 +125,35 @@ class Copies(object):
 
         self._last_changes = defaultdict(int)
 
+        # in-memory reference counts ledger, loaded on first use
+        self._journal_file = join(get_copies_dir(root), 'copies.journal')
+        self._journal = None
+        self._counts = None
+        self._ids = None
+        self._zero_since = None
+        self._dirty = set()
+        self._last_flush = time()
+        # journal records are synced to disk once per flush
+        self._journal_synced = True
+        # flushes changes when no more changes come
+        self._flush_timer = None
+
+        # hash <> time copy file was last requested by ensure_copy_file,
+        # such copies are not packed as they may be opened
+        self._last_used = dict()
+
+        self._chunk_store = None
+        if chunk_store:
+            try:
+                self._chunk_store = ChunkStore(
+                    join(get_copies_dir(root), 'chunks'))
+            except Exception as e:
+                logger.error("Can't open copies chunk store (%s)", e)
+
     @contextmanager
     def create_session(self):
         with self._lock:
+            session_start = perf_counter()
             session = self._Session()
             session.expire_on_commit = False
             session.autoflush = False
@@ -117,30 +170,181 @@ class Copies(object):
                     self.possibly_sync_folder_is_removed()
                     logger.error("Possibly sync folder is removed %s", e)
 
+                _session_rollbacks.inc()
                 if is_db_or_disk_full(e):
                     self.db_or_disk_full.emit()
                 else:
                     raise
             except:
                 session.rollback()
+                _session_rollbacks.inc()
                 raise
             finally:
                 session.close()
+                _session_duration.observe(perf_counter() - session_start)
+
+    def _load_ledger(self):
+        """
+        Loads copies reference counts into memory applying changes
+        logged in journal but not yet saved to db
+        """
+        if self._counts is not None:
+            return
+
+        with self.create_session() as session:
+            rows = session.query(Copy.id, Copy.hash, Copy.count).all()
+        self._ids = {hash: id for id, hash, _ in rows}
+        self._counts = {hash: count for _, hash, count in rows}
+        # copies which had no references at start are collectable at once
+        self._zero_since = {hash: 0 for hash, count in self._counts.items()
+                            if count <= 0}
+
+        journal_counts = self._read_journal()
+        if journal_counts:
+            logger.info("Applying %s copies counts from journal",
+                        len(journal_counts))
+            for hash, count in journal_counts.items():
+                self._set_count(hash, count)
+            self.flush_ledger()
+        # all counts are saved to db at this point. Journal is appended
+        # to, not truncated, as records left are replayed with same result
+        self._journal = open(self._journal_file, 'a')
+
+    def _read_journal(self):
+        counts = dict()
+        if not exists(self._journal_file):
+            return counts
+
+        try:
+            with open(self._journal_file, 'r') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        # last record was not written completely
+                        break
+                    hash, count = line.split()
+                    counts[hash] = int(count)
+        except Exception as e:
+            logger.warning("Can't read copies journal (%s)", e)
+        return counts
+
+    def _set_count(self, hash, count):
+        self._counts[hash] = count
+        self._dirty.add(hash)
+        if count <= 0:
+            self._zero_since.setdefault(hash, time())
+        else:
+            self._zero_since.pop(hash, None)
+
+    def _change_counts(self, deltas):
+        """
+        Applies reference counts deltas in memory and logs new counts
+        to journal. Changes are saved to db in batches by flush_ledger
+
+        @param deltas Dict hash <> delta
+        @return Dict hash <> new count
+        """
+        with self._lock:
+            self._load_ledger()
+            counts = dict()
+            for hash, delta in deltas.items():
+                count = self._counts.get(hash, 0) + delta
+                self._set_count(hash, count)
+                counts[hash] = count
+            try:
+                self._journal.write(''.join(
+                    '{} {}\n'.format(hash, count)
+                    for hash, count in counts.items()))
+                self._journal.flush()
+                self._journal_synced = False
+            except Exception as e:
+                logger.error("Can't write copies journal (%s)", e)
+                self.flush_ledger()
+
+            if len(self._dirty) >= self.LEDGER_FLUSH_SIZE or \
+                    time() - self._last_flush > self.LEDGER_FLUSH_INTERVAL:
+                self.flush_ledger()
+            elif self._dirty and not self._flush_timer:
+                self._flush_timer = Timer(
+                    self.LEDGER_FLUSH_INTERVAL, self._on_flush_timer)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+            return counts
+
+    def _on_flush_timer(self):
+        with self._lock:
+            self._flush_timer = None
+            try:
+                self.flush_ledger()
+            except Exception as e:
+                logger.warning("Can't save copies counts (%s)", e)
+
+    def _sync_journal(self):
+        if self._journal_synced or not self._journal:
+            return
+
+        try:
+            os.fsync(self._journal.fileno())
+            self._journal_synced = True
+        except Exception as e:
+            logger.warning("Can't sync copies journal (%s)", e)
+
+    def flush_ledger(self):
+        """
+        Syncs journal to disk, saves reference counts changed
+        since last flush to db in single transaction and truncates journal
+        """
+        with self._lock:
+            self._last_flush = time()
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+
+            # changes survive if db write fails
+            self._sync_journal()
+            dirty = self._dirty
+            self._dirty = set()
+            with self.create_session() as session:
+                session.bulk_update_mappings(Copy, [
+                    dict(id=self._ids[hash], count=self._counts[hash])
+                    for hash in dirty if hash in self._ids])
+                new_copies = [
+                    Copy(hash=hash, count=self._counts[hash])
+                    for hash in dirty if hash not in self._ids]
+                session.bulk_save_objects(new_copies, return_defaults=True)
+            self._ids.update((copy.hash, copy.id) for copy in new_copies)
+
+            if self._journal:
+                try:
+                    self._journal.seek(0)
+                    self._journal.truncate()
+                except Exception as e:
+                    logger.warning("Can't truncate copies journal (%s)", e)
+            logger.debug("Saved %s copies counts", len(dirty))
+
+    def close(self):
+        """
+        Saves reference counts changes to db and closes journal.
+        To be called before instance is dropped
+        """
+        with self._lock:
+            self.flush_ledger()
+            if self._journal:
+                try:
+                    self._journal.close()
+                except Exception as e:
+                    logger.warning("Can't close copies journal (%s)", e)
+                self._journal = None
+            # ledger is loaded again if instance is still used
+            self._counts = None
 
     def add_copy_reference(self, hash, reason="", postponed=False):
         if postponed:
             self._last_changes[hash] += 1
             copy_count = self._last_changes[hash]
         else:
-            with self.create_session() as session:
-                copy = session.query(Copy)\
-                    .filter(Copy.hash == hash)\
-                    .one_or_none()
-                if copy is None:
-                    copy = Copy(hash=hash, count=0)
-                copy.count += 1
-                copy_count = copy.count
-                session.merge(copy)
+            copy_count = self._change_counts({hash: 1})[hash]
 
         logger.debug("File copy reference added, %s, "
                      "count: %s, postponed is %s",
@@ -162,19 +366,14 @@ class Copies(object):
             self._last_changes[hash] -= 1
             copy_count = self._last_changes[hash]
         else:
-            with self.create_session() as session:
-                copy = session.query(Copy)\
-                    .filter(Copy.hash == hash)\
-                    .one_or_none()
-                if not copy:
+            with self._lock:
+                self._load_ledger()
+                if hash not in self._counts:
                     logger.warning("Trying to remove copy reference "
                                    "for non-existant copy %s", hash)
                     return
 
-                else:
-                    copy.count -= 1
-                    copy_count = copy.count
-                session.merge(copy)
+                copy_count = self._change_counts({hash: -1})[hash]
 
         logger.debug("File copy reference removed, %s, "
                      "count: %s, postponed is %s",
@@ -193,31 +392,7 @@ class Copies(object):
         if not self._last_changes:
             return
 
-        hashes = list(self._last_changes.keys())
-        hashes_len = len(hashes)
-        with self.create_session() as session:
-            mappings = []
-            insert_mappings = []
-            for i in range(0, hashes_len, DB_PAGE_SIZE):
-                hashes_portion = hashes[:DB_PAGE_SIZE]
-                hashes = hashes[DB_PAGE_SIZE:]
-                copies = session.query(Copy)\
-                    .filter(Copy.hash.in_(tuple(hashes_portion)))\
-                    .all()
-                mappings.extend([dict(
-                    id=copy.id,
-                    count=copy.count + self._last_changes[copy.hash])
-                    for copy in copies
-                ])
-                hashes_absent = set(hashes_portion) - {c.hash for c in copies}
-                insert_mappings.extend([dict(
-                    hash=hash,
-                    count=self._last_changes[hash])
-                    for hash in hashes_absent
-                ])
-
-            session.bulk_update_mappings(Copy, mappings)
-            session.bulk_insert_mappings(Copy, insert_mappings)
+        self._change_counts(self._last_changes)
 
         logger.debug("Commited last copies changes for %s hashes",
                      len(self._last_changes))
@@ -230,17 +405,114 @@ class Copies(object):
     def clear_last_changes(self):
         self._last_changes.clear()
 
+    def has_references(self, hash):
+        with self._lock:
+            self._load_ledger()
+            return self._counts.get(hash, 0) > 0 or \
+                self._last_changes.get(hash, 0) > 0
+
     def copy_exists(self, hash):
-        return exists(self.get_copy_file_path(hash))
+        return exists(self.get_copy_file_path(hash)) or \
+            self._chunk_store is not None and self._chunk_store.contains(hash)
 
     def get_copy_size(self, hash):
         copy_path = self.get_copy_file_path(hash)
-        return stat(copy_path).st_size if exists(copy_path) else 0
+        if exists(copy_path):
+            return stat(copy_path).st_size
+        elif self._chunk_store is not None:
+            return self._chunk_store.get_size(hash)
+        return 0
+
+    def ensure_copy_file(self, hash):
+        """
+        Makes copy file exist restoring it from chunk store if necessary
+
+        @param hash Copy hash [str]
+        @return Copy file exists flag [bool]
+        """
+        copy_path = self.get_copy_file_path(hash)
+        with self._lock:
+            self._last_used[hash] = time()
+            if exists(copy_path):
+                return True
+        if self._chunk_store is None:
+            return False
+
+        tmp_path = "{}_{}.restore".format(copy_path, id(self))
+        try:
+            if not self._chunk_store.get(hash, tmp_path):
+                return False
+            os.replace(tmp_path, copy_path)
+        except Exception as e:
+            logger.warning("Can't restore copy %s from chunk store (%s)",
+                           hash, e)
+            remove_file(tmp_path)
+            return False
+
+        _restored_copies.inc()
+        logger.debug("Copy %s restored from chunk store", hash)
+        return True
+
+    def pack_copies(self):
+        """
+        Moves copies files not modified for PACK_MIN_AGE
+        into chunk store
+        """
+        if self._chunk_store is None:
+            return
+
+        min_mtime = time() - self.PACK_MIN_AGE
+        with self._lock:
+            self._load_ledger()
+            hashes = {hash for hash, count in self._counts.items()
+                      if count > 0}
+            self._last_used = {hash: used
+                               for hash, used in self._last_used.items()
+                               if used > min_mtime}
+
+        copies_dir = get_copies_dir(self._root)
+        packed = 0
+        for batch in walk_tree(copies_dir, recursive=False):
+            for path, is_dir, _ in batch:
+                hash = os.path.basename(path)
+                if is_dir or hash not in hashes or \
+                        not _copy_name_re.match(hash):
+                    continue
+
+                try:
+                    if stat(path).st_mtime > min_mtime or \
+                            self._is_copy_used(hash, min_mtime) or \
+                            not self._chunk_store.put(hash, path):
+                        continue
+                    with self._lock:
+                        # copy could be requested while being packed
+                        if self._is_copy_used(hash, min_mtime):
+                            continue
+                        remove_file(path)
+                except Exception as e:
+                    logger.warning("Can't pack copy %s (%s)", hash, e)
+                    continue
+
+                packed += 1
+                _packed_copies.inc()
+
+        self._chunk_store.collect_garbage()
+        copies_size, packs_size = self._chunk_store.get_stored_size()
+        logger.info("Packed %s copies, chunk store keeps %s bytes "
+                    "of copies in %s bytes", packed, copies_size, packs_size)
+
+    def _is_copy_used(self, hash, min_time):
+        return self._last_used.get(hash, 0) > min_time
 
     def get_copy_file_path(self, hash):
         return join(get_copies_dir(self._root), hash)
 
     def clean(self, with_files=True, with_signatures=True):
+        with self._lock:
+            self._clean(with_files, with_signatures)
+
+    def _clean(self, with_files, with_signatures):
+        self.flush_ledger()
         with self.create_session() as session:
             self._log_db(session)
 
@@ -249,6 +521,8 @@ class Copies(object):
                 for copy in copies:
                     if copy.hash:
                         self.delete_copy(copy.hash, with_signatures)
+                if self._chunk_store is not None:
+                    self._chunk_store.clear()
 
         try:
             self._engine.execute("delete from copies")
@@ -258,34 +532,68 @@ class Copies(object):
             if not self.db_file_exists():
                 raise e
 
+        if self._counts is not None:
+            self._counts.clear()
+            self._ids.clear()
+            self._zero_since.clear()
+            self._journal.seek(0)
+            self._journal.truncate()
+
         if self._extended_logging:
             do_rollover(self._logger, use_root=False)
 
     def clean_unnecessary(self):
-        with self.create_session() as session:
-            self._log_db(session)
+        """
+        Deletes copies having no references for GC_GRACE_PERIOD
+        """
+        with self._lock:
+            self._load_ledger()
+            self.flush_ledger()
+            deadline = time() - self.GC_GRACE_PERIOD
+            hashes = [hash for hash, since in self._zero_since.items()
+                      if since <= deadline]
+            if not hashes:
+                return
+
+            with self.create_session() as session:
+                self._log_db(session)
 
-            copies = session.query(Copy).filter(Copy.count <= 0).all()
-            for copy in copies:
-                if copy.hash:
-                    self.delete_copy(copy.hash, True)
+                for hash in hashes:
+                    if hash:
+                        self.delete_copy(hash, True)
 
-            session.query(Copy).filter(Copy.count <= 0).delete()
+                if self._chunk_store is not None:
+                    self._chunk_store.remove(hashes)
+
+                for i in range(0, len(hashes), DB_PAGE_SIZE):
+                    session.query(Copy) \
+                        .filter(Copy.hash.in_(hashes[i:i + DB_PAGE_SIZE])) \
+                        .delete(synchronize_session=False)
+
+            for hash in hashes:
+                self._counts.pop(hash, None)
+                self._ids.pop(hash, None)
+                self._zero_since.pop(hash, None)
+            logger.debug("Deleted %s unnecessary copies", len(hashes))
 
     def remove_copies_not_in_db(self):
-        with self.create_session() as session:
-            copies = session.query(Copy).all()
-            exclude_files = {copy.hash for copy in copies}
+        with self._lock:
+            self._load_ledger()
+            exclude_files = set(self._counts)
         exclude_files.add('copies.db')
+        exclude_files.add('copies.journal')
+        if self._chunk_store is not None:
+            self._chunk_store.remove_except(exclude_files)
         copies_dir = get_copies_dir(self._root)
         try:
-            files_to_delete = set(listdir(copies_dir)) - exclude_files
-            files_to_delete = map(lambda f: join(copies_dir, f),
-                                  files_to_delete)
-            list(map(remove_file, filter(
-                lambda f: isfile(f) and
-                          not f.endswith('.download') and
-                          not f.endswith('.info'), files_to_delete)))
+            for batch in walk_tree(copies_dir,
+                                   exclude_files=exclude_files,
+                                   recursive=False):
+                list(map(remove_file, (
+                    path for path, is_dir, _ in batch
+                    if not is_dir and
+                    not path.endswith('.download') and
+                    not path.endswith('.info'))))
         except Exception as e:
             self.possibly_sync_folder_is_removed()
             logger.warning("Can't remove copies files. Reason: %s", e)
@@ -156,7 +156,8 @@ class FilesystemMonitor(QObject):
             self._root,
             self._storage,
             self._path_converter,
-            self.Exceptions)
+            self.Exceptions,
+            self._copies_storage)
 
         self._files_list = FilesList(self._storage, self._root)
 
@@ -694,7 +695,8 @@ class FilesystemMonitor(QObject):
         if not hash:
             logger.error("Invalid hash '%s'", hash)
             return
-        copy = op.join(get_copies_dir(self._root), hash)
+        # copy chunk store data is removed by copies storage itself
+        copy = self._copies_storage.get_copy_file_path(hash)
         try:
             remove_file(copy)
             logger.info("File copy deleted %s", copy)
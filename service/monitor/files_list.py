@@ -21,26 +21,36 @@
 import logging
 
 from threading import RLock
-from os.path import exists, join, relpath
+from os.path import join, relpath
+
+from sortedcontainers import SortedList
 
 from common.file_path import FilePath
 from common.signal import Signal
-from common.constants import FILE_LIST_COUNT_LIMIT, FILE_LINK_SUFFIX
-from common.path_converter import PathConverter
+from common.constants import FILE_LIST_COUNT_LIMIT
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
 
 class FilesList(object):
+    """
+    Bounded index of most recently changed files.
+    Keeps at most store limit newest files ordered by mtime,
+    so updates cost O(log n) and getting top files costs O(K).
+    Deleted files are dropped on monitor delete events
+    instead of checking file existence on every get
+    """
     CREATE_TOLERANCE_INTERVAL = 30
 
     def __init__(self, storage, root):
         super(FilesList, self).__init__()
         self._storage = storage
-        self._pc = PathConverter(root)
 
+        # rel_path -> (rel_path, is_dir, mtime, was_updated)
         self._files_dict = dict()
+        # (-mtime, rel_path), newest first
+        self._index = SortedList()
         self._store_limit = FILE_LIST_COUNT_LIMIT * 10
 
         self.file_list_changed = Signal()
@@ -53,72 +63,54 @@ class FilesList(object):
             return
 
         with self._lock:
-            self._files_dict[rel_path] = (rel_path, is_dir, mtime, False)
-        self.file_list_changed.emit()
+            changed = self._put((rel_path, is_dir, mtime, False))
+        if changed:
+            self.file_list_changed.emit()
 
     def on_file_deleted(self, rel_path):
         with self._lock:
-            for file_path in self._files_dict.copy():
-                if FilePath(file_path) in FilePath(rel_path) or \
-                                file_path == rel_path:
-                    self._files_dict.pop(file_path)
-        self.file_list_changed.emit()
+            changed = self._pop(rel_path) is not None
+            for file_path in self._get_nested(rel_path):
+                self._pop(file_path)
+                changed = True
+        if changed:
+            self.file_list_changed.emit()
 
     def on_file_moved(self, old_path, new_path):
         with self._lock:
-            for file_path in self._files_dict.copy():
-                if FilePath(file_path) in FilePath(old_path) or \
-                        file_path == old_path:
-                    path = str(FilePath(join(new_path, relpath(file_path, old_path))))
-                    old_file = self._files_dict.pop(file_path)
-                    self._files_dict[path] = (
-                        path, old_file[1], old_file[2], old_file[3])
-
-        self.file_list_changed.emit()
+            moved = [self._pop(file_path)
+                     for file_path in self._get_nested(old_path)]
+            old_file = self._pop(old_path)
+            if old_file:
+                moved.append(old_file)
+            for old_file in moved:
+                path = str(FilePath(
+                    join(new_path, relpath(old_file[0], old_path))))
+                self._put((path, old_file[1], old_file[2], old_file[3]))
+
+        if moved:
+            self.file_list_changed.emit()
 
     def on_file_modified(self, rel_path, mtime):
         with self._lock:
-            old_mtime = self._files_dict.get(rel_path, ('', False, 0, False))[2]
+            old_mtime = self._files_dict.get(
+                rel_path, ('', False, 0, False))[2]
             modified = (mtime - old_mtime) > self.CREATE_TOLERANCE_INTERVAL
             # can't modify directory
-            self._files_dict[rel_path] = (rel_path, False, mtime, modified)
-        self.file_list_changed.emit()
+            changed = self._put((rel_path, False, mtime, modified))
+        if changed:
+            self.file_list_changed.emit()
 
     def on_idle(self):
         self._clear_old()
 
     def get(self):
-        files_to_return = []
-        offset = 0
-        while len(files_to_return) < FILE_LIST_COUNT_LIMIT:
-            with self._lock:
-                files = list(self._files_dict.values())
-            # sort by mtime
-            files.sort(key=lambda f: f[2], reverse=True)
-
-            for item in files:
-                path = item[0]
-
-                abs_path = self._pc.create_abspath(path)
-                if exists(abs_path) or exists(abs_path + FILE_LINK_SUFFIX):
-                    files_to_return.append(item)
-                    if len(files_to_return) >= FILE_LIST_COUNT_LIMIT:
-                        break
-                else:
-                    logger.warning("File does not exists: %s", path)
-                    with self._lock:
-                        try:
-                            self._files_dict.pop(path)
-                        except KeyError:
-                            pass
-
-            if len(self._files_dict) < FILE_LIST_COUNT_LIMIT * 2:
-                loaded = self._load_from_storage(offset)
-                offset += self._store_limit
-                if loaded:
-                    files_to_return = []
-                else:
-                    break
+        with self._lock:
+            if len(self._index) < FILE_LIST_COUNT_LIMIT:
+                self._load_from_storage()
+            files_to_return = [
+                self._files_dict[path] for _, path
+                in self._index.islice(0, FILE_LIST_COUNT_LIMIT)]
 
         if self._last_sent is None or self._last_sent != files_to_return:
             self._last_sent = files_to_return
@@ -129,6 +121,7 @@ class FilesList(object):
     def clear(self):
         with self._lock:
             self._files_dict.clear()
+            self._index.clear()
 
     def start(self):
         self._load_from_storage()
@@ -138,21 +131,43 @@ class FilesList(object):
         with self._lock:
             self.clear()
 
+    def _put(self, file):
+        """
+        Adds or replaces file in index and drops oldest files above limit
+
+        @param file (rel_path, is_dir, mtime, was_updated) [tuple]
+        @return whether file is in index after adding [bool]
+        """
+        rel_path = file[0]
+        self._pop(rel_path)
+        self._files_dict[rel_path] = file
+        self._index.add((-file[2], rel_path))
+        self._clear_old()
+        return rel_path in self._files_dict
+
+    def _pop(self, rel_path):
+        file = self._files_dict.pop(rel_path, None)
+        if file:
+            self._index.remove((-file[2], rel_path))
+        return file
+
+    def _get_nested(self, rel_path):
+        # index is bounded by store limit, so scan is cheap
+        folder = FilePath(rel_path)
+        return [file_path for file_path in self._files_dict
+                if file_path != rel_path and FilePath(file_path) in folder]
+
     def _clear_old(self):
         with self._lock:
-            if len(self._files_dict) <= self._store_limit:
-                return
-
-            files = list(self._files_dict.values())
-            files.sort(key=lambda f: f[2], reverse=True)
-            self._files_dict = {f[0]: f for f in files[:self._store_limit]}
+            while len(self._index) > self._store_limit:
+                _, rel_path = self._index.pop()
+                self._files_dict.pop(rel_path, None)
 
     def _load_from_storage(self, offset=0):
         files_stored = self._storage.get_last_files(self._store_limit, offset)
-        stored_dict = {file.relative_path:
-                           (file.relative_path, file.is_folder,
-                            file.mtime, file.was_updated)
-                       for file in files_stored}
         with self._lock:
-            self._files_dict.update(stored_dict)
+            for file in files_stored:
+                if file.relative_path not in self._files_dict:
+                    self._put((file.relative_path, file.is_folder,
+                               file.mtime, file.was_updated))
         return len(files_stored)
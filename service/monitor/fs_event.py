@@ -20,15 +20,25 @@
 #   
 ###############################################################################
 import time
-import threading
+from itertools import count
 
 from common.constants import event_names
 from common.file_path import FilePath
 
 
 class FsEvent(object):
-    count = 0
-    _lock = threading.RLock()
+    # millions of events may be queued on big tree changes,
+    # so instances have no __dict__
+    __slots__ = (
+        'id', 'event_type', 'src', 'dst', 'is_dir', 'time', 'is_offline',
+        'quiet', 'file', 'actual_path', 'old_hash', 'old_signature',
+        'new_hash', 'new_signature', 'patch', 'rev_patch',
+        'file_recent_copy', 'file_synced_copy', 'file_size', 'mtime',
+        'old_mtime', 'old_size', 'in_storage', 'is_link',
+    )
+
+    # next() of itertools.count is atomic, no lock needed
+    _ids = count(1)
 
     def __init__(self,
                  event_type,
@@ -39,12 +49,7 @@ class FsEvent(object):
                  quiet=False,
                  actual_path=None,
                  event_time=None):
-        super(FsEvent, self).__init__()
-
-        with self._lock:
-            FsEvent.count += 1
-            self.id = FsEvent.count
-
+        self.id = next(FsEvent._ids)
         self.event_type = event_type
         self.src = FilePath(src)
         self.dst = FilePath(dst) if dst else None
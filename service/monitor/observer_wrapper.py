@@ -28,7 +28,7 @@ from PySide2.QtCore import Signal as pyqtSignal, QObject
 from watchdog.observers import Observer
 
 from common.file_path import FilePath
-from common.utils import get_files_dir_list
+from common.tree_walker import walk_tree
 from common.constants import DELETE, CREATE, MODIFY, event_names, \
     FILE_LINK_SUFFIX
 from service.monitor.fs_event import FsEvent
@@ -196,17 +196,24 @@ class ObserverWrapper(QObject):
         logger.debug("Known files: %s", len(known_files))
 
         logger.debug("Obtaining actual files and folders from filesystem...")
-        actual_folders, actual_files = get_files_dir_list(
-            root,
-            exclude_dirs=self._root_handlers[root][0].hidden_dirs,
-            exclude_files=self._root_handlers[root][0].hidden_files)
+        actual_folders = set()
+        actual_files = set()
+        for batch in walk_tree(
+                FilePath(root).longpath,
+                exclude_dirs=self._root_handlers[root][0].hidden_dirs,
+                exclude_files=self._root_handlers[root][0].hidden_files,
+                is_active=lambda: self._active and self._started):
+            for path, is_dir, _ in batch:
+                if is_dir:
+                    actual_folders.add(FilePath(path))
+                else:
+                    actual_files.add(FilePath(path))
         if not self._active or not self._started:
             return
         logger.debug("Actual folders: %s", len(actual_folders))
         logger.debug("Actual files: %s", len(actual_files))
 
-        actual_files = set(map(FilePath, actual_files)) - self._special_files
-        actual_folders = set(map(FilePath, actual_folders))
+        actual_files -= self._special_files
 
         if not self._active or not self._started:
             return
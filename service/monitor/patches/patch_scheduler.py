@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import heapq
+import logging
+from contextlib import contextmanager
+from itertools import count
+from threading import Condition, Semaphore
+from time import perf_counter
+
+from common.async_utils import run_daemon
+from common.metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+SMALL = 'small'
+BIG = 'big'
+
+_queue_latency = {
+    size_class: histogram(
+        'patch_queue_seconds', 'Time patch job waited in queue',
+        labels={'size_class': size_class})
+    for size_class in (SMALL, BIG)}
+_queue_length = {
+    size_class: gauge(
+        'patch_queue_length', 'Patch jobs waiting in queue',
+        labels={'size_class': size_class})
+    for size_class in (SMALL, BIG)}
+_superseded = counter(
+    'patch_jobs_superseded',
+    'Patch jobs cancelled because file version was superseded')
+
+
+class PatchScheduler(object):
+    """
+    Pool of patch workers with separate lanes for small and big files,
+    so a huge file does not hold patches of small files queued behind it.
+    Inside a lane smaller jobs go first. Job for patch uuid is queued once,
+    job queued again while running is rerun after it finishes.
+    Jobs queued with file key are cancelled when job for another version
+    of the same file is queued.
+    Number of jobs doing disk I/O simultaneously is limited by io_slot()
+    """
+
+    def __init__(self, process, small_workers=2, big_workers=1,
+                 max_io_jobs=2, big_size=64 * 1024 * 1024):
+        """
+        @param process Callable processing job (patch) in worker thread
+        @param small_workers Number of workers for small files
+        @param big_workers Number of workers for big files
+        @param max_io_jobs Max number of jobs doing disk I/O at once
+        @param big_size Min file size of big files lane [bytes]
+        """
+        self._process = process
+        self._workers_count = {SMALL: small_workers, BIG: big_workers}
+        self._big_size = big_size
+        self._io_semaphore = Semaphore(max_io_jobs)
+
+        self._condition = Condition()
+        self._lanes = {SMALL: [], BIG: []}
+        self._sequence = count()
+        # uuid <> (size class, size, sequence, queued time, job)
+        self._pending = dict()
+        self._running = set()
+        self._rerun = dict()
+        self._cancelled = set()
+        # file key <> (version, uuids of version jobs)
+        self._versions = dict()
+        self._uuid_keys = dict()
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        with self._condition:
+            self._stopping = False
+        for size_class, workers_count in self._workers_count.items():
+            for _ in range(workers_count):
+                self._threads.append(self._worker(size_class))
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._condition:
+            self._lanes = {SMALL: [], BIG: []}
+            self._pending.clear()
+            self._rerun.clear()
+            self._cancelled.clear()
+            self._versions.clear()
+            self._uuid_keys.clear()
+            for size_class in self._lanes:
+                _queue_length[size_class].set(0)
+
+    def put(self, uuid, job, size, key=None, version=None):
+        """
+        Queues job for patch uuid
+
+        @param uuid Patch uuid [str]
+        @param job Object passed to process callable
+        @param size Size of file patch is created for [bytes]
+        @param key Key of file patch is created for
+        @param version Version of file patch is created for
+        """
+        size = size or 0
+        with self._condition:
+            if key is not None:
+                self._set_version(uuid, key, version)
+            self._cancelled.discard(uuid)
+            if uuid in self._running:
+                self._rerun[uuid] = (job, size)
+                return
+            if uuid in self._pending:
+                return
+
+            size_class = BIG if size >= self._big_size else SMALL
+            sequence = next(self._sequence)
+            self._pending[uuid] = (size_class, sequence, perf_counter())
+            heapq.heappush(
+                self._lanes[size_class], (size, sequence, uuid, job))
+            _queue_length[size_class].inc()
+            self._condition.notify_all()
+
+    def cancel(self, uuid):
+        """
+        Drops queued job for patch uuid.
+        Running job is not interrupted, but is_cancelled()
+        returns True for it until job for uuid is queued again
+        """
+        with self._condition:
+            self._cancel(uuid)
+            self._release_version(uuid)
+
+    def _cancel(self, uuid):
+        self._rerun.pop(uuid, None)
+        pending = self._pending.pop(uuid, None)
+        if pending:
+            _queue_length[pending[0]].dec()
+        if uuid in self._running:
+            self._cancelled.add(uuid)
+        return bool(pending) or uuid in self._running
+
+    def _set_version(self, uuid, key, version):
+        if self._uuid_keys.get(uuid, key) != key:
+            self._release_version(uuid)
+        current = self._versions.get(key)
+        if current and current[0] != version:
+            for superseded in current[1] - {uuid}:
+                self._uuid_keys.pop(superseded, None)
+                if self._cancel(superseded):
+                    _superseded.inc()
+                    logger.debug("Patch job %s superseded by %s",
+                                 superseded, uuid)
+            current = None
+        if not current:
+            current = (version, set())
+            self._versions[key] = current
+        current[1].add(uuid)
+        self._uuid_keys[uuid] = key
+
+    def _release_version(self, uuid):
+        key = self._uuid_keys.pop(uuid, None)
+        current = self._versions.get(key)
+        if not current:
+            return
+        current[1].discard(uuid)
+        if not current[1]:
+            del self._versions[key]
+
+    def is_cancelled(self, uuid):
+        with self._condition:
+            return uuid in self._cancelled
+
+    @contextmanager
+    def io_slot(self):
+        with self._io_semaphore:
+            yield
+
+    def _get_job(self, size_class):
+        lane = self._lanes[size_class]
+        with self._condition:
+            while True:
+                while not lane and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return None, None
+
+                _, sequence, uuid, job = heapq.heappop(lane)
+                pending = self._pending.get(uuid)
+                if not pending or pending[1] != sequence:
+                    # cancelled
+                    continue
+
+                del self._pending[uuid]
+                _queue_length[size_class].dec()
+                _queue_latency[size_class].observe(
+                    perf_counter() - pending[2])
+                self._running.add(uuid)
+                return uuid, job
+
+    def _finish_job(self, uuid):
+        with self._condition:
+            self._running.discard(uuid)
+            self._cancelled.discard(uuid)
+            rerun = self._rerun.pop(uuid, None)
+            if not rerun:
+                self._release_version(uuid)
+        if rerun:
+            self.put(uuid, *rerun)
+
+    @run_daemon
+    def _worker(self, size_class):
+        while True:
+            uuid, job = self._get_job(size_class)
+            if uuid is None:
+                break
+
+            try:
+                self._process(job)
+            except Exception as e:
+                logger.error("Patch job %s failed (%s)", uuid, e)
+            finally:
+                self._finish_job(uuid)
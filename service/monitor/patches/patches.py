@@ -18,7 +18,6 @@
 #   
 ###############################################################################
 import logging
-from queue import Queue
 from pickle import load
 
 from contextlib import contextmanager
@@ -47,10 +46,12 @@ from common.constants import \
     DOWNLOAD_PRIORITY_WANTED_DIRECT_PATCH, \
     DOWNLOAD_PRIORITY_REVERSED_PATCH, \
     DOWNLOAD_PRIORITY_DIRECT_PATCH, \
-    RETRY_DOWNLOAD_TIMEOUT
+    RETRY_DOWNLOAD_TIMEOUT, \
+    PATCH_CHUNKING_FIXED, PATCH_CHUNKING_CDC, PATCH_FORMAT_VERSION_CDC
 from common.file_path import FilePath
 
 from .patch import Base, Patch
+from .patch_scheduler import PatchScheduler
 from db_migrations import upgrade_db, stamp_db
 
 
@@ -67,7 +68,8 @@ class Patches(object):
                  tracker=None,
                  retry_download_timeout=RETRY_DOWNLOAD_TIMEOUT,
                  db_file_created_cb=None,
-                 extended_logging=True, events_db=None):
+                 extended_logging=True, events_db=None,
+                 chunking=PATCH_CHUNKING_FIXED):
         self.possibly_sync_folder_is_removed = Signal()
         self.patch_created = AsyncSignal(str,  # patch uuid
                                          int)  # patch size
@@ -80,6 +82,9 @@ class Patches(object):
         self._tracker = tracker
         self._retry_download_timeout = retry_download_timeout
         self._events_db = events_db
+        self._chunking = chunking
+        # CDC patches are created only when all known nodes support them
+        self._cdc_allowed = False
         self._retry_download_timer = None
 
         self._started = False
@@ -121,7 +126,7 @@ class Patches(object):
 
         self._lock = RLock()
         self._patch_existance_lock = RLock()
-        self._patches_queue = Queue()
+        self._scheduler = PatchScheduler(self._check_patch)
         self._thread = None
 
         self._extended_logging = extended_logging
@@ -134,7 +139,8 @@ class Patches(object):
         self._last_changes = dict()
 
     def start(self):
-        self._thread = self._patches_queue_processor()
+        self._scheduler.start()
+        self._thread = self._check_all_patches()
         self._started = True
         self._patches_on_registration = set()
         logger.debug("Patches started")
@@ -145,11 +151,11 @@ class Patches(object):
 
         self._started = False
         self._patches_on_registration.clear()
-        self._patches_queue.put(None)  # stop _patches_queue
 
         if self._thread:
             self._thread.join()
             self._thread = None
+        self._scheduler.stop()
         logger.debug("Patches stopped")
 
     def set_download_manager(self, download_manager):
@@ -192,7 +198,7 @@ class Patches(object):
 
     def add_direct_patch(
             self, uuid, new_hash, old_hash, size=None, active=True,
-            reason="", postponed=False):
+            reason="", postponed=False, file_uuid=None):
         with self.create_session() as session:
             patch = self._get_patch(uuid)
             if patch is None:
@@ -219,11 +225,12 @@ class Patches(object):
                                    patch, postponed, exists(patch_path),
                                    reason)
 
-        self._patches_queue.put(patch)
+        # patch of new file version supersedes ones of previous version
+        self._queue_patch(patch, file_uuid, new_hash)
 
     def add_reverse_patch(
             self, uuid, new_hash, old_hash, size=None, active=True,
-            reason="", postponed=False):
+            reason="", postponed=False, file_uuid=None):
         with self.create_session() as session:
             patch = self._get_patch(uuid)
             if patch is None:
@@ -252,7 +259,7 @@ class Patches(object):
                                    reason)
 
         logger.debug("Session ended")
-        self._patches_queue.put(patch)
+        self._queue_patch(patch, file_uuid, old_hash)
 
     def remove_direct_patch(self, uuid, reason="", postponed=False):
         with self.create_session() as session:
@@ -368,7 +375,7 @@ class Patches(object):
 
             patch.size = size
             patch = session.merge(patch)
-        self._patches_queue.put(patch)
+        self._queue_patch(patch)
 
     def activate_patch(self, uuid):
         with self.create_session() as session:
@@ -377,7 +384,7 @@ class Patches(object):
                 return
             patch.active = True
             patch = session.merge(patch)
-        self._patches_queue.put(patch)
+        self._queue_patch(patch)
 
     def get_patch_path(self, uuid):
         return join(get_patches_dir(self._root), uuid)
@@ -391,13 +398,14 @@ class Patches(object):
         return stat(patch_path).st_size if exists(patch_path) else 0
 
     @run_daemon
-    def _patches_queue_processor(self):
+    def _check_all_patches(self):
         self.check_patches(only_not_exist=False)
-        while True:
-            patch = self._patches_queue.get(True)
-            if patch is None:
-                break
-            self._check_patch(patch)
+
+    def _queue_patch(self, patch, file_uuid=None, file_hash=None):
+        # copy may be packed into chunk store
+        size = self._copies_storage.get_copy_size(patch.new_hash)
+        self._scheduler.put(
+            patch.uuid, patch, size, key=file_uuid, version=file_hash)
 
     def check_patches(self, only_not_exist=True):
         with self.create_session() as session:
@@ -407,7 +415,7 @@ class Patches(object):
                 patches = patches.filter(Patch.exist == 0)
             patches = patches.all()
         for patch in patches:
-            self._patches_queue.put(patch)
+            self._queue_patch(patch)
 
     def clean(self, with_files=True):
         with self.create_session() as session:
@@ -447,27 +455,33 @@ class Patches(object):
             if patch.uuid in self._patches_on_registration:
                 return
 
-            if not self.patch_exists(patch.uuid):
-                if patch.exist:
-                    self._mark_patch_exist(patch, False)
-                    # to compensate latter referencies removal
-                    self._add_copies_referencies(
-                        patch.uuid, patch.old_hash, patch.new_hash,
-                        False, "_check_patch")
-                try:
-                    self._create_patch(patch)
-                    if self._download_manager:
-                        self._download_manager.cancel_download(patch.uuid)
-                except Exception as e:
-                    if not patch.size:
-                        logger.debug("Waiting for patch update. "
-                                     "Exception %s", e)
-                        return  # wait for patch to update
-                    self._download_patch(patch)
-            elif not patch.exist:
-                patch.size = self.get_patch_size(patch.uuid)
-                self._patches_on_registration.add(patch.uuid)
-                self.patch_created(patch.uuid, patch.size)
+            if self.patch_exists(patch.uuid):
+                if not patch.exist:
+                    patch.size = self.get_patch_size(patch.uuid)
+                    self._patches_on_registration.add(patch.uuid)
+                    self.patch_created(patch.uuid, patch.size)
+                return
+
+            if patch.exist:
+                self._mark_patch_exist(patch, False)
+                # to compensate latter referencies removal
+                self._add_copies_referencies(
+                    patch.uuid, patch.old_hash, patch.new_hash,
+                    False, "_check_patch")
+
+        # patches are created concurrently by scheduler workers,
+        # scheduler never runs two jobs for the same patch
+        try:
+            with self._scheduler.io_slot():
+                self._create_patch(patch)
+            if self._download_manager:
+                self._download_manager.cancel_download(patch.uuid)
+        except Exception as e:
+            if not patch.size:
+                logger.debug("Waiting for patch update. "
+                             "Exception %s", e)
+                return  # wait for patch to update
+            self._download_patch(patch)
 
     def on_patch_registered(self, uuid):
         if not self._started:
@@ -500,16 +514,38 @@ class Patches(object):
 
     def _create_patch(self, patch):
         new_copy = self._get_copy(patch.new_hash)
-        old_signature = self._get_signature(patch.old_hash) \
-            if patch.old_hash and patch.old_hash != EMPTY_FILE_HASH else None
-        new_signature = self._get_signature(patch.new_hash)
         if self._tracker:
             start_time = time()
             file_size = getsize(new_copy)
-        patch_info = Rsync.create_patch(
-            uuid=patch.uuid, modify_file=new_copy, root=self._root,
-            old_blocks_hashes=old_signature, new_blocks_hashes=new_signature,
-            old_file_hash=patch.old_hash, new_file_hash=patch.new_hash)
+        old_copy = self._get_copy(patch.old_hash) \
+            if patch.old_hash and patch.old_hash != EMPTY_FILE_HASH else None
+        def is_cancelled():
+            return self._scheduler.is_cancelled(patch.uuid)
+
+        try:
+            if self._chunking == PATCH_CHUNKING_CDC and \
+                    self._cdc_allowed and old_copy and exists(old_copy):
+                patch_info = Rsync.create_cdc_patch(
+                    uuid=patch.uuid, modify_file=new_copy, root=self._root,
+                    old_file=old_copy,
+                    old_file_hash=patch.old_hash,
+                    new_file_hash=patch.new_hash,
+                    is_cancelled=is_cancelled)
+            else:
+                old_signature = self._get_signature(patch.old_hash) \
+                    if old_copy else None
+                new_signature = self._get_signature(patch.new_hash)
+                patch_info = Rsync.create_patch(
+                    uuid=patch.uuid, modify_file=new_copy, root=self._root,
+                    old_blocks_hashes=old_signature,
+                    new_blocks_hashes=new_signature,
+                    old_file_hash=patch.old_hash,
+                    new_file_hash=patch.new_hash,
+                    is_cancelled=is_cancelled)
+        except Rsync.Cancelled:
+            # patch was deleted while being created
+            logger.debug("Patch %s creation cancelled", patch.uuid)
+            return
         patch_size = patch_info['archive_size']
         if not patch_size or not self.patch_exists(patch.uuid):
             return
@@ -521,6 +557,7 @@ class Patches(object):
         self.patch_created(patch.uuid, patch_size)
 
     def _get_copy(self, hash):
+        self._copies_storage.ensure_copy_file(hash)
         copy_path = join(get_copies_dir(self._root), hash)
         return copy_path
 
@@ -576,7 +613,7 @@ class Patches(object):
             return
         if patch.exist:
             return
-        self._patches_queue.put(patch)
+        self._queue_patch(patch)
 
     def _on_patch_download_failure(self, task):
         patch = self._get_patch(task.id)
@@ -591,6 +628,7 @@ class Patches(object):
         self._failed_downloads.add(patch)
 
     def _delete_patch(self, uuid, silently=False):
+        self._scheduler.cancel(uuid)
         patch_path = join(
             get_patches_dir(self._root), uuid)
         try:
@@ -606,8 +644,23 @@ class Patches(object):
             self.patch_deleted.emit(uuid)
 
     def on_online_nodes_changed(self, nodes):
+        self._cdc_allowed = self._is_cdc_supported(nodes)
         self._redownload()
 
+    @staticmethod
+    def _is_cdc_supported(nodes):
+        """
+        Checks all known nodes advertised patch format version 2 support
+
+        @param nodes Nodes information in the form {node_id: node_info} [dict]
+        @return CDC patches allowed flag [bool]
+        """
+        node_infos = [info for info in nodes.values()
+                      if info.get('type', 'node') == 'node']
+        return bool(node_infos) and all(
+            PATCH_FORMAT_VERSION_CDC in info.get('patch_formats', ())
+            for info in node_infos)
+
     def _redownload(self):
         self._retry_download_timer = None
         if not self._failed_downloads:
@@ -617,7 +670,7 @@ class Patches(object):
         failed_downloads = self._failed_downloads
         self._failed_downloads = set()
         for patch in failed_downloads:
-            self._patches_queue.put(patch)
+            self._queue_patch(patch)
 
     def db_file_exists(self):
         return exists(self._db_file) and getsize(self._db_file) > 0
@@ -48,11 +48,13 @@ class QuietProcessor(object):
                  root,
                  storage,
                  path_converter,
-                 exceptions):
+                 exceptions,
+                 copies_storage=None):
         self._root = root
         self._storage = storage
         self._path_converter = path_converter
         self._exceptions = exceptions
+        self._copies_storage = copies_storage
 
         self._tmp_id = 0
         self._tmp_id_lock = RLock()
@@ -322,7 +324,10 @@ class QuietProcessor(object):
 
     def make_copy_from_existing_files(self, copy_hash):
         copy_full_path = join(get_copies_dir(self._root), copy_hash)
-        if exists(copy_full_path):
+        if self._copies_storage is not None:
+            if self._copies_storage.ensure_copy_file(copy_hash):
+                return True
+        elif exists(copy_full_path):
             return True
 
         tmp_full_path = self._get_temp_path(copy_full_path)
@@ -25,6 +25,7 @@ import os
 from os import path as op
 
 import shutil
+from contextlib import contextmanager
 
 # import time
 from os.path import join, exists
@@ -34,18 +35,63 @@ SortedDict.iteritems = SortedDict.items
 
 from common.utils import remove_file, make_dirs, \
     get_patches_dir, get_copies_dir, copy_file, generate_uuid
-from common.constants import SIGNATURE_BLOCK_SIZE
+from common.constants import SIGNATURE_BLOCK_SIZE, \
+    PATCH_FORMAT_VERSION_FIXED, PATCH_FORMAT_VERSION_CDC, \
+    PATCH_FORMAT_VERSIONS_SUPPORTED, \
+    CDC_MIN_CHUNK_SIZE, CDC_AVG_CHUNK_SIZE, CDC_MAX_CHUNK_SIZE
 
 # Setup logging
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+_CDC_MEDIAN = sorted(md5(bytes((i,))).digest() for i in range(256))[128]
+
+# Translation table splitting byte values into two random (but stable)
+# equal halves, content defined chunk ends with run of bytes from one half
+_CDC_TABLE = bytes(
+    int(md5(bytes((i,))).digest() < _CDC_MEDIAN) for i in range(256))
+
 
 class Rsync:
 
     class AlreadyPatched(Exception):
         pass
 
+    class Cancelled(Exception):
+        pass
+
+    # blocks or chunks processed between cancellation checks
+    CANCEL_CHECK_INTERVAL = 256
+
+    @staticmethod
+    def _patch_filename_getter(root, old_file_hash, new_file_hash):
+        # same patch could be created by several workers at once,
+        # so temporary files names are unique for each creation
+        prefix = os.path.join(
+            get_patches_dir(root),
+            'patches',
+            '{}{}_{}'.format(old_file_hash, new_file_hash, generate_uuid()))
+
+        def get_patch_filename(suffix):
+            return prefix + suffix
+
+        return get_patch_filename
+
+    @classmethod
+    def _check_cancelled(cls, is_cancelled):
+        if is_cancelled and is_cancelled():
+            raise cls.Cancelled()
+
+    @staticmethod
+    @contextmanager
+    def _removed_on_cancel(*files):
+        try:
+            yield
+        except Rsync.Cancelled:
+            for filename in files:
+                remove_file(filename)
+            raise
+
     @staticmethod
     def hash_from_block_checksum(block_checksum):
         hasher = md5()
@@ -94,22 +140,23 @@ class Rsync:
             old_file_hash=None,
             new_file_hash=None,
             uuid=None,
-            blocksize=SIGNATURE_BLOCK_SIZE):
-
-        def get_patch_filename(suffix):
-            return os.path.join(
-                get_patches_dir(root),
-                'patches',
-                str(old_file_hash) +
-                str(new_file_hash) +
-                suffix)
+            blocksize=SIGNATURE_BLOCK_SIZE,
+            is_cancelled=None):
+        """
+        Creates patch (format version 1) of fixed size blocks.
+        is_cancelled is checked between stages and while blocks are
+        processed, Rsync.Cancelled is raised if it returns True
+        """
 
+        get_patch_filename = cls._patch_filename_getter(
+            root, old_file_hash, new_file_hash)
         patch_data_file = get_patch_filename('.patch_data')
 
         # Create directory structure to store patch file
         make_dirs(patch_data_file)
 
-        with open(modify_file, 'rb') as handle_file, \
+        with cls._removed_on_cancel(patch_data_file), \
+                open(modify_file, 'rb') as handle_file, \
                 open(patch_data_file, 'wb') as data_file:
             blocks = SortedDict()
             patch = dict()
@@ -123,7 +170,10 @@ class Rsync:
             if new_blocks_hashes is None:
                 new_blocks_hashes = cls.block_checksum(
                     filepath=modify_file, blocksize=blocksize)
-            for new_offset, new_hash in new_blocks_hashes.items():
+            for i, (new_offset, new_hash) in enumerate(
+                    new_blocks_hashes.items()):
+                if not i % cls.CANCEL_CHECK_INTERVAL:
+                    cls._check_cancelled(is_cancelled)
                 clone_block_offset = new_blocks_hashes_search.get(
                     new_hash, None)
                 from_patch = clone_block_offset is not None
@@ -160,10 +210,162 @@ class Rsync:
         patch['size'] = info.st_size
         patch['blocksize'] = blocksize
 
-        patch_info_file = get_patch_filename('.patch_info')
+        return cls._pack_patch(
+            patch, patch_data_file, get_patch_filename, root, uuid,
+            is_cancelled)
+
+    @staticmethod
+    def _cdc_cut_point(marks, pos, min_size, max_size, anchor):
+        """
+        Finds end of chunk starting at pos
+
+        @param marks Data translated with _CDC_TABLE [bytes]
+        @param anchor Run of marks ending chunk [bytes]
+        @return Chunk size [int]
+        """
+        data_size = len(marks) - pos
+        if data_size <= min_size:
+            return data_size
+
+        end = pos + min(data_size, max_size)
+        # run is searched in C by bytes.find, not byte by byte
+        found = marks.find(
+            anchor, max(pos + min_size + 1 - len(anchor), pos), end)
+        if found < 0:
+            return end - pos
+        return found + len(anchor) - pos
+
+    @classmethod
+    def content_defined_chunks(cls, filepath,
+                               min_size=CDC_MIN_CHUNK_SIZE,
+                               avg_size=CDC_AVG_CHUNK_SIZE,
+                               max_size=CDC_MAX_CHUNK_SIZE):
+        """
+        Splits file into chunks with content defined boundaries,
+        so inserts and deletes shift only chunks around the edit.
+        Chunk ends after min_size at first run of anchor_len bytes from
+        one half of byte values, run of n random bits is expected
+        every 2 ** (n + 1) bytes
+
+        Returns:
+            SortedDict: offset -> (size, md5 hash)
+        """
+        anchor_len = max((avg_size - min_size).bit_length() - 2, 1)
+        anchor = b'\x01' * anchor_len
+        read_size = max_size * 4
+
+        chunks = SortedDict()
+        offset = 0
+        with open(filepath, 'rb') as f:
+            buf = f.read(read_size)
+            marks = buf.translate(_CDC_TABLE)
+            pos = 0
+            while True:
+                if len(buf) - pos < max_size:
+                    data = f.read(read_size)
+                    buf = buf[pos:] + data
+                    marks = marks[pos:] + data.translate(_CDC_TABLE)
+                    pos = 0
+                if pos >= len(buf):
+                    break
+                size = cls._cdc_cut_point(
+                    marks, pos, min_size, max_size, anchor)
+                chunks[offset] = (
+                    size, md5(buf[pos:pos + size]).hexdigest())
+                offset += size
+                pos += size
+        return chunks
+
+    @classmethod
+    def create_cdc_patch(
+            cls, modify_file, root,
+            old_file=None,
+            old_file_hash=None,
+            new_file_hash=None,
+            uuid=None,
+            is_cancelled=None):
+        """
+        Creates patch (format version 2) using content defined chunking.
+        Chunks of new file found anywhere in old file (or earlier
+        in patch data) are referenced instead of being sent,
+        so moved and shifted data is not resent.
+        old_file is a full copy of old file version, if available.
+        is_cancelled is checked between stages and while chunks are
+        processed, Rsync.Cancelled is raised if it returns True
+        """
+
+        get_patch_filename = cls._patch_filename_getter(
+            root, old_file_hash, new_file_hash)
+        patch_data_file = get_patch_filename('.patch_data')
 
-        with open(patch_info_file, 'w') as info_file:
-            json.dump(patch, info_file)
+        # Create directory structure to store patch file
+        make_dirs(patch_data_file)
+
+        old_chunks_search = dict()
+        if old_file and op.exists(old_file):
+            old_chunks = cls.content_defined_chunks(old_file)
+            old_chunks_search = dict(
+                (chunk_hash, (offset, size))
+                for offset, (size, chunk_hash) in old_chunks.items())
+            cls._check_cancelled(is_cancelled)
+
+        new_chunks = cls.content_defined_chunks(modify_file)
+        cls._check_cancelled(is_cancelled)
+        with cls._removed_on_cancel(patch_data_file), \
+                open(modify_file, 'rb') as handle_file, \
+                open(patch_data_file, 'wb') as data_file:
+            chunks = SortedDict()
+            data_chunks_search = dict()
+            for i, (new_offset, (size, chunk_hash)) in enumerate(
+                    new_chunks.items()):
+                if not i % cls.CANCEL_CHECK_INTERVAL:
+                    cls._check_cancelled(is_cancelled)
+                if chunk_hash in data_chunks_search:
+                    chunks[new_offset] = dict(
+                        source='patch',
+                        hash=chunk_hash,
+                        offset=data_chunks_search[chunk_hash],
+                        size=size)
+                elif chunk_hash in old_chunks_search:
+                    old_offset, _ = old_chunks_search[chunk_hash]
+                    chunks[new_offset] = dict(
+                        source='old',
+                        hash=chunk_hash,
+                        offset=old_offset,
+                        size=size)
+                else:
+                    data_file_offset = data_file.tell()
+                    data_file.write(cls.get_data(
+                        handle=handle_file, size=size, offset=new_offset))
+                    chunks[new_offset] = dict(
+                        source='new',
+                        hash=chunk_hash,
+                        offset=data_file_offset,
+                        size=size)
+                    data_chunks_search[chunk_hash] = data_file_offset
+
+        if new_file_hash is None:
+            new_file_hash = Rsync.hash_from_block_checksum(
+                cls.block_checksum(modify_file))
+
+        info = cls.getfileinfo(modify_file)
+        patch = dict(
+            version=PATCH_FORMAT_VERSION_CDC,
+            old_hash=old_file_hash,
+            new_hash=new_file_hash,
+            chunks=chunks,
+            time_modify=info.st_mtime,
+            size=info.st_size,
+        )
+
+        return cls._pack_patch(
+            patch, patch_data_file, get_patch_filename, root, uuid,
+            is_cancelled)
+
+    @classmethod
+    def _pack_patch(cls, patch, patch_data_file, get_patch_filename, root,
+                    uuid, is_cancelled=None):
+        patch_info_file = get_patch_filename('.patch_info')
 
         if uuid is not None:
             patch_archive_file = op.join(
@@ -171,11 +373,18 @@ class Rsync:
         else:
             patch_archive_file = get_patch_filename('.patch')
 
-        with tarfile.open(patch_archive_file, 'w') as archive:
-            archive.add(patch_info_file, arcname='info')
-            archive.add(patch_data_file, arcname='data')
-        remove_file(patch_info_file)
-        remove_file(patch_data_file)
+        with cls._removed_on_cancel(patch_data_file, patch_info_file):
+            cls._check_cancelled(is_cancelled)
+            with open(patch_info_file, 'w') as info_file:
+                json.dump(patch, info_file)
+
+            with tarfile.open(patch_archive_file, 'w') as archive:
+                archive.add(patch_info_file, arcname='info')
+                archive.add(patch_data_file, arcname='data')
+            remove_file(patch_info_file)
+            remove_file(patch_data_file)
+        with cls._removed_on_cancel(patch_archive_file):
+            cls._check_cancelled(is_cancelled)
 
         patch['archive_file'] = patch_archive_file
         patch['archive_size'] = os.stat(patch_archive_file).st_size
@@ -221,6 +430,14 @@ class Rsync:
                                   'expected file hash: {}, actual: {}'
                                   .format(patch_info.get('old_hash', None),
                                           known_old_hash))
+                version = patch_info.get(
+                    'version', PATCH_FORMAT_VERSION_FIXED)
+                if version not in PATCH_FORMAT_VERSIONS_SUPPORTED:
+                    raise IOError('Unsupported patch format version: {}'
+                                  .format(version))
+                if version == PATCH_FORMAT_VERSION_CDC:
+                    return cls._accept_cdc_patch(
+                        patch_info, patch_data, unpatched_file, root)
                 return cls._accept_patch(
                     patch_info, patch_data, unpatched_file, root)
         except tarfile.TarError as e:
@@ -302,6 +519,73 @@ class Rsync:
 
         return new_hash, file_blocks_hashes, patch_info['old_hash']
 
+    @staticmethod
+    def _accept_cdc_patch(patch_info, patch_data, unpatched_file, root):
+        temp_name = os.path.join(
+            get_patches_dir(root), '.patching_' + generate_uuid())
+
+        chunks = SortedDict(
+            (int(k), v) for k, v in patch_info['chunks'].items())
+
+        # chunks are contiguous, so signature is calculated while writing
+        # instead of reading patched file again
+        file_signature = SortedDict()
+        block = b''
+        written = 0
+        source_file = None
+        if op.exists(unpatched_file):
+            source_file = open(unpatched_file, "rb")
+        try:
+            with open(temp_name, "wb") as temp_file:
+                for offset, chunk in chunks.items():
+                    chunk_offset = int(chunk['offset'])
+                    size = int(chunk['size'])
+                    if chunk['source'] == 'old':
+                        if source_file is None:
+                            raise IOError("Source file not found")
+                        source_file.seek(chunk_offset)
+                        data = source_file.read(size)
+                    else:
+                        patch_data.seek(chunk_offset)
+                        data = patch_data.read(size)
+                    if len(data) != size or offset != written:
+                        raise IOError(
+                            "Invalid patch chunk at offset {}".format(offset))
+                    temp_file.write(data)
+                    written += size
+                    block += data
+                    block_start = written - len(block)
+                    while len(block) >= SIGNATURE_BLOCK_SIZE:
+                        file_signature[block_start] = md5(
+                            block[:SIGNATURE_BLOCK_SIZE]).hexdigest()
+                        block = block[SIGNATURE_BLOCK_SIZE:]
+                        block_start += SIGNATURE_BLOCK_SIZE
+            if block:
+                file_signature[written - len(block)] = md5(block).hexdigest()
+        except Exception:
+            remove_file(temp_name)
+            raise
+        finally:
+            if source_file:
+                source_file.close()
+
+        new_hash = patch_info['new_hash']
+        actual_hash = Rsync.hash_from_block_checksum(file_signature)
+        if actual_hash != new_hash:
+            remove_file(temp_name)
+            raise IOError(
+                "Invalid patch result, expected hash: {}, actual: {}"
+                .format(new_hash, actual_hash))
+
+        logger.debug('moving patched file')
+        copy = join(get_copies_dir(root), new_hash)
+        if not exists(copy):
+            copy_file(temp_name, copy)
+        shutil.move(temp_name, unpatched_file)
+        logger.debug('moved patched file')
+
+        return new_hash, file_signature, patch_info['old_hash']
+
     @staticmethod
     def find_data_block(hash, blocks):
         for block_offset, block in blocks.items():
@@ -18,6 +18,7 @@
 #   
 ###############################################################################
 import logging
+from time import perf_counter
 
 from os.path import exists, getsize, join, relpath
 from contextlib import contextmanager
@@ -33,6 +34,7 @@ from common.file_path import FilePath
 from common.path_utils import is_contained_in, is_contained_in_dirs
 from common.signal import Signal
 from common.utils import make_dirs, is_db_or_disk_full, remove_file, benchmark
+from common.metrics import counter, histogram
 
 from .file import Base, File
 from db_migrations import upgrade_db, stamp_db
@@ -41,6 +43,12 @@ from db_migrations import upgrade_db, stamp_db
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+_session_duration = histogram(
+    'db_session_seconds', 'DB session lifetime', labels={'db': 'storage'})
+_session_rollbacks = counter(
+    'db_session_rollbacks_total', 'DB sessions rolled back',
+    labels={'db': 'storage'})
+
 
 def with_session(read_only, locked=False):
     def _with_session(func):
@@ -127,6 +135,7 @@ class Storage(object):
 
     @contextmanager
     def create_session(self, read_only=True, locked=False):
+        session_start = perf_counter()
         session = self._Session()
         session.expire_on_commit = False
         session.autoflush = False
@@ -150,6 +159,7 @@ class Storage(object):
             except Exception as e:
                 logger.warning("OperationalError, exception while trying to rollback session: %s", e)
                 pass
+            _session_rollbacks.inc()
             if is_db_or_disk_full(e):
                 self.db_or_disk_full.emit()
             else:
@@ -157,6 +167,7 @@ class Storage(object):
         except Exception as e:
             logger.warning("Exception: %s", e)
             session.rollback()
+            _session_rollbacks.inc()
             raise
         finally:
             if not read_only and locked:
@@ -164,6 +175,7 @@ class Storage(object):
                 logger.debug(
                     "session %s released lock.", hex(id(session)))
             session.close()
+            _session_duration.observe(perf_counter() - session_start)
 
     @with_session(True)
     def _get_known_paths(self, is_folder,
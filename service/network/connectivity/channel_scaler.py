@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+from time import time
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class _NodeChannels(object):
+    __slots__ = ('limit', 'bytes', 'window_start', 'baseline', 'saturated')
+
+    def __init__(self, now):
+        self.limit = 0
+        self.bytes = 0
+        self.window_start = now
+        self.baseline = None
+        self.saturated = False
+
+
+class ChannelScaler(object):
+    """
+    Adapts number of channels opened to node by throughput measured
+    while receiving data from it. One more channel is allowed while
+    adding previous one increased throughput at least MIN_GAIN times
+    """
+
+    MEASURE_INTERVAL = 5.
+    MIN_GAIN = 1.2
+    # throughput too low to be limited by channels number, bytes per second
+    MIN_THROUGHPUT = 256 * 1024
+
+    def __init__(self, max_limit):
+        self._max_limit = max_limit
+        self._nodes = dict()
+
+    def get_limit(self, node_id, base_limit):
+        node = self._nodes.get(node_id)
+        return max(base_limit, node.limit) if node else base_limit
+
+    def on_data_received(self, node_id, size, channels_count, now=None):
+        """
+        Accounts data received from node
+
+        @param node_id Node id [str]
+        @param size Data size [bytes]
+        @param channels_count Number of channels to node opened now
+        @return True if one more channel to node should be opened
+        """
+        now = time() if now is None else now
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = _NodeChannels(now)
+        node.bytes += size
+        elapsed = now - node.window_start
+        if elapsed < self.MEASURE_INTERVAL:
+            return False
+
+        throughput = node.bytes / elapsed
+        node.bytes = 0
+        node.window_start = now
+        if node.saturated or channels_count < node.limit or \
+                throughput < self.MIN_THROUGHPUT:
+            return False
+
+        if node.baseline is not None and \
+                throughput < node.baseline * self.MIN_GAIN:
+            logger.debug("Channels to node %s saturated at %s, "
+                         "throughput %.0f B/s",
+                         node_id, channels_count, throughput)
+            node.saturated = True
+            return False
+
+        if channels_count >= self._max_limit:
+            return False
+
+        node.baseline = throughput
+        node.limit = channels_count + 1
+        logger.debug("Opening channel %s to node %s, throughput %.0f B/s",
+                     node.limit, node_id, throughput)
+        return True
+
+    def reset(self, node_id):
+        self._nodes.pop(node_id, None)
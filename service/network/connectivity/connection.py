@@ -17,11 +17,20 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #   
 ###############################################################################
+from time import time
 from uuid import uuid4
 
 
 class Connection(object):
     MAX_BUFFER_CAPACITY = 16 * 1024 * 1024
+    # weight of last drain rate measurement in smoothed value
+    DRAIN_RATE_SMOOTHING = 0.3
+    # drain rate assumed for connections not measured yet, bytes per second
+    MIN_DRAIN_RATE = 64 * 1024
+    # connection is not loaded more than for this time (seconds)
+    # unless buffered amount is below LOAD_LIMIT_MIN_BUFFER
+    LOAD_LIMIT = 1.
+    LOAD_LIMIT_MIN_BUFFER = 1024 * 1024
 
     def __init__(self, node_id, connection_id=None):
         self.node_id = node_id
@@ -29,6 +38,40 @@ class Connection(object):
         self.open = False
         self.buffered_amount = 0
         self.used = False
+        self.drain_rate = 0.
+        self._buffered_amount_time = None
 
     def is_buffer_overflow(self):
-        return self.buffered_amount > self.MAX_BUFFER_CAPACITY / 2.
+        return self.buffered_amount > self.MAX_BUFFER_CAPACITY / 2. or \
+            self.buffered_amount > self.LOAD_LIMIT_MIN_BUFFER and \
+            self.get_load() > self.LOAD_LIMIT
+
+    def on_sent(self, size):
+        """
+        Accounts data passed to connection send buffer
+        """
+        self.used = True
+        self.buffered_amount += size
+
+    def set_buffered_amount(self, amount, now=None):
+        """
+        Updates buffered amount reported by connection
+        and measures rate send buffer drains with
+        """
+        now = time() if now is None else now
+        if self._buffered_amount_time is not None:
+            elapsed = now - self._buffered_amount_time
+            drained = self.buffered_amount - amount
+            if elapsed > 0 and drained > 0:
+                rate = drained / elapsed
+                self.drain_rate = rate if not self.drain_rate else \
+                    self.drain_rate + self.DRAIN_RATE_SMOOTHING * (
+                        rate - self.drain_rate)
+        self.buffered_amount = amount
+        self._buffered_amount_time = now
+
+    def get_load(self):
+        """
+        Returns estimated time (seconds) to send data already buffered
+        """
+        return self.buffered_amount / max(self.drain_rate, self.MIN_DRAIN_RATE)
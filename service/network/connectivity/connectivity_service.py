@@ -21,11 +21,10 @@ import json
 import logging
 from collections import defaultdict
 from json import JSONDecodeError
+from math import ceil
 from time import time
 from PySide2.QtCore import QObject, QTimer, Signal, Qt
-from service.network.leakybucket import LeakyBucketException
 from contextlib import contextmanager
-import random
 
 import faulthandler
 faulthandler.enable()
@@ -33,6 +32,7 @@ from webrtc import WebRtc
 
 from common.async_qt import qt_run
 from service.network.connectivity.connection import Connection
+from service.network.connectivity.channel_scaler import ChannelScaler
 from service.network.connectivity.statistic_parser import StatisticParser
 from service.network.connectivity.webrtc_listener import WebRtcListener
 from common.constants import NETWORK_WEBRTC_RELAY, NETWORK_WEBRTC_DIRECT, \
@@ -47,7 +47,6 @@ class ConnectivityService(QObject):
     CONNECT_TIMEOUT = 20 * 1000
     CONNECT_INTERVAL = 1000
     RESEND_INTERVAL = 250
-    LEAKY_INTERVAL = 15
     connected_nodes_incoming_changed = Signal(set)
     connected_nodes_outgoing_changed = Signal(set)
     node_incoming_connected = Signal(str)
@@ -109,6 +108,7 @@ class ConnectivityService(QObject):
 
         self._upload_limiter = None
         self._network_speed_calculator = network_speed_calculator
+        self._channel_scaler = ChannelScaler(self.HARD_CONNECTIONS_LIMIT)
         self._refresh_connections_timer = QTimer(self)
         self._refresh_connections_timer.setInterval(1000)
         self._refresh_connections_timer.setSingleShot(True)
@@ -243,13 +243,16 @@ class ConnectivityService(QObject):
             message = messages[0]
             message_len = len(message)
             if self._upload_limiter and limit_upload:
-                try:
-                    self._upload_limiter.leak(message_len)
-                except LeakyBucketException:
-                    return False, self.LEAKY_INTERVAL
-
-            connection = random.choice(ready_connections)
-            connection.used = True
+                wait = self._upload_limiter.consume(message_len)
+                if wait:
+                    # resend exactly when limiter has enough tokens
+                    return False, max(int(ceil(wait * 1000)), 1)
+
+            # send to connection which drains its buffer soonest,
+            # so messages of big responses are striped over all channels
+            # in proportion to channels speeds
+            connection = min(ready_connections, key=Connection.get_load)
+            connection.on_sent(message_len)
             messages.pop(0)
             logger.verbose("Sending message through connection %s",
                            connection.id)
@@ -378,7 +381,8 @@ class ConnectivityService(QObject):
 
         if self._is_connections_limit_reached(
                 self._outgoing_node_connections.get(node_id),
-                5 // len(online_node_ids) + 1):
+                self._channel_scaler.get_limit(
+                    node_id, 5 // len(online_node_ids) + 1)):
             return
 
         self._connect_to_node_via_webrtc(node_id)
@@ -492,7 +496,7 @@ class ConnectivityService(QObject):
         if not connection:
             connection = self._outgoing_connections.get(connection_id, None)
         if connection:
-            connection.buffered_amount = amount
+            connection.set_buffered_amount(amount)
 
     def _on_message(self, message_tuple):
         connection_id, message = message_tuple
@@ -509,6 +513,12 @@ class ConnectivityService(QObject):
                 NETWORK_WEBRTC_RELAY if self.is_relayed(node_id)
                 else NETWORK_WEBRTC_DIRECT)
 
+        if node_id and connection_id in self._outgoing_connections and \
+                self._channel_scaler.on_data_received(
+                    node_id, len(message),
+                    len(self._outgoing_node_connections[node_id])):
+            self._schedule_node_connect(self.CONNECT_INTERVAL, node_id)
+
         if node_id:
             self.data_received.emit((node_id, message), connection_id.decode())
         else:
@@ -564,6 +574,7 @@ class ConnectivityService(QObject):
                 del self._outgoing_node_connections[node_id]
 
                 self._relayed_nodes.discard(node_id)
+                self._channel_scaler.reset(node_id)
 
                 if node_id in self._connected_outgoing_nodes:
                     logger.debug("Disconnect node %s", node_id)
@@ -20,6 +20,7 @@
 import json
 from abc import abstractmethod
 import time
+from time import perf_counter
 
 import logging
 import errno
@@ -30,10 +31,18 @@ from PySide2.QtCore import QObject, Signal, QTimer
 from service.network.browser_sharing import Message, ProtoError
 
 from common.constants import DOWNLOAD_CHUNK_SIZE
+from common.metrics import counter, gauge, histogram
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+_read_duration = histogram(
+    'data_supplier_read_seconds', 'Time to read requested data from file')
+_sent_bytes = counter(
+    'data_supplier_sent_bytes_total', 'Bytes supplied to remote nodes')
+_queued_requests = gauge(
+    'data_supplier_queued_requests', 'Data requests waiting for processing')
+
 
 class DataSupplier(QObject):
     class DataRequest(object):
@@ -141,6 +150,7 @@ class DataSupplier(QObject):
         )
 
     def _read_data_by_chunks_from_file(self, path, offset, length):
+        start = perf_counter()
         try:
             chunks = []
             with open(path, 'rb') as f:
@@ -163,6 +173,7 @@ class DataSupplier(QObject):
                 path, offset, length, e)
             raise ProtoError("FILE_READING_ERROR", "")
 
+        _read_duration.observe(perf_counter() - start)
         return chunks
 
     def _check_processing(self, request):
@@ -185,6 +196,7 @@ class DataSupplier(QObject):
                 # p2p traffic
                 info_tx = (request.obj_id, request.length, 0, is_share)
             self.signal_info_tx.emit(info_tx)
+            _sent_bytes.inc(request.length)
 
             self._processing_data_requests.discard(request)
             if len(self._processing_data_requests) < \
@@ -230,12 +242,15 @@ class DataSupplier(QObject):
 
     def _put_request_to_queue(self, request):
         self._queued_data_requests.append(request)
+        _queued_requests.set(len(self._queued_data_requests))
 
     def _get_request_from_queue(self):
         try:
             return self._queued_data_requests.pop(0)
         except IndexError:
             return None
+        finally:
+            _queued_requests.set(len(self._queued_data_requests))
 
     def _abort_request(self, request):
         for req in self._processing_data_requests.copy():
@@ -52,7 +52,7 @@ class FileDataSupplier(DataSupplier):
             raise ProtoError(
                 "FILE_NOT_REGISTERED", "")
         path = self._copies.get_copy_file_path(hash)
-        if not exists(path):
+        if not exists(path) and not self._copies.ensure_copy_file(hash):
             path = path + '.download'
         if not exists(path):
             path = self._get_file_path(obj_id, set_quiet=True)
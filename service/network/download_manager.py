@@ -405,6 +405,10 @@ class DownloadManager(QObject):
     def get_downloads_count(self):
         return len(self._downloads)
 
+    def has_file_hash_download(self, file_hash):
+        return any(task.file_hash == file_hash
+                   for task in list(self._downloads.values()))
+
     def is_download_ready(self, obj_id):
         for task in self._ready_downloads_queue:
             if task.id == obj_id:
@@ -26,21 +26,33 @@ import pickle as pickle
 
 import logging
 import errno
-from time import time
+from time import time, perf_counter
 
 from PySide2.QtCore import QObject, Signal, QTimer
 from os.path import exists
 
-from service.network.leakybucket import LeakyBucketException
 
 from service.monitor.rsync import Rsync
 from common.utils import remove_file, get_free_space_by_filepath, \
     get_signature_file_size
 from common.constants import DOWNLOAD_PART_SIZE, DOWNLOAD_CHUNK_SIZE
+from common.metrics import counter, histogram
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+_received_bytes_p2p = counter(
+    'download_received_bytes_total', 'Bytes received by download tasks',
+    labels={'route': 'p2p'})
+_received_bytes_relayed = counter(
+    'download_received_bytes_total', 'Bytes received by download tasks',
+    labels={'route': 'relayed'})
+_chunk_write_duration = histogram(
+    'download_chunk_write_seconds', 'Download task chunk write duration')
+_chunk_receive_interval = histogram(
+    'download_chunk_receive_interval_seconds',
+    'Interval between chunks received from the same node')
+
 
 class DownloadTask(QObject):
     download_ready = Signal(QObject)
@@ -379,6 +391,7 @@ class DownloadTask(QObject):
         last_received_time = self._nodes_last_receive_time.get(node_id, 0.)
         if node_id in self._nodes_last_receive_time:
             self._nodes_last_receive_time[node_id] = now
+            _chunk_receive_interval.observe(now - last_received_time)
 
         self._nodes_timeouts_count.pop(node_id, 0)
 
@@ -442,8 +455,10 @@ class DownloadTask(QObject):
         self.received += length
         if self._connectivity_service.is_relayed(node_id):
             self._received_via_turn += length
+            _received_bytes_relayed.inc(length)
         else:
             self._received_via_p2p += length
+            _received_bytes_p2p.inc(length)
 
         new_offset = offset
         new_length = length
@@ -595,9 +610,11 @@ class DownloadTask(QObject):
         return True
 
     def _write_to_file(self, offset, data):
+        start = perf_counter()
         self._file.seek(offset)
         try:
             self._file.write(data)
+            _chunk_write_duration.observe(perf_counter() - start)
         except EnvironmentError as e:
             logger.error("Download task %s can't write to file. Reason: %s",
                          self.id, e)
@@ -876,16 +893,16 @@ class DownloadTask(QObject):
         logger.debug("Requesting date from node %s, request_chunk (%s, %s)",
                      node_id, offset, length)
         if self._limiter:
-            try:
-                self._limiter.leak(length)
-            except LeakyBucketException:
+            wait = self._limiter.consume(length)
+            if wait:
                 if node_id not in self._nodes_requested_chunks:
                     self._nodes_last_receive_time.pop(node_id, None)
                     if not self._network_limited_error_set:
                         self.download_error.emit('Network limited.')
                         self._network_limited_error_set = True
                 if not self._leaky_timer.isActive():
-                    self._leaky_timer.start()
+                    # wake up exactly when limiter has enough tokens
+                    self._leaky_timer.start(max(int(math.ceil(wait * 1000)), 1))
                 return
 
         if self._network_limited_error_set:
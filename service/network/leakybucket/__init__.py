@@ -19,5 +19,7 @@
 ###############################################################################
 from service.network.leakybucket.leakybucket import LeakyBucket, ThreadSafeLeakyBucket, \
     LeakyBucketException
+from service.network.leakybucket.token_bucket import TokenBucket
 
-__all__ = [LeakyBucket, ThreadSafeLeakyBucket, LeakyBucketException]
+__all__ = [LeakyBucket, ThreadSafeLeakyBucket, LeakyBucketException,
+           TokenBucket]
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+from threading import RLock
+from time import monotonic
+
+
+class TokenBucket(object):
+    """
+    Token bucket which tells exact time until requested amount of tokens
+    is available instead of failing, so waiters can be woken up once.
+    Buckets can be chained (global -> direction -> node), tokens are
+    taken from bucket and all its parents at once.
+    Bucket with zero rate does not limit anything itself.
+    """
+    __slots__ = [
+        '_capacity', '_rate', '_time_provider', '_parent', '_lock',
+        '_tokens', '_last_time']
+
+    # waits shorter than timers resolution are not worth a wakeup,
+    # tokens are taken in debt instead
+    MIN_WAIT = 0.001
+
+    def __init__(self, rate, capacity, parent=None, time_provider=monotonic):
+        """
+        Constructor
+
+        @param rate Tokens added per second [float]
+        @param capacity Max tokens stored [float]
+        @param parent Parent bucket limiting this one too [TokenBucket]
+        @param time_provider Function returning current time in seconds
+        """
+        self._rate = float(rate)
+        self._capacity = float(max(capacity, 0))
+        self._time_provider = time_provider
+        self._parent = parent
+        # whole hierarchy shares one lock to take tokens atomically
+        self._lock = parent._lock if parent else RLock()
+        self._tokens = self._capacity
+        self._last_time = time_provider()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def child(self, rate=0, capacity=0):
+        """
+        Creates bucket limited by this one and own rate
+
+        @param rate Own rate of child, 0 for parent rate only [float]
+        @param capacity Own capacity of child [float]
+        @return child bucket [TokenBucket]
+        """
+        return TokenBucket(rate, capacity, self, self._time_provider)
+
+    def consume(self, amount):
+        """
+        Takes amount of tokens if it is available in this bucket
+        and all parents
+
+        @param amount Tokens to take [float]
+        @return 0 if tokens are taken, otherwise seconds to wait
+            until they become available [float]
+        """
+        with self._lock:
+            buckets = self._chain()
+            wait = max(b._get_wait_time(amount) for b in buckets)
+            if wait < self.MIN_WAIT:
+                for bucket in buckets:
+                    if bucket._rate:
+                        bucket._tokens -= amount
+                return 0.
+            return wait
+
+    def get_wait_time(self, amount):
+        """
+        Returns seconds to wait until amount of tokens is available,
+        tokens are not taken
+
+        @param amount Tokens needed [float]
+        @return seconds [float]
+        """
+        with self._lock:
+            return max(b._get_wait_time(amount) for b in self._chain())
+
+    def _chain(self):
+        buckets = [self]
+        while buckets[-1]._parent:
+            buckets.append(buckets[-1]._parent)
+        return buckets
+
+    def _get_wait_time(self, amount):
+        if not self._rate:
+            return 0.
+
+        self._refill()
+        # amount above capacity would never fit, allow it on full bucket
+        needed = min(amount, self._capacity) - self._tokens
+        return needed / self._rate if needed > 0 else 0.
+
+    def _refill(self):
+        current_time = self._time_provider()
+        if self._tokens < self._capacity:
+            self._tokens = min(
+                self._capacity,
+                self._tokens + (current_time - self._last_time) * self._rate)
+        self._last_time = current_time
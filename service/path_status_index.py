@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+from collections import defaultdict
+from os.path import normcase
+
+from common.file_path import FilePath
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Path states
+IGNORED = 'ignored'
+DISK_ERROR = 'disk_error'
+INDEXING = 'indexing'
+DOWNLOADING = 'downloading'
+
+ERROR_STATES = frozenset((IGNORED, DISK_ERROR))
+SYNCING_STATES = frozenset((INDEXING, DOWNLOADING))
+
+
+class _Node(object):
+    __slots__ = ('parent', 'name', 'children', 'states', 'subscribers',
+                 'error_count', 'syncing_count', 'subscriptions_count')
+
+    def __init__(self, parent, name):
+        self.parent = parent
+        self.name = name
+        self.children = None
+        self.states = None
+        # client <> subscription path
+        self.subscribers = None
+        # numbers of paths with error / syncing states in subtree
+        self.error_count = 0
+        self.syncing_count = 0
+        # number of subscriptions in subtree
+        self.subscriptions_count = 0
+
+    def is_empty(self):
+        return not self.children and not self.states and \
+            not self.subscribers
+
+
+class PathStatusIndex(object):
+    """
+    Trie of paths holding path states (ignored, disk error, indexing,
+    downloading) and clients subscriptions to path statuses.
+    Every node keeps number of error and syncing paths and subscriptions
+    in its subtree, so path status and subscribers affected by path
+    change are found in O(depth)
+    """
+
+    def __init__(self):
+        self._root = _Node(None, None)
+        # state <> {path key: node}
+        self._state_nodes = defaultdict(dict)
+        # client <> set of subscription paths
+        self._clients = dict()
+
+    @staticmethod
+    def _key(path):
+        path = normcase(FilePath(path)).replace('\\', '/')
+        return tuple(name for name in path.split('/') if name)
+
+    def _find(self, path):
+        node = self._root
+        for name in self._key(path):
+            if not node.children:
+                return None
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def _get_or_create(self, path):
+        node = self._root
+        for name in self._key(path):
+            if node.children is None:
+                node.children = dict()
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = _Node(node, name)
+            node = child
+        return node
+
+    def _prune(self, node):
+        while node is not self._root and node.is_empty():
+            parent = node.parent
+            del parent.children[node.name]
+            node.parent = None
+            node = parent
+
+    @staticmethod
+    def _update_counts(node, error_delta, syncing_delta):
+        while node is not None:
+            node.error_count += error_delta
+            node.syncing_count += syncing_delta
+            node = node.parent
+
+    # Path states
+
+    def add_state(self, path, state):
+        node = self._get_or_create(path)
+        if node.states is None:
+            node.states = set()
+        elif state in node.states:
+            return
+
+        had_error = bool(node.states & ERROR_STATES)
+        had_syncing = bool(node.states & SYNCING_STATES)
+        node.states.add(state)
+        self._state_nodes[state][self._key(path)] = node
+        self._update_counts(
+            node,
+            int(not had_error and state in ERROR_STATES),
+            int(not had_syncing and state in SYNCING_STATES))
+
+    def remove_state(self, path, state):
+        node = self._state_nodes[state].pop(self._key(path), None)
+        if node is not None:
+            self._remove_node_state(node, state)
+
+    def _remove_node_state(self, node, state):
+        node.states.discard(state)
+        has_error = bool(node.states & ERROR_STATES)
+        has_syncing = bool(node.states & SYNCING_STATES)
+        self._update_counts(
+            node,
+            -int(not has_error and state in ERROR_STATES),
+            -int(not has_syncing and state in SYNCING_STATES))
+        self._prune(node)
+
+    def clear_state(self, state):
+        nodes = self._state_nodes.pop(state, {})
+        for node in nodes.values():
+            self._remove_node_state(node, state)
+
+    def set_state_paths(self, state, paths):
+        """
+        Makes given paths to be the only ones having the state
+        """
+        keys = {self._key(path): path for path in paths}
+        current = self._state_nodes[state]
+        for key in set(current) - set(keys):
+            self._remove_node_state(current.pop(key), state)
+        for key in set(keys) - set(current):
+            self.add_state(keys[key], state)
+
+    def has_state(self, path, state):
+        return self._key(path) in self._state_nodes.get(state, ())
+
+    def has_error(self, path):
+        """
+        Returns True if path or any path inside it has error state
+        """
+        node = self._find(path)
+        return node is not None and node.error_count > 0
+
+    def has_syncing(self, path):
+        """
+        Returns True if path or any path inside it has syncing state
+        """
+        node = self._find(path)
+        return node is not None and node.syncing_count > 0
+
+    # Subscriptions
+
+    def add_client(self, client):
+        """
+        Registers client without subscriptions,
+        drops previous client subscriptions if any
+        """
+        self.remove_client(client)
+        self._clients[client] = set()
+
+    def remove_client(self, client):
+        for path in self._clients.pop(client, ()):
+            self._remove_subscription(client, path)
+
+    def clients(self):
+        """
+        Returns dict client <> set of subscription paths
+        """
+        return self._clients
+
+    def subscribe(self, client, path):
+        path = FilePath(path)
+        paths = self._clients.setdefault(client, set())
+        if path in paths:
+            return
+
+        paths.add(path)
+        node = self._get_or_create(path)
+        if node.subscribers is None:
+            node.subscribers = dict()
+        node.subscribers[client] = path
+        while node is not None:
+            node.subscriptions_count += 1
+            node = node.parent
+
+    def unsubscribe(self, client, path):
+        """
+        Removes client subscriptions for path and paths inside it
+        """
+        for sub_client, sub_path in self.subscriptions_within(path):
+            if sub_client == client:
+                self._clients[client].discard(sub_path)
+                self._remove_subscription(client, sub_path)
+
+    def _remove_subscription(self, client, path):
+        node = self._find(path)
+        if node is None or not node.subscribers or \
+                client not in node.subscribers:
+            return
+
+        del node.subscribers[client]
+        parent = node
+        while parent is not None:
+            parent.subscriptions_count -= 1
+            parent = parent.parent
+        self._prune(node)
+
+    def path_subscribers(self, path):
+        """
+        Returns clients subscribed exactly to path
+        """
+        node = self._find(path)
+        return list(node.subscribers) if node and node.subscribers else []
+
+    def subscribers(self, path):
+        """
+        Returns subscriptions affected by path change, i.e. for the path
+        and paths containing it, in the form {client: [paths]}
+        """
+        result = defaultdict(list)
+        node = self._root
+        for name in self._key(path):
+            if node.subscribers:
+                for client, sub_path in node.subscribers.items():
+                    result[client].append(sub_path)
+            if not node.children:
+                return result
+            node = node.children.get(name)
+            if node is None:
+                return result
+
+        if node.subscribers:
+            for client, sub_path in node.subscribers.items():
+                result[client].append(sub_path)
+        return result
+
+    def subscriptions_within(self, path):
+        """
+        Returns list of (client, path) for subscriptions
+        for path and paths inside it
+        """
+        node = self._find(path)
+        if node is None:
+            return []
+
+        result = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.subscribers:
+                result.extend(node.subscribers.items())
+            if node.children:
+                stack.extend(child for child in node.children.values()
+                             if child.subscriptions_count)
+        return result
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+import os
+import os.path as op
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from uuid import uuid4
+
+from common.file_path import FilePath
+from common.metrics import counter
+from common.tree_walker import walk_tree
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_files_wiped = counter('wipe_files', 'Files overwritten by secure wipe')
+_bytes_wiped = counter(
+    'wipe_bytes', 'Bytes overwritten by secure wipe, all passes')
+_wipe_errors = counter('wipe_errors', 'Files secure wipe failed on')
+
+# one sync per pass flushes data of all files overwritten by it,
+# where not available each file is synced after its overwrite
+_sync = getattr(os, 'sync', None)
+
+
+class SecureWipe(object):
+    """
+    Overwrites files of directory tree and optionally removes them.
+    Tree is walked once into work list, smaller files go first.
+    Files are overwritten pass by pass in bounded pool of threads by
+    large sequential writes of preallocated pattern buffer, each pass
+    is synced to disk once after all files are overwritten by it.
+    Wiped files are renamed to random names and unlinked after all
+    passes, so namespace changes don't add journal commits to syncs
+    """
+
+    block_size = 2 * 1024 * 1024  # 2MB
+    workers_count = min(cpu_count() * 2, 8)
+    progress_interval = 1.  # seconds
+
+    def __init__(self, passes=1, remove=False, workers_count=None,
+                 progress_cb=None):
+        """
+        @param passes Number of overwrite passes [int]
+        @param remove Rename and unlink wiped files, remove emptied dirs
+        @param workers_count Number of threads overwriting files [int]
+        @param progress_cb Called as
+            progress_cb(files_done, files_total, bytes_done, bytes_total),
+            bytes are counted for all passes
+        """
+        assert passes > 0, passes
+        self._passes = passes
+        self._remove = remove
+        self._workers_count = workers_count or self.workers_count
+        self._progress_cb = progress_cb
+        # last pass writes zeros, previous ones reuse one random buffer
+        zeros = memoryview(bytes(self.block_size))
+        random = memoryview(os.urandom(self.block_size)) \
+            if passes > 1 else zeros
+        self._patterns = [random] * (passes - 1) + [zeros]
+
+        self._lock = threading.Lock()
+        self._files_total = self._bytes_total = 0
+        self._files_done = self._bytes_done = 0
+        self._last_progress = 0
+        self._failed = set()
+
+    def wipe_dir(self, dirname, files_to_hold=(), skip_extensions=('.log',)):
+        """
+        Wipes all files in dirname tree except files_to_hold
+        (long paths) and files with skip_extensions
+
+        @return Number of files wiped [int]
+        """
+        files_to_hold = set(files_to_hold)
+        files = []
+        dirs = []
+        for batch in walk_tree(dirname, follow_symlinks=False,
+                               with_stat=True):
+            for path, is_dir, stat_result in batch:
+                if is_dir:
+                    dirs.append(path)
+                    continue
+                filename = FilePath(path).longpath
+                if filename in files_to_hold or \
+                        op.splitext(path)[1] in skip_extensions:
+                    continue
+                files.append((stat_result.st_size, filename))
+
+        # wipe smaller files first
+        files.sort(key=lambda f: f[0])
+        self._files_total = len(files)
+        self._bytes_total = sum(f[0] for f in files) * self._passes
+        logger.debug("Wiping %s files (%s bytes) in '%s'",
+                     self._files_total, self._bytes_total, dirname)
+
+        for pattern in self._patterns:
+            self._wipe_pass(files, pattern)
+            files = [f for f in files if f[1] not in self._failed]
+            if _sync:
+                _sync()
+
+        wiped = [filename for _, filename in files]
+        _files_wiped.inc(len(wiped))
+        with self._lock:
+            self._files_done = len(wiped)
+
+        if self._remove:
+            self._remove_files(wiped)
+            # deepest first, dirs still holding files are kept
+            for path in sorted(dirs, key=len, reverse=True):
+                try:
+                    os.rmdir(FilePath(path).longpath)
+                except OSError:
+                    pass
+
+        self._report_progress(force=True)
+        logger.debug("Dir '%s' has been wiped", dirname)
+        return self._files_done
+
+    def _wipe_pass(self, files, pattern):
+        # bound number of files queued to pool
+        in_flight = threading.BoundedSemaphore(self._workers_count * 2)
+
+        def on_done(_):
+            in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self._workers_count,
+                                thread_name_prefix='SecureWipe') as pool:
+            for filesize, filename in files:
+                if not filesize:
+                    continue
+                in_flight.acquire()
+                pool.submit(self._wipe_file, filename, filesize, pattern) \
+                    .add_done_callback(on_done)
+
+    def _wipe_file(self, filename, filesize, pattern):
+        try:
+            with self._open(filename) as f:
+                self._overwrite(f, filesize, pattern)
+                if not _sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except Exception as e:
+            _wipe_errors.inc()
+            logger.error("Error occured while wiping file '%s'. "
+                         "Error '%s'", filename, e)
+            with self._lock:
+                self._failed.add(filename)
+            return
+
+        _bytes_wiped.inc(filesize)
+        with self._lock:
+            self._bytes_done += filesize
+        self._report_progress()
+
+    def _remove_files(self, wiped):
+        # random prefix hides original names, keep dir order for locality
+        prefix = uuid4().hex
+        for i, filename in enumerate(sorted(wiped)):
+            wiped_name = op.join(op.dirname(filename), '%s%x' % (prefix, i))
+            try:
+                os.rename(filename, wiped_name)
+                os.unlink(wiped_name)
+            except OSError as e:
+                logger.warning("Can't remove wiped file '%s'. Error '%s'",
+                               filename, e)
+
+    def _open(self, filename):
+        try:
+            return open(filename, 'r+b')
+        except PermissionError:
+            os.chmod(filename, stat.S_IREAD | stat.S_IWRITE)
+            return open(filename, 'r+b')
+
+    def _overwrite(self, f, size, pattern):
+        offset = 0
+        while offset < size:
+            offset += f.write(pattern[:min(size - offset, self.block_size)])
+
+    def _report_progress(self, force=False):
+        if not self._progress_cb:
+            return
+
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_progress < \
+                    self.progress_interval:
+                return
+
+            self._last_progress = now
+            progress = (self._files_done, self._files_total,
+                        self._bytes_done, self._bytes_total)
+        try:
+            self._progress_cb(*progress)
+        except Exception as e:
+            logger.warning("Wipe progress callback failed: %s", e)
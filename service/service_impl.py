@@ -28,8 +28,9 @@ from PySide2.QtCore import QCoreApplication
 from common import config
 from common.utils import wipe_internal
 from common.logging_setup import clear_old_logs, set_max_log_size_mb
-from service.stat_tracking import Tracker
 from common.crash_handler import init_crash_handler
+from common.metrics import MetricsServer
+from common.startup_timer import startup_stage
 from service.service_worker import ApplicationWorker
 
 
@@ -46,6 +47,7 @@ class ApplicationService(QCoreApplication):
         self._tracker = None
         self._tracker_thread = None
         self._worker = None
+        self._metrics_server = None
 
     def start(self, app_start_ts, args):
         '''
@@ -57,7 +59,8 @@ class ApplicationService(QCoreApplication):
 
         clear_old_logs(logger)
         # Load configuration file
-        self._cfg = config.load_config()
+        with startup_stage('service', 'load_config'):
+            self._cfg = config.load_config()
         set_max_log_size_mb(logger, max(self._cfg.max_log_size, 0.02))
         if self._cfg.copies_logging:
             copies_logger = logging.getLogger('copies_logger')
@@ -76,9 +79,12 @@ class ApplicationService(QCoreApplication):
             raise SystemExit(0)
 
         if self._cfg.tracking_address:
+            # stats tracking is optional, so it is imported only if enabled
+            from service.stat_tracking import Tracker
             self._tracker = Tracker(
                 'service_stats.db', self._cfg.sync_directory,
-                self._cfg.tracking_address)
+                self._cfg.tracking_address,
+                batches=self._cfg.tracking_batches)
             init_crash_handler(self._tracker)
             self._tracker_thread = QThread()
             self._tracker.moveToThread(self._tracker_thread)
@@ -87,11 +93,17 @@ class ApplicationService(QCoreApplication):
         else:
             init_crash_handler(logger=logger)
 
-        self._worker = ApplicationWorker(self._cfg, self._tracker,
-                                         app_start_ts, args)
+        if self._cfg.metrics_port:
+            self._metrics_server = MetricsServer(self._cfg.metrics_port)
+            self._metrics_server.start()
+
+        with startup_stage('service', 'create_worker'):
+            self._worker = ApplicationWorker(self._cfg, self._tracker,
+                                             app_start_ts, args)
         self._worker.exited.connect(self._on_exit, Qt.QueuedConnection)
 
-        self._worker.start_work()
+        with startup_stage('service', 'start_work'):
+            self._worker.start_work()
         self.exec_()
         logger.debug("Service exiting...")
 
@@ -103,6 +115,8 @@ class ApplicationService(QCoreApplication):
 
     def _on_exit(self):
         logger.debug("Worker thread quit")
+        if self._metrics_server:
+            self._metrics_server.stop()
         if self._tracker_thread:
             self._tracker_thread.quit()
             self._tracker_thread.wait(2)
@@ -23,7 +23,9 @@ from os.path import join
 import asyncio
 
 from common.async_utils import run_daemon
+from common.gui_protocol import GuiProtocol, BATCH_SUBPROTOCOL
 from common.utils import make_dirs
+from service.gui_updates_buffer import GuiUpdatesBuffer
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -33,6 +35,16 @@ logger.addHandler(logging.NullHandler())
 class ServiceServerProtocol(WebSocketServerProtocol):
     def __init__(self):
         super(ServiceServerProtocol, self).__init__()
+        self.is_batching = False
+
+    def onConnect(self, request):
+        if BATCH_SUBPROTOCOL in request.protocols:
+            self.is_batching = True
+            return BATCH_SUBPROTOCOL
+        return None
+
+    def send_gui_message(self, message):
+        self.sendMessage(message.encode())
 
     def onOpen(self):
         logger.debug("Incoming WebSocket connection opened")
@@ -60,6 +72,9 @@ class ServiceServer(object):
         self._server = None
         self._on_client_connected = None
         self._on_received = None
+        self._protocol = GuiProtocol(())
+        self._updates = GuiUpdatesBuffer(self._loop, self._send_updates)
+        self._ping_handle = None
         self.start(config_path)
 
     def set_on_client_connected_callback(self, cb):
@@ -73,14 +88,35 @@ class ServiceServer(object):
     def send_gui_message(self, message):
         self._loop.call_soon_threadsafe(self._broadcast_message, message)
 
+    def send_gui_update(self, action, data):
+        self._loop.call_soon_threadsafe(self._updates.put, action, data)
+
     def _broadcast_message(self, message):
+        # keep order of updates and messages sent after them
+        self._updates.flush()
         clients = getattr(self._factory, 'client_connections', set())
         for client in clients:
             try:
                 logger.verbose('Sending message to app %s', message)
             except AttributeError:
                 pass
-            client.sendMessage(message.encode())
+            client.send_gui_message(message)
+
+    def _send_updates(self, updates):
+        clients = getattr(self._factory, 'client_connections', set())
+        batch = None
+        messages = None
+        for client in clients:
+            if client.is_batching:
+                if batch is None:
+                    batch = self._protocol.create_batch(updates)
+                client.send_gui_message(batch)
+            else:
+                if messages is None:
+                    messages = [self._protocol.create_action(action, data)
+                                for action, data in updates]
+                for message in messages:
+                    client.send_gui_message(message)
 
     def _on_connected(self):
         self._do_ping()
@@ -88,10 +124,17 @@ class ServiceServer(object):
             self._on_client_connected()
 
     def _do_ping(self):
+        if self._ping_handle:
+            self._ping_handle.cancel()
         clients = getattr(self._factory, 'client_connections', set())
+        if not clients:
+            self._ping_handle = None
+            return
+
         for client in clients:
             client.sendPing()
-        self._loop.call_later(self.ping_interval, self._do_ping)
+        self._ping_handle = self._loop.call_later(
+            self.ping_interval, self._do_ping)
 
     @run_daemon
     def start(self, config_path):
@@ -19,7 +19,6 @@
 ###############################################################################
 from collections import deque
 import logging
-import os
 import os.path as op
 from types import FunctionType
 import shutil
@@ -39,7 +38,10 @@ from .gui_proxy import GuiProxy
 from .service_server import ServiceServer
 from common.async_qt import qt_run
 from common.file_path import FilePath
+from common.metrics import registry as metrics_registry
+from common.startup_timer import startup_stage, startup_ready
 from .file_status_manager import FileStatusManager
+from .secure_wipe import SecureWipe
 from common.utils import get_cfg_dir, get_data_dir, \
     get_cfg_filename, touch, ensure_unicode, get_downloads_dir,\
     make_dirs, remove_dir, create_shortcuts, get_bases_filename, \
@@ -61,7 +63,6 @@ from common.translator import tr
 from db_migrations import upgrade_db, stamp_db
 
 from .sync_mechanism.sync import Sync
-from .websharing import WebshareHandler
 from .shell_integration \
     import signals as shell_integration_signals
 from service.signalling import SignalServerClient
@@ -403,10 +404,14 @@ class ApplicationWorker(QObject):
         if not self._create_cfg_dir_if_needed():
             return
 
-        self._webshare_handler = WebshareHandler(
-            tracker=self._tracker, config=self._cfg, sync=self._sync,
-            network_speed_calculator=self._network_speed_calculator,
-            db=self._events_db, parent=self)
+        # webshare is imported here instead of module level
+        # to keep service imports light
+        from .websharing import WebshareHandler
+        with startup_stage('service', 'webshare'):
+            self._webshare_handler = WebshareHandler(
+                tracker=self._tracker, config=self._cfg, sync=self._sync,
+                network_speed_calculator=self._network_speed_calculator,
+                db=self._events_db, parent=self)
 
         self._connect_sync_signals()
 
@@ -425,7 +430,8 @@ class ApplicationWorker(QObject):
         # Add statistics event to be before session/login
         self._tracker.session_ready(self._app_start_ts)
 
-        self._sync.force_apply_config()
+        with startup_stage('service', 'monitor_and_connectivity'):
+            self._sync.force_apply_config()
         logger.info("apply rate limits")
         self._apply_rate_limits()
         self._apply_send_statistic()
@@ -501,6 +507,8 @@ class ApplicationWorker(QObject):
         self._sync.license_alert.connect(self._on_license_alert)
         self._sync.file_list_changed.connect(self._start_file_list_sending)
         self._sync.sync_start_completed.connect(self._complete_login)
+        self._sync.sync_start_completed.connect(
+            lambda: startup_ready('service'))
         self._sync.revert_failed.connect(self._gui.revert_failed)
         self._sync.connected_nodes_changed.connect(
             lambda n: self._on_connected_nodes_changed(n, -1))
@@ -537,6 +545,13 @@ class ApplicationWorker(QObject):
         self._upload_handler.upload_folder_excluded.connect(
             lambda name: self._on_share_upload_cancelled(
                 name, 'upload', 'excluded'))
+        self._sync.file_removed_from_indexing.connect(
+            lambda _, path_removed:
+            path_removed and self._upload_handler.on_paths_changed())
+        self._sync.file_moved.connect(
+            lambda *_: self._upload_handler.on_paths_changed())
+        self._sync.config_changed.connect(
+            self._upload_handler.on_paths_changed)
 
     def _init_transport_setup(self):
         # Initializes transport and signalling server connection
@@ -653,6 +668,8 @@ class ApplicationWorker(QObject):
 
         self._gui.get_offline_dirs.connect(self._sync.get_offline_dirs)
         self._gui.set_offline_dirs.connect(self._set_offline_dirs)
+        self._gui.get_metrics.connect(
+            lambda: self._gui.metrics(metrics_registry.snapshot()))
 
     def _connect_tx_signals(self):
         # connect traffic info signals
@@ -1348,7 +1365,7 @@ class ApplicationWorker(QObject):
 
         # wipe files
         data_dir = self._cfg.sync_directory
-        self._wipe_dir(data_dir, files_to_hold)
+        self._wipe_dir(data_dir, files_to_hold, remove=True)
         config_dir = get_cfg_dir()
         self._wipe_dir(config_dir, files_to_hold)
 
@@ -1377,60 +1394,15 @@ class ApplicationWorker(QObject):
         else:
             Application.exit()
 
-    def _wipe_file(self, filename, filesize):
-        logger.debug("wipe file '%s', size '%s'", filename, filesize)
-        rest_size = filesize
-        block_size = 2 * 1024 * 1024  # 2MB
-        try:
-            with open(filename, "r+b") as f:
-                f.seek(0, 0)
-                while True:
-                    m = block_size if rest_size > block_size else rest_size
-                    f.write(b"\x00" * m)
-                    rest_size = rest_size - m
-                    if rest_size <= 0:
-                        break
-                f.flush()
-            logger.debug("File '%s' has been wiped successfully", filename)
-        except Exception as e:
-            logger.error("Error occured while wiping file '%s'. "
-                         "Error '%s'", filename, e)
-
-    def _wipe_dir(self, dirname, files_to_hold):
-        sizes_scale = [
-            1024,  # 1 KB
-            100 * 1024,  # 100 KB
-            1024 * 1024,  # 1 MB
-            100 * 1024 * 1024,  # 100 MB
-            1024 * 1024 * 1024,  # 1 GB
-        ]
-        sizes = iter(sizes_scale)
-        max_size = 0
-        while True:
-            if max_size is None:
-                break
-            try:
-                min_size = max_size
-                max_size = next(sizes)
-                logger.debug("min_size: %s, max_size: %s",
-                             min_size, max_size)
-            except StopIteration:
-                max_size = None
-            for root, dirs, files in os.walk(dirname):
-                for f in files:
-                    _, ext = op.splitext(f)
-                    filename = FilePath(op.join(root, f)).longpath
-                    if filename in files_to_hold or ext == '.log':
-                        continue
-                    try:
-                        filesize = op.getsize(filename)
-                    except OSError as e:
-                        logger.error("Error occured while getting "
-                                     "file size: '%s'", e)
-                        continue
-                    if max_size is None or (min_size <= filesize < max_size):
-                        self._wipe_file(filename, filesize)
-        logger.debug("Dir '%s' has been wiped", dirname)
+    def _wipe_dir(self, dirname, files_to_hold, remove=False):
+        wipe = SecureWipe(passes=self._cfg.wipe_passes, remove=remove,
+                          progress_cb=self._on_wipe_progress)
+        wipe.wipe_dir(dirname, files_to_hold)
+
+    def _on_wipe_progress(self, files_done, files_total,
+                          bytes_done, bytes_total):
+        logger.info("Wiped %s of %s files, %s of %s bytes",
+                    files_done, files_total, bytes_done, bytes_total)
 
     def _on_remote_action_credentials(self, remote_action_uuid,
                                       remote_action_user_hash):
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+from collections import defaultdict
+
+from common.file_path import FilePath
+from common.metrics import counter
+from .protocol import get_files_status_reply
+
+# Setup logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_updates = counter(
+    'shell_status_updates', 'Path status updates queued for shell clients')
+_coalesced = counter(
+    'shell_status_coalesced',
+    'Path status updates replaced by newer ones before sending')
+_messages = counter(
+    'shell_status_messages', 'Status messages sent to shell clients')
+_resyncs = counter(
+    'shell_status_resyncs',
+    'Shell clients asked to resync statuses because of overflow')
+
+
+class StatusBuffer(object):
+    """
+    Outbound path statuses buffer of single shell extension client.
+    Updates are merged per path (last write wins) and sent grouped
+    by status on adaptive interval or when buffer size reaches threshold.
+    If client does not read messages and buffer overflows, updates are
+    dropped and client is asked to resync statuses.
+    Must be used from event loop thread only
+    """
+
+    MIN_FLUSH_INTERVAL = 0.05
+    MAX_FLUSH_INTERVAL = 1.
+    FLUSH_SIZE = 1000
+    MAX_PENDING = 50000
+    MAX_WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, loop, send, resync, get_write_buffer_size):
+        """
+        @param loop Event loop to schedule flushes in
+        @param send Callable sending encoded message to client
+        @param resync Callable asking client to resync statuses
+        @param get_write_buffer_size Callable returning number of bytes
+            not yet written to client socket
+        """
+        self._loop = loop
+        self._send = send
+        self._resync = resync
+        self._get_write_buffer_size = get_write_buffer_size
+        # path <> status
+        self._pending = dict()
+        self._resync_needed = False
+        self._interval = self.MIN_FLUSH_INTERVAL
+        self._flush_handle = None
+        self._closed = False
+
+    def put(self, paths, status):
+        if self._closed:
+            return
+
+        pending = self._pending
+        _updates.inc(len(paths))
+        coalesced = 0
+        for path in paths:
+            if pending.pop(path, None) is not None:
+                coalesced += 1
+            pending[path] = status
+        if coalesced:
+            _coalesced.inc(coalesced)
+
+        if len(pending) > self.MAX_PENDING:
+            logger.warning(
+                "Status buffer overflow (%s paths), client will resync",
+                len(pending))
+            pending.clear()
+            self._resync_needed = True
+
+        if len(pending) >= self.FLUSH_SIZE and self._is_writable():
+            self.flush()
+        else:
+            self._schedule_flush()
+
+    def discard(self, path):
+        """
+        Drops pending updates for path and paths inside it
+        """
+        path = FilePath(path)
+        for pending_path in [p for p in self._pending
+                             if FilePath(p) in path]:
+            del self._pending[pending_path]
+
+    def flush(self):
+        self._cancel_flush()
+        if self._closed or not (self._pending or self._resync_needed):
+            return
+
+        if not self._is_writable():
+            self._interval = self.MAX_FLUSH_INTERVAL
+            self._schedule_flush()
+            return
+
+        if self._resync_needed:
+            self._resync_needed = False
+            _resyncs.inc()
+            self._resync()
+
+        statuses_paths = defaultdict(list)
+        for path, status in self._pending.items():
+            statuses_paths[status].append(path)
+        sent_count = len(self._pending)
+        self._pending = dict()
+
+        for status, paths in statuses_paths.items():
+            self._send(get_files_status_reply(paths, status).encode())
+        _messages.inc(len(statuses_paths))
+
+        # back off while updates keep coming in bulk
+        if sent_count >= self.FLUSH_SIZE // 2:
+            self._interval = min(self._interval * 2, self.MAX_FLUSH_INTERVAL)
+        else:
+            self._interval = self.MIN_FLUSH_INTERVAL
+
+    def close(self):
+        self._closed = True
+        self._cancel_flush()
+        self._pending.clear()
+
+    def _is_writable(self):
+        try:
+            return self._get_write_buffer_size() < self.MAX_WRITE_BUFFER_SIZE
+        except Exception as e:
+            logger.debug("Can't get write buffer size (%s)", e)
+            return True
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(
+                self._interval, self._on_flush_timeout)
+
+    def _on_flush_timeout(self):
+        self._flush_handle = None
+        self.flush()
+
+    def _cancel_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
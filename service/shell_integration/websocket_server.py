@@ -26,9 +26,10 @@ from common.async_utils import run_daemon
 from common.utils import get_platform, HOME_DIR, ensure_unicode, make_dirs, get_cfg_dir
 from .protocol import \
     parse_message, get_sync_dir_reply, emit_signal, create_command, \
-    get_is_sharing_reply, get_shared_reply, get_files_status_reply, \
+    get_is_sharing_reply, get_shared_reply, \
     get_clear_path_reply, get_share_copy_move_reply, get_file_info_reply, \
     get_offline_status_reply, get_smart_sync_reply
+from .status_buffer import StatusBuffer
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -38,6 +39,7 @@ logger.addHandler(logging.NullHandler())
 class IPCWebSocketProtocol(WebSocketServerProtocol):
     def __init__(self):
         super(IPCWebSocketProtocol, self).__init__()
+        self.status_buffer = None
 
     def onOpen(self):
         logger.debug("Incoming WebSocket connection opened")
@@ -45,6 +47,9 @@ class IPCWebSocketProtocol(WebSocketServerProtocol):
         first_client = not clients and get_platform() == 'Windows'
         clients.add(self)
         self.factory.client_connections = clients
+        self.status_buffer = StatusBuffer(
+            self.factory.loop, self.sendMessage, self._resync_statuses,
+            self._get_write_buffer_size)
         self.factory.loop.call_soon_threadsafe(
            self._on_connected, first_client)
 
@@ -53,6 +58,8 @@ class IPCWebSocketProtocol(WebSocketServerProtocol):
         emit_signal("status_unsubscribe", self.peer, "")
         clients = getattr(self.factory, 'client_connections', set())
         clients.discard(self)
+        if self.status_buffer:
+            self.status_buffer.close()
 
     def onMessage(self, payload, isBinary):
         # Parse message received
@@ -117,6 +124,15 @@ class IPCWebSocketProtocol(WebSocketServerProtocol):
 
         self.sendMessage(get_smart_sync_reply().encode())
 
+    def _resync_statuses(self):
+        # statuses were dropped, so drop subscriptions
+        # and make client subscribe and request statuses again
+        emit_signal("status_subscribe", self.peer, "")
+        self.sendMessage(create_command('refresh').encode())
+
+    def _get_write_buffer_size(self):
+        return self.transport.get_write_buffer_size()
+
 
 class IPCWebSocketServer(object):
     def __init__(self):
@@ -173,10 +189,9 @@ class IPCWebSocketServer(object):
 
     def _send_files_status(self, client_id, paths, status):
         clients = getattr(self._factory, 'client_connections', set())
-        msg = get_files_status_reply(paths, status).encode()
         for client in clients:
             if client.peer == client_id:
-                client.sendMessage(msg)
+                client.status_buffer.put(paths, status)
                 return
 
     def _send_clear_path(self, client_id, path):
@@ -184,6 +199,9 @@ class IPCWebSocketServer(object):
         msg = get_clear_path_reply(path).encode()
         for client in clients:
             if client.peer == client_id:
+                # statuses queued for cleared paths are not actual anymore
+                client.status_buffer.discard(path)
+                client.status_buffer.flush()
                 client.sendMessage(msg)
                 return
 
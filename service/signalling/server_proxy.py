@@ -23,6 +23,8 @@ import logging
 import ssl
 import socket
 import certifi
+import time
+from threading import Condition
 from concurrent.futures import Future
 from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlunparse, urlencode
@@ -30,6 +32,7 @@ import asyncio
 
 from service.signalling.websocket_connection_factory \
     import WebSocketConnectionFactory
+from service.signalling.signalling_protocol import FILE_EVENTS_BATCH_SIZE
 
 # Setup logging
 from common.async_utils import run_daemon
@@ -39,6 +42,62 @@ logger.addHandler(logging.NullHandler())
 
 TCP_CONNECTION_TIMEOUT = 10
 PING_TIMEOUT_MULTIPLIER = 3
+# Max time to wait for consumer to take file events batch (seconds)
+FILE_EVENTS_CONSUME_TIMEOUT = 60
+
+
+class FlowControl(object):
+    """
+    Limits number of batches passed to consumer but not consumed yet.
+    Disabled until max pending batches number is set
+    """
+
+    def __init__(self):
+        self._max_pending = None
+        self._pending = 0
+        self._condition = Condition()
+
+    def set_max_pending(self, max_pending):
+        with self._condition:
+            self._max_pending = max_pending
+            self._condition.notify_all()
+
+    def acquire(self, is_active, timeout=FILE_EVENTS_CONSUME_TIMEOUT):
+        """
+        Waits until batch could be passed to consumer
+
+        @param is_active Callable returning False if waiting
+            is to be aborted
+        @param timeout Max time to wait (seconds) [float]
+        @return False if waiting is aborted [bool]
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while self._max_pending and self._pending >= self._max_pending:
+                if not is_active():
+                    return False
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning(
+                        "Consumer has not taken %s batches for %s seconds",
+                        self._pending, timeout)
+                    break
+
+                self._condition.wait(min(remaining, 0.5))
+            self._pending += 1
+        return True
+
+    def release(self):
+        with self._condition:
+            if self._pending > 0:
+                self._pending -= 1
+            self._condition.notify_all()
+
+    def reset(self):
+        with self._condition:
+            self._pending = 0
+            self._condition.notify_all()
 
 
 class ServerProxy(object):
@@ -103,6 +162,9 @@ class ServerProxy(object):
         # Startup threads
         self._loop = None
         self._executor = ThreadPoolExecutor(max_workers=1)
+        # messages are processed in order outside of loop thread,
+        # it can wait for file events consumer
+        self._messages_executor = ThreadPoolExecutor(max_workers=1)
         self._ws_thread()
 
         self._reconnect_pending = False
@@ -111,6 +173,8 @@ class ServerProxy(object):
         self._last_message_id = 0
         self._url = None
 
+        self._file_events_flow = FlowControl()
+
     def _ping_checker(self):
         """Checks server ping.
         If no ping during server ping_timeout, initiates reconnection.
@@ -243,7 +307,8 @@ class ServerProxy(object):
             on_connected=self._on_connection_established,
             on_disconnected=self._on_connection_lost,
             last_message_id=self._last_message_id,
-            ssl_fingerprint=self.ssl_fingerprint)
+            ssl_fingerprint=self.ssl_fingerprint,
+            messages_executor=self._messages_executor)
 
         if self.use_ssl:
             logger.info("cafile: %s", certifi.where())
@@ -424,10 +489,28 @@ class ServerProxy(object):
         # Call user callbacks
         self._emit_signal('server_connect')
 
+    def set_max_pending_file_events(self, max_pending):
+        """
+        Enables flow control for 'file_events' signal.
+        Next batch of file events is not emitted until
+        file_events_consumed is called, if max_pending batches are
+        not consumed yet
+
+        @param max_pending Max number of batches not consumed [int]
+        """
+        self._file_events_flow.set_max_pending(max_pending)
+
+    def file_events_consumed(self):
+        self._file_events_flow.release()
+
+    def reset_file_events_flow(self):
+        self._file_events_flow.reset()
+
     def _on_connection_lost(self):
         """
         Updates state on signalling server connection lost
         """
+        self._file_events_flow.reset()
         if self._ws:
             self._last_message_id = self._ws.get_message_id()
 
@@ -509,8 +592,7 @@ class ServerProxy(object):
             self._storage.sharing_disable(uuid=data['uuid'])
         # Obtained info on file events
         elif operation == 'file_events':
-            logger.info("Obtained info on %s file event(s)", len(data))
-            self._emit_signal('file_events', data, node_id)
+            self._process_file_events(data, node_id)
         elif operation == 'node_status':
             logger.info(
                 "Received node ID %s status update: %s", node_id, data)
@@ -518,3 +600,52 @@ class ServerProxy(object):
         else:
             logger.info("Received message %s with data %s.", operation, data)
             self._emit_signal(operation, data)
+
+    def _process_file_events(self, data, node_id):
+        """
+        Emits file events in batches of bounded size.
+        Waits for consumer before each batch if flow control is enabled.
+        Called in messages executor thread, so waiting doesn't block loop
+        reading socket, next messages wait in executor queue
+
+        @param data List of file events or DataBatches
+            if message is decoded in batches
+        @param node_id Other client ID (optional) [string]
+        """
+
+        if isinstance(data, list):
+            logger.info("Obtained info on %s file event(s)", len(data))
+            batches = (data[i:i + FILE_EVENTS_BATCH_SIZE]
+                       for i in range(0, len(data), FILE_EVENTS_BATCH_SIZE))
+        else:
+            logger.info("Obtained big file events message, "
+                        "processing in batches")
+            batches = data
+
+        def is_active():
+            return self._enabled and self._ws is not None
+
+        events_count = 0
+        for batch in batches:
+            if not self._file_events_flow.acquire(is_active):
+                logger.info("File events processing aborted "
+                            "after %s event(s)", events_count)
+                return
+
+            events_count += len(batch)
+            if not isinstance(data, list):
+                # node id placed after data is known for last batch only
+                node_id = data.fields.get('node_id', node_id)
+            self._emit_signal('file_events', batch, node_id)
+
+        if not events_count:
+            if not isinstance(data, list):
+                node_id = data.fields.get('node_id', node_id)
+            # empty list means there is no more events on server
+            if not self._file_events_flow.acquire(is_active):
+                logger.info("File events processing aborted")
+                return
+
+            self._emit_signal('file_events', [], node_id)
+        elif not isinstance(data, list):
+            logger.info("Processed %s file event(s)", events_count)
@@ -159,6 +159,28 @@ class SignalServerClient(QObject):
 
         return self._server_proxy.is_connected()
 
+    def set_max_pending_file_events(self, max_pending):
+        """
+        Enables flow control for 'file_events' signal.
+        Consumer must call file_events_consumed for every batch obtained
+
+        @param max_pending Max number of batches emitted
+            but not consumed yet [int]
+        """
+        self._server_proxy.set_max_pending_file_events(max_pending)
+
+    def file_events_consumed(self):
+        """
+        Notifies that batch of file events is consumed
+        """
+        self._server_proxy.file_events_consumed()
+
+    def reset_file_events_flow(self):
+        """
+        Forgets all batches of file events not consumed yet
+        """
+        self._server_proxy.reset_file_events_flow()
+
     def get_nodes(self, allowed_types=None, online_only=True):
         """
         Returns list of known node IDs
@@ -19,6 +19,8 @@
 ###############################################################################
 import logging
 import json
+import re
+import codecs
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -73,3 +75,179 @@ def parse_msg(encoded):
         raise
 
     return operation, node_id, data
+
+
+# Messages bigger than this are decoded incrementally
+BATCHED_PARSE_MIN_SIZE = 1024 * 1024
+# Max number of file events passed to consumer at once
+FILE_EVENTS_BATCH_SIZE = 500
+# Operations which data list is decoded lazily in batches
+BATCHED_OPERATIONS = ('file_events', )
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class JsonStream(object):
+    """
+    JSON text read from chunks of utf-8 encoded bytes (or strings).
+    Only part of text not decoded yet is kept in memory
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._text = ''
+        self._idx = 0
+        self._eof = False
+
+    def _read(self):
+        """
+        Appends next chunk to text
+
+        @return False if there are no more chunks [bool]
+        """
+        if self._eof:
+            return False
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            tail = self._utf8.decode(b'', final=True)
+        elif isinstance(chunk, bytes):
+            tail = self._utf8.decode(chunk)
+        else:
+            tail = chunk
+        self._text = self._text[self._idx:] + tail
+        self._idx = 0
+        return True
+
+    def peek(self):
+        """
+        @return Next not whitespace char, '' at the end of text [str]
+        """
+        while True:
+            self._idx = _whitespace.match(self._text, self._idx).end()
+            if self._idx < len(self._text):
+                return self._text[self._idx]
+            if not self._read():
+                return ''
+
+    def expect(self, chars):
+        """
+        Skips next not whitespace char
+
+        @param chars Chars expected [str]
+        @return Char skipped [str]
+        @raise ValueError if char is not expected
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expecting one of '{}', got '{}'".format(
+                chars, char))
+
+        self._idx += 1
+        return char
+
+    def decode(self):
+        """
+        Decodes next JSON value
+
+        @raise ValueError
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._text, self._idx)
+            except ValueError:
+                # value may be cut by chunk end
+                if self._read():
+                    continue
+                raise
+
+            # number may be cut by chunk end
+            if end >= len(self._text) and self._read():
+                continue
+
+            self._idx = end
+            return value
+
+
+class DataBatches(object):
+    """
+    Iterator over batches of message 'data' list items decoded lazily.
+    Message fields placed after 'data' are added to fields
+    before last batch is returned
+    """
+
+    def __init__(self, stream, fields, batch_size):
+        self.fields = fields
+        self._stream = stream
+        self._batch_size = batch_size
+
+    def __iter__(self):
+        stream = self._stream
+        batch = []
+        if stream.peek() == ']':
+            stream.expect(']')
+        else:
+            while True:
+                batch.append(stream.decode())
+                if len(batch) >= self._batch_size:
+                    yield batch
+                    batch = []
+                if stream.expect(',]') == ']':
+                    break
+
+        while stream.expect(',}') == ',':
+            key = stream.decode()
+            stream.expect(':')
+            self.fields[key] = stream.decode()
+        if batch:
+            yield batch
+
+
+def parse_msg_batched(encoded, batch_size):
+    '''
+    Decodes message from JSON format like parse_msg, but message text
+    is decoded incrementally while chunks are read, so the whole text
+    is never held in memory.
+    'data' list of operations from BATCHED_OPERATIONS placed after
+    'operation' field is decoded lazily in batches, so the whole list
+    is never held in memory as python objects
+
+    @param encoded JSON encoded message [bytes or string]
+        or iterable over its chunks
+    @param batch_size Max number of items in batch [int]
+    @return Parsed message data in the form
+            (operation, node_id, data) [tuple],
+            where data is DataBatches instance if decoded lazily.
+            node_id placed after data is in data.fields then
+    @raise ValueError
+    @raise KeyError
+    '''
+
+    if isinstance(encoded, (bytes, str)):
+        encoded = (encoded, )
+    stream = JsonStream(encoded)
+    fields = dict()
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.expect('}')
+    else:
+        while True:
+            key = stream.decode()
+            stream.expect(':')
+            if key == 'data' and \
+                    fields.get('operation') in BATCHED_OPERATIONS and \
+                    stream.peek() == '[':
+                stream.expect('[')
+                return fields['operation'], fields.get('node_id', None), \
+                    DataBatches(stream, fields, batch_size)
+
+            fields[key] = stream.decode()
+            if stream.expect(',}') == '}':
+                break
+
+    return fields['operation'], fields.get('node_id', None), \
+        fields.get('data', None)
@@ -30,6 +30,7 @@ class WebSocketConnectionFactory(WebSocketClientFactory):
         self.on_disconnected = kwargs.pop('on_disconnected')
         self.message_id_to_skip = kwargs.pop('last_message_id')
         self.ssl_fingerprint = kwargs.pop('ssl_fingerprint', None)
+        self.messages_executor = kwargs.pop('messages_executor', None)
         super(WebSocketConnectionFactory, self).__init__(*args, **kwargs)
         self.setProtocolOptions(
             acceptMaskedServerFrames=False, maskClientFrames=False,
@@ -18,9 +18,11 @@
 #   
 ###############################################################################
 import logging
+from queue import Queue
 
 from autobahn.asyncio import WebSocketClientProtocol
-from service.signalling.signalling_protocol import parse_msg
+from service.signalling.signalling_protocol import parse_msg, \
+    parse_msg_batched, BATCHED_PARSE_MIN_SIZE, FILE_EVENTS_BATCH_SIZE
 
 from hashlib import sha256
 
@@ -43,23 +45,76 @@ class WebSocketConnectionProtocol(WebSocketClientProtocol):
     def onOpen(self):
         logger.info("WebSocket connection opened.")
         self._closing = False
+        self._frames_count = 0
+        self._stream = None
         self.factory.on_connected(self)
         self.factory.update_last_ping_time()
 
     def onMessage(self, payload, isBinary):
         self.factory.update_last_ping_time()
+        self._queue_message(self._on_message, payload)
+
+    def _queue_message(self, on_message, payload):
+        """
+        Passes message to messages executor.
+        Socket is read further meanwhile, so pings are answered while
+        messages are processed. File events consumer is waited for
+        by server proxy in executor thread
+        """
         try:
             if not self._closing:
                 message_id = self.factory.get_message_id()
                 self.factory.loop.run_in_executor(
-                    None, self._on_message, payload, message_id)
+                    self.factory.messages_executor,
+                    on_message, payload, message_id)
         except AttributeError as e:
             logger.warning("No attribute: %s", e)
         except RuntimeError as e:
             logger.warning("Possibly trying to process message "
                            "after executor shutdown. %s", e)
 
+    def onMessageBegin(self, isBinary):
+        self._frames_count = 0
+        self._stream = None
+        super(WebSocketConnectionProtocol, self).onMessageBegin(isBinary)
+
+    def onMessageFrameBegin(self, length):
+        super(WebSocketConnectionProtocol, self).onMessageFrameBegin(length)
+        self._frames_count += 1
+        if self._frames_count == 1 and length >= BATCHED_PARSE_MIN_SIZE \
+                and not self._closing:
+            # Big message is decoded while being received,
+            # its chunks are not collected
+            self._stream = Queue()
+            self._queue_message(self._on_message_stream, self._stream)
+
+    def onMessageFrameData(self, payload):
+        if self._stream is not None:
+            self.factory.update_last_ping_time()
+            self._stream.put(payload)
+        else:
+            super(WebSocketConnectionProtocol, self).onMessageFrameData(
+                payload)
+
+    def onMessageFrameEnd(self):
+        if self._stream is None:
+            super(WebSocketConnectionProtocol, self).onMessageFrameEnd()
+
+    def onMessageEnd(self):
+        if self._stream is not None:
+            self._end_stream()
+            self.factory.update_last_ping_time()
+        else:
+            super(WebSocketConnectionProtocol, self).onMessageEnd()
+
+    def _end_stream(self):
+        if self._stream is not None:
+            self._stream.put(None)
+            self._stream = None
+
     def onClose(self, wasClean, code, reason):
+        # message being received is not complete, its decoding fails
+        self._end_stream()
         logger.debug("WebSocket connection closed, wasClean: {} "
                      "code: {}, reason: {}.".format(wasClean, code, reason))
         if code == 1006 and "403 - Forbidden" in reason:
@@ -100,19 +155,43 @@ class WebSocketConnectionProtocol(WebSocketClientProtocol):
         if message_id <= self.factory.message_id_to_skip:
             return
 
-        # Try to parse message obtained
+        # Big messages are decoded incrementally, file events
+        # are decoded in batches while being processed
+        try:
+            if len(payload) >= BATCHED_PARSE_MIN_SIZE:
+                operation, node_id, data = parse_msg_batched(
+                    payload, FILE_EVENTS_BATCH_SIZE)
+            else:
+                operation, node_id, data = parse_msg(payload)
+        except Exception as e:
+            logger.error(
+                "Failed to parse message '%s' (%s)", payload[:1024], e)
+            return
+
+        self._process_message(operation, node_id, data, payload[:1024])
+
+    def _on_message_stream(self, stream, message_id):
+        if message_id <= self.factory.message_id_to_skip:
+            return
+
         try:
-            operation, node_id, data = parse_msg(payload)
+            operation, node_id, data = parse_msg_batched(
+                iter(stream.get, None), FILE_EVENTS_BATCH_SIZE)
         except Exception as e:
-            logger.error("Failed to parse message '%s' (%s)", payload, e)
+            logger.error("Failed to parse big message (%s)", e)
             return
+
+        self._process_message(
+            operation, node_id, data, "big message '{}'".format(operation))
+
+    def _process_message(self, operation, node_id, data, description):
         # Try to process message obtained
         try:
             self.factory.process_message(operation, node_id, data)
         except Exception as e:
             logger.error(
                 "Exception occured while processing message '%s' (%s)",
-                payload, e)
+                description, e)
 
     def get_message_id(self):
         return self.factory.get_message_id()
@@ -114,20 +114,23 @@ class StatsDB(object):
         finally:
             session.close()
 
-    def load_event(self):
+    def load_events(self, limit):
+        """
+        Returns list of (id, event string) for oldest events
+
+        @param limit Max number of events to load
+        """
         if not self._has_events:
-            return None, None
+            return []
 
         with self.create_session() as session:
-            event = session.query(Event)\
+            events = session.query(Event.id, Event.name)\
                 .order_by(Event.id)\
-                .limit(1)\
-                .one_or_none()
-            if event is None:
+                .limit(limit)\
+                .all()
+            if not events:
                 self._has_events = False
-                return None, None
-
-            return event.id, event.name
+            return events
 
     def save_event(self, event_str):
         self._has_events = True
@@ -135,10 +138,14 @@ class StatsDB(object):
             event = Event(name=event_str)
             session.add(event)
 
-    def delete_event(self, event_id):
+    def delete_events(self, first_id, last_id):
+        """
+        Deletes events with ids in range [first_id, last_id]
+        """
         with self.create_session() as session:
             session.query(Event)\
-                .filter(Event.id == event_id)\
+                .filter(Event.id >= first_id)\
+                .filter(Event.id <= last_id)\
                 .delete(synchronize_session=False)
 
     def get_installation_id(self):
@@ -87,7 +87,7 @@ class Tracker(QObject):
     _stop_session = Signal()
 
     def __init__(self, db_name, root='',
-                 address=None):
+                 address=None, batches=False):
         QObject.__init__(self)
 
         self._connect_slots()
@@ -103,6 +103,7 @@ class Tracker(QObject):
         self._session_info = {"_rx_ws": 0, "_rx_wd": 0, "_rx_wr": 0,
                               "_tx_ws": 0, "_tx_wd": 0, "_tx_wr": 0}
         self._address = address
+        self._batches = batches
 
         self._root = root
 
@@ -174,7 +175,8 @@ class Tracker(QObject):
             session_params = dict()
         logger.debug("Initializing usage statistics tracker...")
         self.tracking = statistics_tracking.Tracking(
-            self, data_base_path, tracking_server_address, self.on_session_stopped)
+            self, data_base_path, tracking_server_address,
+            self.on_session_stopped, self._batches)
         self._new_session(self._user_agent, version_extension, session_params)
         self._started = True
 
@@ -17,6 +17,8 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #   
 ###############################################################################
+import gzip
+import random
 import time
 from sortedcontainers import SortedDict
 from urllib.parse import quote
@@ -72,23 +74,89 @@ class Sender:
     request_timeout = 10
     read_timeout = 60
 
-    def __init__(self, server_address, session, on_event_sent_cb):
+    # Reply to batch request has to confirm number of events accepted
+    batch_accepted_header = 'X-Tracking-Accepted'
+
+    def __init__(self, server_address, session, on_events_sent_cb,
+                 batches=False):
+        """
+        @param server_address Stat server URL [str]
+        @param session Tracking session
+        @param on_events_sent_cb Callback called with range of events sent
+        @param batches Flag to send events in compressed batch requests,
+            stat server has to accept them [bool]
+        """
         self._server_address = server_address
         self._tracking_session = session
-        self._on_event_sent_cb = on_event_sent_cb
+        self._on_events_sent_cb = on_events_sent_cb
 
         self._requests_session = None
+        self._batches = batches
 
     def set_session(self, session):
         self._tracking_session = session
 
     @qt_run
-    def send(self, event_id, event_str):
-        success = self._tracking_session is not None
-        if success:
-            string_to_send = "?{}&{}".format(self._tracking_session, event_str)
-            success = self._send(string_to_send)
-        self._on_event_sent_cb(event_id, success)
+    def send(self, batch_key, events):
+        """
+        Sends events in one compressed request if batches are enabled,
+        or one request per event otherwise, or if server has not
+        confirmed batch. Calls on_events_sent_cb with range of
+        events ids acknowledged
+
+        @param batch_key Idempotency key, the same for batch retries [str]
+        @param events List of (event id, event string)
+        """
+        first_id = events[0][0]
+        last_id = None
+        session = self._tracking_session
+        if session is not None:
+            if self._batches:
+                if self._send_batch(session, batch_key, events):
+                    last_id = events[-1][0]
+            # batches are disabled if server has not confirmed batch
+            if not self._batches:
+                for event_id, event_str in events:
+                    if not self._send("?{}&{}".format(session, event_str)):
+                        break
+                    last_id = event_id
+        success = last_id == events[-1][0]
+        self._on_events_sent_cb(first_id, last_id or 0, success)
+
+    def _send_batch(self, session, batch_key, events):
+        body = gzip.compress("\n".join(
+            "{}&{}".format(session, event_str)
+            for _, event_str in events).encode())
+        headers = {
+            'User-Agent': session.user_agent,
+            'Content-Type': 'text/plain; charset=utf-8',
+            'Content-Encoding': 'gzip',
+            'Idempotency-Key': batch_key,
+        }
+        self._get_or_create_requests_session()
+        try:
+            res = self._requests_session.post(
+                self._server_address, data=body, headers=headers,
+                timeout=(self.request_timeout, self.read_timeout))
+        except Exception as e:
+            logger.error("Stat batch request failed due to %s", e)
+            return False
+
+        logger.debug("Stat batch of %s events (%s bytes) sent, status %s",
+                     len(events), len(body), res.status_code)
+        if not 200 <= res.status_code < 300:
+            return False
+
+        # events are acknowledged only if server confirms all of them
+        accepted = res.headers.get(self.batch_accepted_header)
+        if accepted != str(len(events)):
+            logger.warning("Stat server has not confirmed batch "
+                           "(accepted: %s), sending events one by one",
+                           accepted)
+            self._batches = False
+            return False
+
+        return True
 
     def _get_or_create_requests_session(self):
         if not self._requests_session:
@@ -166,12 +234,13 @@ class TrackingSession:
 class Tracking(QObject):
     SENDING_INTERVAL = 10 * 1000
     WAIT_INTERVAL = 5 * 60 * 1000
+    BATCH_SIZE = 500
 
-    _event_sent = Signal(int, bool)
+    _events_sent = Signal(int, int, bool)
     _send_next_event = Signal()
 
     def __init__(self, parent, data_base_path, server_address,
-                 on_session_stopped_cb):
+                 on_session_stopped_cb, batches=False):
         QObject.__init__(self, parent=parent)
 
         self._session = None
@@ -180,7 +249,10 @@ class Tracking(QObject):
         self._db = StatsDB(data_base_path)
 
         self._sender = Sender(
-            server_address, self._session, self.on_event_sent_cb)
+            server_address, self._session, self.on_events_sent_cb, batches)
+        # (first id, last id, idempotency key) of batch being sent
+        self._batch = None
+        self._failures = 0
 
         self._connect_slots()
 
@@ -192,7 +264,7 @@ class Tracking(QObject):
             self._on_send_next_event)
 
     def _connect_slots(self):
-        self._event_sent.connect(self._on_event_sent, Qt.QueuedConnection)
+        self._events_sent.connect(self._on_events_sent, Qt.QueuedConnection)
         self._send_next_event.connect(
             self._on_send_next_event, Qt.QueuedConnection)
 
@@ -242,37 +314,51 @@ class Tracking(QObject):
             return
 
         try:
-            event_id, event_str = self._db.load_event()
+            events = self._db.load_events(self.BATCH_SIZE)
         except Exception as e:
-            logger.warning("Can't load tracking event. Reason: %s", e)
-            event_id = None
-
-        if event_id:
-            self._sender.send(event_id, event_str)
+            logger.warning("Can't load tracking events. Reason: %s", e)
+            events = []
+
+        if events:
+            first_id, last_id = events[0][0], events[-1][0]
+            # retries of the same batch are sent with the same key
+            if not self._batch or self._batch[:2] != (first_id, last_id):
+                self._batch = (first_id, last_id, str(uuid4()))
+            self._sender.send(self._batch[2], events)
         else:
             self._sending_timer.setInterval(self.WAIT_INTERVAL)
             self._start_timer()
 
-    def on_event_sent_cb(self, event_id, success):
+    def on_events_sent_cb(self, first_id, last_id, success):
         if not self._session:
             return
 
-        self._event_sent.emit(event_id, success)
+        self._events_sent.emit(first_id, last_id, success)
 
-    def _on_event_sent(self, event_id, success):
-        if success:
+    def _on_events_sent(self, first_id, last_id, success):
+        if last_id:
             try:
-                self._db.delete_event(event_id)
+                self._db.delete_events(first_id, last_id)
             except Exception as e:
-                logger.warning("Can't delete tracking event %s. Reason: %s",
-                               event_id, e)
-                self._start_timer()
-                return
+                logger.warning("Can't delete tracking events %s-%s. "
+                               "Reason: %s", first_id, last_id, e)
+                success = False
 
+        if success:
+            self._batch = None
+            self._failures = 0
+            self._sending_timer.setInterval(self.SENDING_INTERVAL)
             self._send_next_event.emit()
         elif self._sending_enabled:
+            self._failures += 1
+            self._sending_timer.setInterval(self._get_backoff_interval())
             self._start_timer()
 
+    def _get_backoff_interval(self):
+        interval = min(self.SENDING_INTERVAL * 2 ** min(self._failures, 10),
+                       self.WAIT_INTERVAL)
+        return int(interval * random.uniform(0.5, 1.))
+
     def _start_timer(self):
         if not self._sending_timer.isActive():
             self._sending_timer.start()
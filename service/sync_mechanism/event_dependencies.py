@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+
+from service.events_db import File
+
+
+# Setup logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class EventDependencies(object):
+    """
+    Tells whether loaded event depends on folder events being processed.
+    Event may run only when no folder on the path to its file
+    (and to its destination folder for moves) is being created or moved,
+    so events in independent subtrees are processed in parallel.
+    Folders tree is read lazily from db session used for loading
+    and cached for the loading pass only
+    """
+
+    def __init__(self, session, folders_ids, folders_uuids):
+        """
+        Constructor
+
+        @param session Events db session used for loading
+        @param folders_ids Ids of folders having events in processing [set]
+        @param folders_uuids Uuids of these folders [set]
+        """
+        self._session = session
+        self._folders_ids = folders_ids
+        self._folders_uuids = folders_uuids
+        # folder id -> parent folder id
+        self._parents = dict()
+        # folder uuid -> folder id
+        self._ids = dict()
+
+    def is_blocked(self, event):
+        if not self._folders_ids:
+            return False
+
+        if event.folder_uuid:
+            if event.folder_uuid in self._folders_uuids:
+                return True
+            folder_id = self._get_folder_id(event.folder_uuid)
+            # unknown folder is probably being created
+            if folder_id is None or self._is_in_subtree(folder_id):
+                return True
+
+        file = event.file
+        return bool(file) and file.folder_id is not None and \
+            self._is_in_subtree(file.folder_id)
+
+    def _is_in_subtree(self, folder_id):
+        visited = set()
+        while folder_id is not None:
+            if folder_id in self._folders_ids:
+                return True
+            if folder_id in visited:
+                logger.warning("Folders loop found for folder %s", folder_id)
+                return True
+            visited.add(folder_id)
+            if folder_id not in self._parents:
+                row = self._session.query(File.folder_id) \
+                    .filter(File.id == folder_id) \
+                    .one_or_none()
+                if not row:
+                    return True
+                self._parents[folder_id] = row.folder_id
+            folder_id = self._parents[folder_id]
+        return False
+
+    def _get_folder_id(self, folder_uuid):
+        if folder_uuid not in self._ids:
+            row = self._session.query(File.id) \
+                .filter(File.uuid == folder_uuid) \
+                .one_or_none()
+            self._ids[folder_uuid] = row.id if row else None
+        return self._ids[folder_uuid]
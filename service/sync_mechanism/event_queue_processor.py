@@ -63,6 +63,7 @@ from .event_strategies.exceptions import FolderUUIDNotFound, SkipEventForNow, \
     RenameDstPathFailed, SkipExcludedMove, ParentDeleted
 from .event_strategies.utils import basename
 from .events_loader import EventsLoader, EVENTS_QUERY_LIMIT
+from .event_dependencies import EventDependencies
 
 
 # Setup logging
@@ -70,9 +71,15 @@ logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
 MIN_EVENTS_PROCESSING = 50
+# loading window is sized to be consumed in about this time
+LOADING_WINDOW_PERIOD = 2.
+MAX_LOADING_WINDOW = EVENTS_QUERY_LIMIT * 10
 
 class EventQueueProcessor(object):
     workers_count = max(multiprocessing.cpu_count(), 1) * 2
+    # local events mostly wait for web server replies,
+    # so they are registered in own lane with more requests in flight
+    register_workers_count = max(workers_count, 16)
 
     def __init__(
             self,
@@ -129,7 +136,9 @@ class EventQueueProcessor(object):
 
         self._thread = None
         self._remote_msg_thread = None
-        self._events_queue = daque.Daque(self.workers_count)
+        self._events_queue = daque.Daque(
+            self.workers_count, self.register_workers_count,
+            is_io=lambda s: isinstance(s, LocalEventStrategy))
         self._remote_packs_queue = None
         self._last_remote_pack = None
 
@@ -152,6 +161,10 @@ class EventQueueProcessor(object):
 
         self.events_added = threading.Event()
 
+        self._loading_window = EVENTS_QUERY_LIMIT
+        self._last_loading_time = 0
+        self._last_loaded_count = 0
+
         self._events_loader = EventsLoader(
             self, self._db, self._fs, self._excluded_dirs)
 
@@ -802,7 +815,7 @@ class EventQueueProcessor(object):
                 read_only=True) as session:
             try:
                 if load_local_events_count:
-                    # Count <= load_local_events_count <= EVENTS_QUERY_LIMIT
+                    # Count <= load_local_events_count
                     local_events = self._events_loader.load_local_events(
                         session,
                         events_count=load_local_events_count,
@@ -835,12 +848,16 @@ class EventQueueProcessor(object):
                 logger.debug("appending events from DB to queue...")
 
             with self._processing_events_lock:
-                remote_folders_in_processing = any(
-                    s.event and s.event.is_folder and
-                    isinstance(s, RemoteEventStrategy)
-                    for s in self._processing_events.values())
-            self._add_loaded_events_for_processing(
-                events, remote_folders_in_processing)
+                remote_folders_in_processing = [
+                    s for s in self._processing_events.values()
+                    if s.event and s.event.is_folder and
+                    isinstance(s, RemoteEventStrategy)]
+                dependencies = EventDependencies(
+                    session,
+                    set(s.file_id for s in remote_folders_in_processing),
+                    set(s.event.file_uuid
+                        for s in remote_folders_in_processing))
+            self._add_loaded_events_for_processing(events, dependencies)
 
             self._add_excluded_moves_waiting(local_events)
 
@@ -856,8 +873,7 @@ class EventQueueProcessor(object):
                 self._clean_trash()
             return len(events)
 
-    def _add_loaded_events_for_processing(self, events,
-                                          remote_folders_in_processing):
+    def _add_loaded_events_for_processing(self, events, dependencies):
         for event in events:
             strategy = create_strategy_from_database_event(
                 self._db, event, self._license_type,
@@ -868,7 +884,7 @@ class EventQueueProcessor(object):
                 if strategy.event.file_id in self._processing_local_files \
                         or not strategy.event.is_folder and \
                         isinstance(strategy, RemoteEventStrategy) and \
-                        remote_folders_in_processing:
+                        dependencies.is_blocked(strategy.event):
                     continue
             self._add_event_for_processing(strategy)
 
@@ -924,7 +940,8 @@ class EventQueueProcessor(object):
         logger.info("Starting events queue processing thread")
         self._events_queue_worker_idle = False
         self._on_events_queue_worker_start()
-        executor = ThreadPoolExecutor(max_workers=self.workers_count)
+        executor = ThreadPoolExecutor(
+            max_workers=self.workers_count + self.register_workers_count)
         should_load_events = True
         while True:
             try:
@@ -972,7 +989,8 @@ class EventQueueProcessor(object):
                 future = executor.submit(self._process_single_event, strategy)
                 # will wait getting next event above max_workers
                 # until some event is processed
-                future.add_done_callback(self._events_queue.task_done)
+                future.add_done_callback(
+                    lambda f, s=strategy: self._events_queue.task_done(f, s))
 
             except OperationalError as e:
                 self.possibly_sync_folder_is_removed.emit()
@@ -1018,8 +1036,8 @@ class EventQueueProcessor(object):
             processing_local_files = tuple(
                 e.file_id for e in processing_local_events)
 
-            load_local_events_count = \
-                EVENTS_QUERY_LIMIT - len(processing_local_files)
+            load_local_events_count = max(
+                0, self._loading_window - len(processing_local_files))
 
             if self._loading_remotes_allowed:
                 processing_remote_events = filter(
@@ -1029,7 +1047,7 @@ class EventQueueProcessor(object):
                     e.file_id for e in processing_remote_events)
 
                 load_remote_events_count = \
-                    EVENTS_QUERY_LIMIT * 3 - len(processing_remote_files)
+                    self._loading_window * 3 - len(processing_remote_files)
                 load_remote_events_count = max(0, load_remote_events_count)
             else:
                 load_remote_events_count = 0
@@ -1055,8 +1073,24 @@ class EventQueueProcessor(object):
                         (load_local_events_count and self._loading_remotes_allowed):
                     logger.debug("Clear events_added")
                     self.events_added.clear()
+            self._adapt_loading_window(loaded_count)
         return should_load, loaded_count
 
+    def _adapt_loading_window(self, loaded_count):
+        # events are loaded when queue is empty again, so previous portion
+        # was consumed since previous loading
+        now = time()
+        elapsed = now - self._last_loading_time
+        if self._last_loaded_count and elapsed > 0:
+            rate = self._last_loaded_count / elapsed
+            self._loading_window = int(min(
+                max(rate * LOADING_WINDOW_PERIOD, EVENTS_QUERY_LIMIT),
+                MAX_LOADING_WINDOW))
+            logger.debug("Events consumption rate %.1f/s, "
+                         "loading window %s", rate, self._loading_window)
+        self._last_loading_time = now
+        self._last_loaded_count = loaded_count
+
     def _set_events_queue_worker_idle(self):
         logger.debug("_set_events_queue_worker_idle")
         self._events_queue_worker_idle = True
@@ -350,7 +350,8 @@ class LocalEventStrategy(EventStrategy):
                     event.file_hash,
                     event.file_hash_before_event,
                     reason="register. Event {}. File {}"
-                        .format(event.uuid, event.file_name))
+                        .format(event.uuid, event.file_name),
+                    file_uuid=event.file_uuid)
 
         if 'rev_diff_file_uuid' in data:
             assert event.rev_diff_file_uuid
@@ -360,7 +361,8 @@ class LocalEventStrategy(EventStrategy):
                     event.file_hash_before_event,
                     event.file_hash,
                     reason="register. Event {}. File {}"
-                        .format(event.uuid, event.file_name))
+                        .format(event.uuid, event.file_name),
+                    file_uuid=event.file_uuid)
 
     @atomic
     def process_conflict(self,
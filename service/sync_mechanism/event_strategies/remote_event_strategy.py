@@ -22,7 +22,7 @@
 import logging
 import time
 
-from os.path import join, exists
+from os.path import join
 
 from service.events_db import File, Event
 from service.sync_mechanism.event_strategies.exceptions import EventAlreadyAdded, FolderUUIDNotFound
@@ -359,7 +359,8 @@ class RemoteEventStrategy(EventStrategy):
                     active=False,
                     reason="add_to_local_database. Event {}. File {}"
                         .format(event.uuid, event.file_name),
-                    postponed=True)
+                    postponed=True,
+                    file_uuid=event.file_uuid)
             if event.file_size_before_event:
                 patches_storage.add_reverse_patch(
                     event.rev_diff_file_uuid, event.file_hash_before_event,
@@ -367,7 +368,8 @@ class RemoteEventStrategy(EventStrategy):
                     active=False,
                     reason="add_to_local_database. Event {}. File {}"
                         .format(event.uuid, event.file_name),
-                    postponed=True)
+                    postponed=True,
+                    file_uuid=event.file_uuid)
 
     def _process_folder_move_delete_adding(self, event, fs, events_queue,
                                            excluded_dirs, already_deleted,
@@ -500,7 +502,7 @@ class RemoteEventStrategy(EventStrategy):
             else self.event.file_hash_before_event
         path = join(get_copies_dir(fs.get_root()), hash)
 
-        if exists(path):
+        if self._copies_storage.ensure_copy_file(hash):
             self.download_success = True
             return self.download_success
         else:
@@ -53,20 +53,20 @@ class EventsLoader(object):
             remote_not_creations_events = []
             excluded_events = []
         else:
-            # Count <= EVENTS_QUERY_LIMIT
+            # Count <= events_count
             remote_creations_events = \
                 self.load_remote_creations_events(
                     session, events_count, exclude_files)
             events_count -= len(remote_creations_events)
 
-            # Count <= EVENTS_QUERY_LIMIT
+            # Count <= events_count
             remote_not_creations_events = \
                 self.load_remote_not_creations_events(
                     remote_creations_events, session,
                     events_count, exclude_files)
             events_count -= len(remote_not_creations_events)
 
-            # Count <= EVENTS_QUERY_LIMIT
+            # Count <= events_count
             excluded_events = self.load_excluded_events(
                 session, events_count, exclude_files)
 
@@ -89,21 +89,24 @@ class EventsLoader(object):
             """
                 select final_e.* from events final_e
                 where final_e.id in (
-                    select min(e.id) from events e, files f
-                    where f.id = e.file_id
+                    select min(e.id) from pending_files p
+                    cross join files f cross join events e
+                    where f.id = p.file_id
+                    and e.file_id = f.id
                     and not f.excluded
                     and e.file_id not in ({})
                     and e.state in ('occured', 'conflicted')
                     and (
                         f.folder_id is null
-                        or f.folder_id in (
-                            select processed_f.id from files processed_f, 
+                        or exists (
+                            select 1 from files processed_f,
                             events processed_e
-                            where processed_f.is_folder
+                            where processed_f.id = f.folder_id
+                            and processed_f.is_folder
                             and not processed_f.excluded
                             and processed_f.uuid is not null
                             and processed_f.event_id = processed_e.id
-                            and processed_e.state not in 
+                            and processed_e.state not in
                             ('occured', 'conflicted')
                         )
                     )
@@ -113,7 +116,7 @@ class EventsLoader(object):
                 limit {}
             """.format(
                     ','.join(map(str, exclude_files)),
-                    min(events_count, EVENTS_QUERY_LIMIT)
+                    events_count
             ))).all()
         if local_events:
             logger.debug(
@@ -129,8 +132,10 @@ class EventsLoader(object):
             """
                 select final_e.* from events final_e
                 where final_e.id in (
-                    select max(unhandled_e.id) from events unhandled_e, files unhandled_f
-                    where unhandled_f.id = unhandled_e.file_id
+                    select max(unhandled_e.id) from pending_files p
+                    cross join files unhandled_f cross join events unhandled_e
+                    where unhandled_f.id = p.file_id
+                    and unhandled_e.file_id = unhandled_f.id
                     and not unhandled_f.excluded
                     and unhandled_f.is_folder
                     and unhandled_e.file_id not in ({})
@@ -160,15 +165,14 @@ class EventsLoader(object):
                 )
                 and (
                     final_e.folder_uuid is null
-                    or final_e.folder_uuid in (
-                        select processed_f.uuid from files processed_f, events processed_e
-                        where processed_f.is_folder
-                        and processed_f.id = processed_e.file_id
+                    or exists (
+                        select 1 from files processed_f
+                        where processed_f.uuid = final_e.folder_uuid
+                        and processed_f.is_folder
                         and not processed_f.excluded
-                        and processed_f.event_id in (
+                        and processed_f.event_id = (
                             select max(existing_e.id) from events existing_e
-                            where existing_e.is_folder
-                            group by existing_e.file_id
+                            where existing_e.file_id = processed_f.id
                         )
                     )
                     or final_e.folder_uuid in (
@@ -195,13 +199,15 @@ class EventsLoader(object):
             return []
 
         start_time = time()
-        limit = min(EVENTS_QUERY_LIMIT, events_count)
+        limit = events_count
         remote_creations_events = session.query(Event).from_statement(sql_text(
             """
                 select p.* from events p
                 where p.id in (
-                    select max(e.id) from events e, files f
-                    where f.id = e.file_id
+                    select max(e.id) from pending_files p
+                    cross join files f cross join events e
+                    where f.id = p.file_id
+                    and e.file_id = f.id
                     and not f.excluded
                     and not f.is_folder
                     and f.event_id is null
@@ -232,7 +238,7 @@ class EventsLoader(object):
             return []
 
         start_time = time()
-        limit = min(EVENTS_QUERY_LIMIT, events_count)
+        limit = events_count
         remote_creations_events_files_ids = [
             e.file.id for e in remote_creations_events]
         remote_creations_events_files_ids.extend(exclude_files)
@@ -245,8 +251,10 @@ class EventsLoader(object):
             """
                 select final_e.* from events final_e
                 where final_e.id in (
-                    select min(e.id) from events e, files f
-                    where f.id = e.file_id
+                    select min(e.id) from pending_files p
+                    cross join files f cross join events e
+                    where f.id = p.file_id
+                    and e.file_id = f.id
                     and not f.excluded
                     and not f.is_folder
                     and e.file_id not in ({})
@@ -304,7 +312,7 @@ class EventsLoader(object):
 
         offset = 0
         excluded_events = []
-        limit = min(EVENTS_QUERY_LIMIT, events_count)
+        limit = events_count
         while True:
             excluded_portion = session.query(Event).from_statement(sql_text(
                 """
@@ -315,9 +323,9 @@ class EventsLoader(object):
                             select moved_file.id from events move_event, files moved_file 
                             where moved_file.id = move_event.file_id
                             and move_event.id in (
-                                select max(event.id) from events event, files file
-                                where file.id = event.file_id
-                                and file.excluded
+                                select max(event.id) from files file cross join events event
+                                where file.excluded = 1
+                                and event.file_id = file.id
                                 and event.type == 'move'
                                 group by file.id
                             )
@@ -512,9 +520,9 @@ class EventsLoader(object):
                         select moved_file.id from events move_event, files moved_file 
                         where moved_file.id = move_event.file_id
                         and move_event.id in (
-                            select max(event.id) from events event, files file
-                            where file.id = event.file_id
-                            and file.excluded
+                            select max(event.id) from files file cross join events event
+                            where file.excluded = 1
+                            and event.file_id = file.id
                             and event.type == 'move'
                             group by file.id
                         )
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import logging
+import threading
+from collections import namedtuple
+from time import time, sleep
+
+from sqlalchemy.exc import OperationalError
+
+from common.async_utils import run_daemon
+
+
+# Setup logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+PathStatus = namedtuple('PathStatus', ['uuid', 'is_folder', 'is_offline'])
+
+
+class PathStatusSnapshot(object):
+    """
+    In-memory snapshot of per-path status (uuid, folder flag,
+    offline flag) built from events db.
+    Snapshot is built as a whole at start and after clear() (resync).
+    After that sync mechanism reports changed paths via invalidate_path()
+    and invalidate_uuid() and background thread updates only those paths
+    with their children, not more often than once per min_update_interval.
+    Snapshot dicts are changed by that thread only, single dict operations
+    are atomic, so no lock is needed for queries.
+    Paths changed by user actions are marked stale at once via
+    invalidate_uuid(), queries for them raise KeyError (so callers use db)
+    until update started after the change is applied
+    """
+
+    min_update_interval = 1.0
+    # more changed paths are applied by full build, as it is cheaper
+    max_update_paths = 500
+
+    def __init__(self, db):
+        self._db = db
+        # relative path -> PathStatus, replaced as a whole on full build
+        self._statuses = None
+        # uuid -> relative path
+        self._paths_by_uuid = dict()
+        # relative path -> set of children relative paths
+        self._children = dict()
+        # paths and uuids changed since update started, '' path
+        # for full build
+        self._changed_paths = set()
+        self._changed_uuids = set()
+        # paths (with children) changed after update started,
+        # '' for whole snapshot
+        self._stale_paths = frozenset()
+        self._stale_version = 0
+        self._changes_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stopped = True
+        self._thread = None
+        self._last_update_time = 0
+        # incremented on clear to drop snapshots being built
+        self._generation = 0
+
+    def start(self):
+        with self._changes_lock:
+            self._changed_paths.add('')
+        self._dirty.set()
+        if not self._stopped:
+            return
+
+        self._stopped = False
+        self._thread = self._update_worker()
+
+    def stop(self):
+        self._stopped = True
+        self._dirty.set()
+
+    def clear(self):
+        self._generation += 1
+        self._statuses = None
+        self._paths_by_uuid = dict()
+        self._children = dict()
+        with self._changes_lock:
+            self._changed_paths = set()
+            self._changed_uuids = set()
+            self._stale_paths = frozenset()
+
+    def invalidate_path(self, path):
+        """
+        Marks relative path given and its children as outdated.
+        To be called after changes committed
+
+        @param path Relative path of file or folder [str]
+        """
+        with self._changes_lock:
+            self._changed_paths.add(self._key(path))
+        self._dirty.set()
+
+    def invalidate_uuid(self, uuid):
+        """
+        Marks path of file or folder with uuid given and its children
+        as outdated at once. To be called after changes committed
+
+        @param uuid File or folder uuid, None for sync directory root [str]
+        """
+        path = self._paths_by_uuid.get(uuid, '') if uuid else ''
+        with self._changes_lock:
+            if uuid:
+                self._changed_uuids.add(uuid)
+            else:
+                self._changed_paths.add('')
+            self._stale_version += 1
+            self._stale_paths = self._stale_paths | {path}
+        self._dirty.set()
+
+    def is_ready(self):
+        return self._statuses is not None
+
+    def get(self, path):
+        """
+        Returns PathStatus for relative path given, None if path is unknown.
+        Raises KeyError if snapshot is not ready yet
+        """
+        statuses = self._statuses
+        key = self._key(path)
+        if statuses is None or self._is_stale(key):
+            raise KeyError(path)
+
+        return statuses.get(key)
+
+    def get_many(self, paths):
+        statuses = self._statuses
+        keys = [self._key(path) for path in paths]
+        if statuses is None or any(map(self._is_stale, keys)):
+            raise KeyError(paths)
+
+        return [statuses.get(key) for key in keys]
+
+    @staticmethod
+    def _key(path):
+        return path.replace('\\', '/').strip('/')
+
+    @staticmethod
+    def _parent(key):
+        return key.rpartition('/')[0]
+
+    def _is_stale(self, key):
+        return any(not stale or key == stale or key.startswith(stale + '/')
+                   for stale in self._stale_paths)
+
+    @run_daemon
+    def _update_worker(self):
+        logger.debug("Path status snapshot worker started")
+        while not self._stopped:
+            self._dirty.wait()
+            if self._stopped:
+                break
+
+            delay = self._last_update_time + self.min_update_interval - \
+                time()
+            if delay > 0:
+                # collect more changes into one update
+                sleep(delay)
+            self._dirty.clear()
+            self._last_update_time = time()
+            generation = self._generation
+            with self._changes_lock:
+                paths, uuids = self._changed_paths, self._changed_uuids
+                self._changed_paths, self._changed_uuids = set(), set()
+                stale_version = self._stale_version
+            try:
+                if self._statuses is None or '' in paths or \
+                        len(paths) + len(uuids) > self.max_update_paths:
+                    statuses = self._build()
+                    if generation == self._generation:
+                        self._publish(statuses)
+                else:
+                    self._update(paths, uuids, generation)
+                if generation == self._generation:
+                    with self._changes_lock:
+                        # no paths changed while updating
+                        if stale_version == self._stale_version:
+                            self._stale_paths = frozenset()
+            except OperationalError as e:
+                logger.debug("Can't update path status snapshot (%s)", e)
+                self._restore_changes(paths, uuids)
+                self._dirty.set()
+            except Exception as e:
+                logger.warning("Can't update path status snapshot (%s)", e)
+                self._restore_changes(paths, uuids)
+        logger.debug("Path status snapshot worker stopped")
+
+    def _restore_changes(self, paths, uuids):
+        with self._changes_lock:
+            self._changed_paths |= paths
+            self._changed_uuids |= uuids
+
+    def _build(self):
+        start_time = time()
+        statuses = self._make_statuses(self._db.get_existing_files_statuses())
+        logger.debug("Built path status snapshot for %s paths in %.3f sec",
+                     len(statuses), time() - start_time)
+        return statuses
+
+    def _update(self, paths, uuids, generation):
+        start_time = time()
+        statuses = self._statuses
+        # moved or deleted files are found by uuid known for old path
+        for path in paths:
+            status = statuses.get(path)
+            if status:
+                uuids.add(status.uuid)
+        roots = set(paths)
+        for uuid in uuids:
+            old_path = self._paths_by_uuid.get(uuid)
+            if old_path is not None:
+                roots.add(old_path)
+            new_path = self._db.get_file_path_by_uuid(uuid)
+            if new_path:
+                roots.add(self._key(new_path))
+        # children are updated with their parents
+        roots = sorted(roots)
+        roots = [root for i, root in enumerate(roots)
+                 if not any(root.startswith(parent + '/')
+                            for parent in roots[:i])]
+
+        updates = []
+        for root in roots:
+            rows = self._db.get_subtree_statuses(root)
+            parent_ids = set(row[1] for row in rows) - \
+                set(row[0] for row in rows)
+            updates.append((root, self._make_statuses(
+                rows, parent_ids=parent_ids, parent_path=self._parent(root))))
+        if generation != self._generation:
+            return
+
+        for root, root_statuses in updates:
+            self._remove(root)
+            self._add(root_statuses)
+        logger.debug("Updated path status snapshot for %s paths "
+                     "in %.3f sec", len(roots), time() - start_time)
+
+    @staticmethod
+    def _make_statuses(rows, parent_ids=(), parent_path=''):
+        """
+        Returns relative path -> PathStatus dict for rows given.
+        Rows of files in deleted folders are skipped
+
+        @param rows (id, folder_id, name, uuid, is_folder, is_offline)
+            tuples
+        @param parent_ids Ids of folders with parent_path,
+            rows are in sync directory root if not given
+        @param parent_path Relative path of parent folders [str]
+        """
+        by_id = {row[0]: row for row in rows}
+        paths = {parent_id: parent_path for parent_id in parent_ids}
+
+        def get_path(file_id):
+            path = paths.get(file_id)
+            if path is not None:
+                return path
+
+            chain = []
+            while file_id is not None and file_id not in paths:
+                row = by_id.get(file_id)
+                if row is None:
+                    # parent folder is deleted
+                    for chain_id in chain:
+                        paths[chain_id] = False
+                    return False
+                chain.append(file_id)
+                file_id = row[1]
+            parent_path = paths[file_id] if file_id is not None else ''
+            for chain_id in reversed(chain):
+                if parent_path is False:
+                    paths[chain_id] = False
+                    continue
+                name = by_id[chain_id][2]
+                parent_path = '/'.join((parent_path, name)) \
+                    if parent_path else name
+                paths[chain_id] = parent_path
+            return paths[chain[0]]
+
+        statuses = dict()
+        for file_id, _, _, uuid, is_folder, is_offline in rows:
+            path = get_path(file_id)
+            if path:
+                statuses[path] = PathStatus(
+                    uuid, bool(is_folder), bool(is_offline))
+        return statuses
+
+    def _publish(self, statuses):
+        paths_by_uuid = dict()
+        children = dict()
+        for path, status in statuses.items():
+            paths_by_uuid[status.uuid] = path
+            children.setdefault(self._parent(path), set()).add(path)
+        self._paths_by_uuid = paths_by_uuid
+        self._children = children
+        # reference assignment is atomic, readers see old or new snapshot
+        self._statuses = statuses
+
+    def _remove(self, path):
+        status = self._statuses.pop(path, None)
+        if status is not None and \
+                self._paths_by_uuid.get(status.uuid) == path:
+            del self._paths_by_uuid[status.uuid]
+        siblings = self._children.get(self._parent(path))
+        if siblings is not None:
+            siblings.discard(path)
+        for child in self._children.pop(path, ()):
+            self._remove(child)
+
+    def _add(self, statuses):
+        for path, status in statuses.items():
+            self._statuses[path] = status
+            self._paths_by_uuid[status.uuid] = path
+            self._children.setdefault(self._parent(path), set()).add(path)
@@ -24,12 +24,13 @@ import os
 import os.path as op
 import time
 
+from collections import deque
 from contextlib import contextmanager
 from threading import RLock
 
 from PySide2.QtCore import QObject, QThread, Qt, QTimer
 from PySide2.QtCore import Signal as pyqtSignal
-from service.network.leakybucket import ThreadSafeLeakyBucket
+from service.network.leakybucket import TokenBucket
 
 from service.events_db import EventsDbBusy, FileNotFound
 from common.async_qt import qt_run
@@ -54,6 +55,7 @@ from common.translator import tr
 from common.path_utils import is_contained_in_dirs
 
 from .event_queue_processor import EventQueueProcessor
+from .path_status_snapshot import PathStatusSnapshot
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -122,6 +124,8 @@ class Sync(QObject):
 
     events_check_after_checked_interval = 30 * 60 * 1000
     events_check_after_online_interval = 60 * 1000
+    # Max number of remote events batches obtained but not processed yet
+    max_pending_remote_packs = 4
 
     def __init__(self, cfg, web_api, db, ss_client,
                  get_sync_dir_size, tracker=None, parent=None,
@@ -146,7 +150,10 @@ class Sync(QObject):
         self._get_sync_dir_size = get_sync_dir_size
         self._tracker = tracker
         self.first_start = True
-        self._max_remote_event_received = 0
+        # Max server event id processed by event queue
+        self._max_remote_event_processed = 0
+        # Last event ids of remote packs put to event queue
+        self._pending_remote_packs = deque()
 
         self._init_connectivity()
 
@@ -195,6 +202,8 @@ class Sync(QObject):
         self._alert_intervals = [1 * 60, 5 * 60, 10 * 60, 30 * 60, 60 * 60]
         self._alert_info = dict()
 
+        self._status_snapshot = PathStatusSnapshot(self._db)
+
         self._connect_signals()
 
     def _init_connectivity(self):
@@ -215,6 +224,8 @@ class Sync(QObject):
     def _connect_ss_slots(self):
         self._ss_client.file_events.connect(
             self._on_remote_file_event_messages_cb, Qt.QueuedConnection)
+        self._ss_client.set_max_pending_file_events(
+            self.max_pending_remote_packs)
         self._ss_client.patches_info.connect(
             self._patches_info_obtained, Qt.QueuedConnection)
         self._ss_client.min_stored_event.connect(
@@ -411,18 +422,23 @@ class Sync(QObject):
 
     def _on_remote_file_event_messages_cb(self, events, node_id):
         logger.info("Obtained %s event(s)", len(events))
+        pack_queued = False
         with self._remote_events_lock:
             self._waiting_file_events = False
             if events or self._loading_missed_events:
                 try:
                     self._event_queue.append_messages_from_remote_peer(events)
-                    if events and events[-1]['event_id'] > \
-                            self._max_remote_event_received:
-                        self._max_remote_event_received = events[-1]['event_id']
+                    if events:
+                        self._pending_remote_packs.append(
+                            events[-1]['event_id'])
+                        pack_queued = True
                 except Exception:
                     handle_exception("Can't put received remote event to queue.")
             if not events:
                 self._loading_missed_events = False
+        if not pack_queued:
+            # only not empty packs are reported as processed
+            self._ss_client.file_events_consumed()
         self._remote_file_event_messages.emit(node_id)
 
     def _on_remote_file_event_messages(self, node_id):
@@ -461,8 +477,8 @@ class Sync(QObject):
                     self._events_check_timer.start()
                     return
             else:
-                max_server_event_id = self._max_remote_event_received
-                max_checked_server_event_id = self._max_remote_event_received
+                max_server_event_id = self._max_remote_event_processed
+                max_checked_server_event_id = self._max_remote_event_processed
                 events_count = 0
 
             logger.debug("max_server_event_id %s, max_checked_server_event_id %s, events_count %s",
@@ -477,6 +493,12 @@ class Sync(QObject):
         self._update_status()
 
     def _on_remote_pack_processed(self, events_num):
+        self._ss_client.file_events_consumed()
+        with self._remote_events_lock:
+            if self._pending_remote_packs:
+                last_event_id = self._pending_remote_packs.popleft()
+                if last_event_id > self._max_remote_event_processed:
+                    self._max_remote_event_processed = last_event_id
         if not self._started:
             return
         logger.debug("_on_remote_pack_processed %s", events_num)
@@ -509,6 +531,7 @@ class Sync(QObject):
 
         self._download_manager.resume_all_downloads()
         self._event_queue.start(self.first_start)
+        self._status_snapshot.start()
         if self._patches_storage:
             self._patches_storage.start()
 
@@ -535,8 +558,9 @@ class Sync(QObject):
     def stop(self):
         logger.debug("Stop")
         self._stop(cancel_downloads=True, clear_queue=True)
+        self._status_snapshot.clear()
         with self._remote_events_lock:
-            self._max_remote_event_received = 0
+            self._max_remote_event_processed = 0
 
     def _stop(self, cancel_downloads=False, clear_queue=False):
         if cancel_downloads:
@@ -545,6 +569,11 @@ class Sync(QObject):
 
         if clear_queue and self._event_queue:
             self._event_queue.clear_queue()
+            with self._remote_events_lock:
+                self._pending_remote_packs.clear()
+        # remote packs are not processed while stopped,
+        # so do not wait for them
+        self._ss_client.reset_file_events_flow()
 
         if not self._started:
             logger.debug("Already stopped")
@@ -648,16 +677,25 @@ class Sync(QObject):
 
         logger.info("initialize module monitor")
         self._root = FilePath(self._cfg.sync_directory)
+        if self._copies_storage:
+            # old instance must not write counts after new one loads them
+            self._copies_storage.close()
         self._copies_storage = Copies(
             self._root, self._db_file_created_cb,
-            extended_logging=self._cfg.copies_logging)
+            extended_logging=self._cfg.copies_logging,
+            chunk_store=self._cfg.copies_chunk_store)
         self._patches_storage = Patches(
             self._root, self._copies_storage,
             self._tracker, db_file_created_cb=self._db_file_created_cb,
             extended_logging=self._cfg.copies_logging,
-            events_db=self._db)
+            events_db=self._db,
+            chunking=self._cfg.patch_chunking)
         self._connect_copies_patches_signals()
 
+        # connectivity initializes in its own thread while
+        # filesystem monitor is being set up here
+        connectivity_started = self._start_connectivity()
+
         # clear excluded dirs if any to migrate on smart sync
         self._migrate_from_selective_to_smart_sync()
         self._excluded_dirs_relpaths = self._cfg.excluded_dirs
@@ -678,7 +716,7 @@ class Sync(QObject):
             db_file_created_cb=self._db_file_created_cb
         )
 
-        self._re_start_downloads()
+        self._re_start_downloads(connectivity_started)
         self._connect_fs_signals()
         self._connect_disk_full_signals()
 
@@ -721,7 +759,19 @@ class Sync(QObject):
         self._patches_storage.possibly_sync_folder_is_removed.connect(
             self.check_if_sync_folder_is_removed)
 
-    def _re_start_downloads(self):
+    def _start_connectivity(self):
+        if self._connectivity_service_thread.isRunning():
+            return False
+
+        upload_limiter = self._create_limiter(
+            self._cfg.upload_limit, DOWNLOAD_CHUNK_SIZE * 2)
+        self._connectivity_service_thread.started.connect(
+            lambda: self._connectivity_service.set_upload_limiter(
+                upload_limiter))
+        self._connectivity_service_thread.start()
+        return True
+
+    def _re_start_downloads(self, connectivity_started=False):
         if self._download_manager:
             self._connectivity_service.disconnect_ss_slots.emit()
             self._download_manager.quit.emit()
@@ -739,19 +789,12 @@ class Sync(QObject):
 
         download_limiter = self._create_limiter(
             self._cfg.download_limit, DOWNLOAD_PART_SIZE)
-        upload_limiter = self._create_limiter(
-            self._cfg.upload_limit, DOWNLOAD_CHUNK_SIZE * 2)
 
         self._patches_storage.set_download_manager(self._download_manager)
 
         self._connect_downloads_signals()
 
-        if not self._connectivity_service_thread.isRunning():
-            self._connectivity_service_thread.started.connect(
-                lambda: self._connectivity_service.set_upload_limiter(
-                    upload_limiter))
-            self._connectivity_service_thread.start()
-        else:
+        if not connectivity_started:
             self._connectivity_service.connect_ss_slots.emit()
 
         if not self._download_manager_thread.isRunning():
@@ -838,6 +881,9 @@ class Sync(QObject):
         self._event_queue.event_processed.connect(
             lambda rel_path, is_dir, mod_time, is_loc:
             self.sync_dir_size_changed.emit())
+        self._event_queue.event_processed.connect(
+            lambda rel_path, is_dir, mod_time, is_loc:
+            self._status_snapshot.invalidate_path(rel_path))
         self._event_queue.change_excluded_dirs.connect(
             lambda dirs_to_delete, dirs_to_add:
             self._change_excluded_dirs.emit(dirs_to_delete, dirs_to_add))
@@ -894,7 +940,7 @@ class Sync(QObject):
             else chunk_size)
 
         return (
-            ThreadSafeLeakyBucket(capacity, limit, time.time)
+            TokenBucket(limit, capacity)
             if limit
             else None)
 
@@ -958,6 +1004,7 @@ class Sync(QObject):
                 if not is_offline and self._event_queue:
                     self._event_queue.cancel_downloads_for_parent_uuid(uuid)
                 self._recalculate_processing_events_count()
+                self._status_snapshot.invalidate_uuid(uuid)
                 self.file_status_refresh.emit()
                 success = True
         except EventsDbBusy:
@@ -985,6 +1032,20 @@ class Sync(QObject):
         if not self._cfg.smart_sync:
             return status
 
+        try:
+            path_statuses = self._status_snapshot.get_many(paths)
+        except KeyError:
+            path_statuses = None
+        if path_statuses is not None:
+            if not all(path_statuses):
+                return timeout_status   # unknown path
+
+            if all(s.is_offline for s in path_statuses):
+                status = 1      # offline
+            elif all(not s.is_offline for s in path_statuses):
+                status = 0      # not offline
+            return status
+
         try:
             with self._db.soft_lock(timeout_sec=timeout):
                 statuses = self._db.get_offline_statuses(paths)
@@ -1020,6 +1081,15 @@ class Sync(QObject):
 
     def is_path_shared(self, path, is_file):
         sharing_info = self._ss_client.get_sharing_info()
+        try:
+            path_status = self._status_snapshot.get(path)
+            uuid = path_status.uuid \
+                if path_status and path_status.is_folder != is_file \
+                else None
+            return bool(uuid and uuid in sharing_info)
+        except KeyError:
+            pass
+
         try:
             # Given path is a file inside sync directory
             if is_file:
@@ -1033,7 +1103,7 @@ class Sync(QObject):
                      path, uuid, sharing_info)
 
         # Check that UUID is known as shared
-        return uuid and uuid in sharing_info
+        return bool(uuid and uuid in sharing_info)
 
     def _try_clean_old_events(self, status, substatus, lc, rc, fsc):
         if self._download_backups_changed:
@@ -1193,6 +1263,7 @@ class Sync(QObject):
             self._copies_storage.clean_unnecessary()
             if self._started:
                 self._copies_storage.remove_copies_not_in_db()
+                self._copies_storage.pack_copies()
             self._copies_cleaned.emit()
 
         if not self._event_queue_idle or not self._monitor_idle \
@@ -1406,8 +1477,11 @@ class Sync(QObject):
         Application.show_tray_notification(msg.format(display_name))
 
     def exit(self):
+        self._status_snapshot.stop()
         if self.fs:
                 self.fs.quit()
+        if self._copies_storage:
+            self._copies_storage.close()
 
         if self._download_manager:
             self._download_manager.quit.emit()
@@ -1569,6 +1643,8 @@ class Sync(QObject):
             self.config_changed.emit()
 
     def _on_change_excluded_dirs(self, dirs_to_delete, dirs_to_add):
+        for directory in dirs_to_delete + dirs_to_add:
+            self._status_snapshot.invalidate_path(directory)
         pc = PathConverter(self._root)
         for directory in dirs_to_delete:
             try:
@@ -1659,9 +1735,9 @@ class Sync(QObject):
             max_checked_server_event_id = 0
             events_count = 0
             self._rerequest_all_events = False
-        elif self._max_remote_event_received and not force_db_values:
-            max_server_event_id = self._max_remote_event_received
-            max_checked_server_event_id = self._max_remote_event_received
+        elif self._max_remote_event_processed and not force_db_values:
+            max_server_event_id = self._max_remote_event_processed
+            max_checked_server_event_id = self._max_remote_event_processed
             events_count = 0
         else:
             with self._db.create_session(read_only=True) as session:
@@ -1752,6 +1828,23 @@ class Sync(QObject):
     def _on_info_rx(self, info_rx):
         self.signal_info_rx.emit(info_rx)
 
+    def is_copy_needed(self, copy_hash):
+        """
+        Checks copy is referenced by sync or being downloaded
+
+        @param copy_hash Copy hash [str]
+        @return Copy needed flag [bool]
+        """
+        if self._copies_storage and \
+                self._copies_storage.has_references(copy_hash):
+            return True
+
+        return bool(self._download_manager) and \
+            self._download_manager.has_file_hash_download(copy_hash)
+
+    def is_downloading(self):
+        return not self._download_tasks_idle
+
     def make_copy_from_existing_files(self, copy_hash):
         if not self.fs:
             return False
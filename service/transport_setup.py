@@ -21,7 +21,7 @@ import logging
 from PySide2.QtCore import QObject, Signal, Qt
 
 from common.utils import license_type_constant_from_string
-from common.constants import REGULAR_URI
+from common.constants import REGULAR_URI, PATCH_FORMAT_VERSIONS_SUPPORTED
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -109,6 +109,8 @@ def get_server_addr_port(login_data, connectivity_service):
     If none, returns default server address and port
 
     @param login_data Data returned by API server [dict]
+    @param connectivity_service Service STUN/TURN servers are added to,
+        None not to add them
     '''
 
     # Signal server URL in the form HOST:PORT
@@ -118,6 +120,8 @@ def get_server_addr_port(login_data, connectivity_service):
     for server in login_data['servers']:
         # STUN/TURN server
         if server['server_type'] in ('STUN', 'TURN'):
+            if connectivity_service is None:
+                continue
             server_protocol = 'stun:' if server['server_type'] == 'STUN' \
                 else 'turn:'
             server_login = server.get('server_login', '')
@@ -263,7 +267,9 @@ def init(events_db, connectivity_service, upload_handler, ss_client, cfg,
                 dict(disk_usage=get_sync_folder_size(),
                      upload_speed=get_upload_speed(),
                      download_speed=get_download_speed(),
-                     node_status=get_node_status())), Qt.QueuedConnection)
+                     node_status=get_node_status(),
+                     patch_formats=list(PATCH_FORMAT_VERSIONS_SUPPORTED))),
+            Qt.QueuedConnection)
         ss_client.server_connect.connect(
             signals.signalling_connected, Qt.QueuedConnection)
         ss_client.server_connect.connect(
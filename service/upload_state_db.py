@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import json
+import logging
+import pickle
+import time
+from contextlib import contextmanager
+from os.path import exists
+from threading import RLock
+
+from sqlalchemy import create_engine, event, bindparam
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, Unicode, Text, Float, Boolean
+
+from common.constants import DB_PAGE_SIZE
+from common.utils import remove_file
+from common.file_path import FilePath
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+Base = declarative_base()
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+class Upload(Base):
+    __tablename__ = 'uploads'
+
+    id = Column(Integer(), primary_key=True, autoincrement=False)
+    # json of upload_add message data
+    info = Column(Text(), nullable=False, default='{}')
+    tmp_fn = Column(Unicode(), nullable=True)
+    loaded = Column(Integer(), nullable=False, default=0)
+    size = Column(Integer(), nullable=False, default=0)
+    elapsed = Column(Float(), nullable=False, default=0.)
+    # downloaded, but completion is not reported to signalling server yet
+    complete = Column(Boolean(), nullable=False, default=False, index=True)
+    updated = Column(Float(), nullable=False, default=0.)
+
+    def __repr__(self):
+        return \
+            "id='{self.id}' " \
+            "loaded='{self.loaded}' " \
+            "size='{self.size}' " \
+            "complete='{self.complete}'" \
+            .format(self=self)
+
+
+def _set_pragmas(dbapi_connection, _):
+    # checkpoints are frequent small writes, wal doesn't rewrite db pages
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+class UploadStateDB(object):
+    """
+    State of upload tasks, row per upload. Keeps byte offsets of
+    uploads being downloaded to resume them and ids of complete uploads
+    not reported to signalling server yet
+    """
+
+    def __init__(self, db_file):
+        """
+        @param db_file Path of db file. Legacy pickled file of
+            not reported uploads is imported and replaced [str]
+        """
+        self._db_file = db_file
+        legacy_ids = self._read_legacy()
+
+        # single connection, sessions are serialized by lock
+        self._engine = create_engine(
+            'sqlite:///{}'.format(FilePath(self._db_file)),
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool)
+        event.listen(self._engine, 'connect', _set_pragmas)
+        self._Session = sessionmaker(bind=self._engine)
+        Base.metadata.create_all(self._engine, checkfirst=True)
+        self._lock = RLock()
+
+        if legacy_ids:
+            logger.info("Importing %s not reported uploads", len(legacy_ids))
+            for upload_id in legacy_ids:
+                self.set_complete(upload_id)
+
+    def _read_legacy(self):
+        if not exists(self._db_file):
+            return []
+
+        with open(self._db_file, 'rb') as f:
+            header = f.read(len(SQLITE_HEADER))
+            if header == SQLITE_HEADER:
+                return []
+
+            f.seek(0)
+            try:
+                upload_ids = [int(i) for i in pickle.load(f)]
+            except Exception as e:
+                logger.warning("Can't read legacy uploads file (%s)", e)
+                upload_ids = []
+        remove_file(self._db_file)
+        return upload_ids
+
+    @contextmanager
+    def create_session(self):
+        with self._lock:
+            session = self._Session()
+            session.expire_on_commit = False
+            session.autoflush = False
+            try:
+                yield session
+                session.commit()
+            except Exception as e:
+                logger.error("Upload state DB session rollback. Reason: %s",
+                             e)
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+    def add(self, upload_id, info, tmp_fn):
+        """
+        Adds or refreshes row of upload being downloaded
+
+        @return Stored upload or None if it is new [Upload]
+        """
+        with self.create_session() as session:
+            upload = session.query(Upload).get(upload_id)
+            stored = upload if upload and not upload.complete else None
+            if not upload:
+                upload = Upload(id=upload_id)
+                session.add(upload)
+            upload.info = json.dumps(info)
+            upload.tmp_fn = tmp_fn
+            upload.complete = False
+            upload.updated = time.time()
+            if not stored:
+                upload.loaded = upload.size = 0
+                upload.elapsed = 0.
+            return stored
+
+    def checkpoint(self, offsets):
+        """
+        Saves progress of uploads in single transaction
+
+        @param offsets Iterable of (upload_id, loaded, size, elapsed)
+        """
+        params = [dict(b_id=upload_id, loaded=loaded, size=size,
+                       elapsed=elapsed, updated=time.time())
+                  for upload_id, loaded, size, elapsed in offsets]
+        if not params:
+            return
+
+        statement = Upload.__table__.update() \
+            .where(Upload.id == bindparam('b_id')) \
+            .values(loaded=bindparam('loaded'), size=bindparam('size'),
+                    elapsed=bindparam('elapsed'),
+                    updated=bindparam('updated'))
+        with self.create_session() as session:
+            session.execute(statement, params)
+
+    def set_complete(self, upload_id):
+        with self.create_session() as session:
+            upload = session.query(Upload).get(upload_id)
+            if not upload:
+                upload = Upload(id=upload_id)
+                session.add(upload)
+            upload.complete = True
+            upload.tmp_fn = None
+            upload.updated = time.time()
+
+    def complete_ids(self):
+        with self.create_session() as session:
+            return [upload_id for upload_id, in session.query(Upload.id)
+                    .filter(Upload.complete)
+                    .all()]
+
+    def remove(self, upload_ids):
+        if not upload_ids:
+            return
+
+        with self.create_session() as session:
+            self._delete(session, list(upload_ids))
+
+    def remove_stale(self, max_age):
+        """
+        Removes rows of uploads not updated for max_age seconds
+
+        @return Temporary files of removed uploads [list]
+        """
+        with self.create_session() as session:
+            stale = session.query(Upload.id, Upload.tmp_fn) \
+                .filter(~Upload.complete) \
+                .filter(Upload.updated < time.time() - max_age) \
+                .all()
+            self._delete(session, [s.id for s in stale])
+        return [s.tmp_fn for s in stale if s.tmp_fn]
+
+    @staticmethod
+    def _delete(session, upload_ids):
+        for i in range(0, len(upload_ids), DB_PAGE_SIZE):
+            session.query(Upload) \
+                .filter(Upload.id.in_(upload_ids[i:i + DB_PAGE_SIZE])) \
+                .delete(synchronize_session=False)
+
+    def close(self):
+        self._engine.dispose()
@@ -21,7 +21,6 @@ import logging
 import os
 import os.path as op
 import shutil
-import pickle
 import time
 import errno
 
@@ -33,8 +32,8 @@ from common.utils import make_dirs, ensure_unicode, \
 from common.file_path import FilePath
 from common.constants import DOWNLOAD_STARTING, DOWNLOAD_LOADING, \
     DOWNLOAD_FINISHING, API_EVENTS_URI
-from service.http_downloader import HttpDownloader
 from service.events_db import EventsDbBusy
+from service.upload_state_db import UploadStateDB
 
 
 # Setup logging
@@ -58,18 +57,23 @@ class UploadTaskHandler(QObject):
     upload_folder_excluded = Signal(str)         # upload file name
     upload_folder_not_synced = Signal(str)         # upload file name
     _on_server_connect_signal = Signal()
-    _upload_task_completed_signal = Signal(str,     # str(upload_id)
+    _upload_task_completed_signal = Signal(object,  # upload_id
                                            float,       # elapsed
-                                           str)     # str(total)
-    _upload_task_error_signal = Signal(str,         # str(upload_id)
+                                           object)  # total
+    _upload_task_error_signal = Signal(object,      # upload_id
                                        str)         # error message
-    _upload_task_progress_signal = Signal(str,      # str(upload_id)
-                                          str,      # str(loaded)
-                                          str,      # str(total)
+    _upload_task_progress_signal = Signal(object,   # upload_id
+                                          object,   # loaded
+                                          object,   # total
                                           float)        # elapsed
     _on_upload_added_signal = Signal(dict)
     _on_upload_cancel_signal = Signal(int)
 
+    # seconds between saves of uploads progress
+    CHECKPOINT_INTERVAL = 5
+    # uploads not resumed for so long are dropped with their temporary files
+    STALE_UPLOAD_AGE = 7 * 24 * 60 * 60
+
     def __init__(self,
                  cfg,
                  web_api,
@@ -98,11 +102,11 @@ class UploadTaskHandler(QObject):
         self._network_speed_calculator = network_speed_calculator
         self._db = db
         self._filename = ensure_unicode(filename)
-        self.task_to_report = {}
+        self._store = None
 
-        self._downloader = HttpDownloader(
-            network_speed_calculator=self._network_speed_calculator)
-        self._set_callbacks()
+        # Http downloader is created on first upload task
+        self._downloader = None
+        self._download_limiter = None
 
         # Download tasks info as task_id: info
         self.download_tasks_info = {}
@@ -111,8 +115,10 @@ class UploadTaskHandler(QObject):
         self._last_length = 0.0
         self._was_stopped = False
         self._empty_progress = (None, 0, 0)
+        # uploads with progress not saved to store yet
+        self._not_saved = set()
 
-        self._open_uploads_file()
+        self._open_store()
 
         self._uploads_deleted = \
             self._uploads_excluded = \
@@ -127,13 +133,34 @@ class UploadTaskHandler(QObject):
         self._on_upload_added_signal.connect(self._on_upload_added)
         self._on_upload_cancel_signal.connect(self._on_upload_cancel)
 
-        self._check_upload_path_timer = QTimer(self)
-        self._check_upload_path_timer.setInterval(10 * 1000)
-        self._check_upload_path_timer.timeout.connect(
+        # upload paths are checked on sync notifications, see
+        # on_paths_changed, notifications bursts are checked once
+        self._check_upload_paths_timer = QTimer(self)
+        self._check_upload_paths_timer.setInterval(1000)
+        self._check_upload_paths_timer.setSingleShot(True)
+        self._check_upload_paths_timer.timeout.connect(
             self._check_upload_paths)
 
+        self._checkpoint_timer = QTimer(self)
+        self._checkpoint_timer.setInterval(self.CHECKPOINT_INTERVAL * 1000)
+        self._checkpoint_timer.timeout.connect(self._checkpoint)
+
     def set_download_limiter(self, download_speed_limiter):
-        self._downloader.set_download_limiter(download_speed_limiter)
+        self._download_limiter = download_speed_limiter
+        if self._downloader:
+            self._downloader.set_download_limiter(download_speed_limiter)
+
+    def _get_downloader(self):
+        if self._downloader:
+            return self._downloader
+
+        from service.http_downloader import HttpDownloader
+        self._downloader = HttpDownloader(
+            network_speed_calculator=self._network_speed_calculator)
+        self._set_callbacks()
+        if self._download_limiter:
+            self._downloader.set_download_limiter(self._download_limiter)
+        return self._downloader
 
     def _set_callbacks(self):
         self._downloader.set_callbacks(
@@ -144,36 +171,56 @@ class UploadTaskHandler(QObject):
             on_get_upload_state_cb=self.get_upload_state_cb,
         )
 
-    def _open_uploads_file(self):
+    def _open_store(self):
         logger.info(
             "Loading upload task data from '%s'...", self._filename)
 
-        # Load previously stored download task data
         try:
-            if not op.exists(self._filename):
-                with open(self._filename, 'wb') as f:
-                    pickle.dump(self.task_to_report, f)
-            # Not reported complete download tasks info as task_id: info
-            with open(self._filename, 'rb') as f:
-                self.task_to_report = pickle.load(f)
+            self._store = UploadStateDB(self._filename)
+            stale_files = self._store.remove_stale(self.STALE_UPLOAD_AGE)
         except Exception as e:
             logger.error("Failed to load upload task data (%s)", e)
-            self.task_to_report = None
+            self._store = None
             try:
                 remove_file(self._filename)
             except Exception:
                 pass
+            return
 
-    def _sync__uploads_file(self):
+        for tmp_fn in stale_files:
+            logger.debug("Removing stale upload file '%s'", tmp_fn)
+            try:
+                remove_file(tmp_fn)
+                # http downloader ranges state
+                remove_file(tmp_fn + '.ranges')
+            except Exception as e:
+                logger.warning(
+                    "Failed to delete temporary file '%s' (%s)", tmp_fn, e)
+
+    def _get_store(self):
+        if self._store is None:
+            self._open_store()
+        return self._store
+
+    def _checkpoint(self):
+        """
+        Saves progress of uploads changed since last checkpoint
+        """
+        store = self._get_store()
+        if not store or not self._not_saved:
+            return
+
+        offsets = []
+        for upload_id in self._not_saved:
+            info = self.download_tasks_info.get(upload_id)
+            if info:
+                offsets.append((upload_id, info['loaded'], info['size'],
+                                info['elapsed']))
+        self._not_saved.clear()
         try:
-            with open(self._filename, 'wb') as f:
-                pickle.dump(self.task_to_report, f)
+            store.checkpoint(offsets)
         except Exception as e:
-            logger.error("Failed to save upload task data (%s)", e)
-            try:
-                remove_file(self._filename)
-            except Exception:
-                pass
+            logger.warning("Failed to save upload tasks progress (%s)", e)
 
     def _cleanup(self, upload_id):
         """
@@ -198,7 +245,9 @@ class UploadTaskHandler(QObject):
 
         # Clear upload info
         del self.download_tasks_info[upload_id]
+        self._not_saved.discard(upload_id)
         if not self.download_tasks_info:
+            self._checkpoint_timer.stop()
             self.idle.emit()
 
     def _on_upload_failed(self, upload_id):
@@ -210,6 +259,7 @@ class UploadTaskHandler(QObject):
 
         # Notify signalling server on upload fail
         self._ss_client.send_upload_failed(upload_id)
+        self._remove_stored_upload(upload_id)
 
         task_info = self.download_tasks_info.get(upload_id, None)
         if task_info:
@@ -223,34 +273,33 @@ class UploadTaskHandler(QObject):
         """
         Saves upload task ID in the case in could not be reported immediately
 
-        @param upload_id ID of upload task [string]
+        @param upload_id ID of upload task [int]
         """
 
-        if self.task_to_report is None:
-            self._open_uploads_file()
-            if self.task_to_report is None:
-                return
+        store = self._get_store()
+        if not store:
+            return
 
-        self.task_to_report[str(upload_id)] = \
-            self.download_tasks_info[upload_id]
-        self._sync__uploads_file()
+        try:
+            store.set_complete(upload_id)
+        except Exception as e:
+            logger.error("Failed to save upload task data (%s)", e)
 
-    def _clean_complete_upload_id(self, upload_id):
+    def _remove_stored_upload(self, upload_id):
         """
-        Remove previously stored upload task ID
+        Removes previously stored upload task
 
-        @param upload_id ID of upload task [string]
+        @param upload_id ID of upload task [int]
         """
 
-        if self.task_to_report is None:
-            self._open_uploads_file()
-            if self.task_to_report is None:
-                return
+        store = self._get_store()
+        if not store:
+            return
 
-        upload_id = str(upload_id)  # For pickle
-        if upload_id in self.task_to_report:
-            del self.task_to_report[upload_id]
-            self._sync__uploads_file()
+        try:
+            store.remove([upload_id])
+        except Exception as e:
+            logger.error("Failed to remove upload task data (%s)", e)
 
     def _report_stored_uploads(self):
         """
@@ -258,33 +307,37 @@ class UploadTaskHandler(QObject):
         server
         """
 
-        if self.task_to_report is None:
-            self._open_uploads_file()
-            if self.task_to_report is None:
-                return
+        store = self._get_store()
+        if not store:
+            return
 
         logger.debug(
             "Checking upload tasks haven't been reported...")
 
-        count = 0
-        for upload_id in list(self.task_to_report.keys()):
-            if self._ss_client.send_upload_complete(int(upload_id)):
-                count += 1
-                self._clean_complete_upload_id(upload_id)
+        try:
+            reported = [upload_id for upload_id in store.complete_ids()
+                        if self._ss_client.send_upload_complete(upload_id)]
+            store.remove(reported)
+        except Exception as e:
+            logger.error("Failed to report stored upload tasks (%s)", e)
+            return
 
-        if count > 0:
+        if reported:
             logger.info(
-                "Reported %s upload tasks completion to the signalling server")
+                "Reported %s upload tasks completion to the signalling server",
+                len(reported))
 
     def _on_upload_complete(self, upload_id):
         """
         Routines to be executed on upload task successful completion
 
-        @param upload_id ID of upload task [string]
+        @param upload_id ID of upload task [int]
         """
 
         # Notify signalling server on upload completetion
-        if not self._ss_client.send_upload_complete(upload_id):
+        if self._ss_client.send_upload_complete(upload_id):
+            self._remove_stored_upload(upload_id)
+        else:
             self._store_complete_upload_id(upload_id)
 
         # Cleanup upload data
@@ -340,9 +393,24 @@ class UploadTaskHandler(QObject):
         path = self._check_upload_path(upload_id)
         if path is None:
             return
-        else:
-            if not self._check_upload_path_timer.isActive():
-                self._check_upload_path_timer.start()
+
+        # Generate filename to save file into
+        tmp_fn = op.join(
+            get_patches_dir(self._cfg.sync_directory),
+            '.upload_' + str(upload_id))
+
+        # Resume upload downloaded partially before restart
+        proceed = None
+        stored = self._add_stored_upload(upload_id, upload_info, tmp_fn)
+        if stored and stored.size and op.exists(tmp_fn) and \
+                self._has_ranges_state(tmp_fn):
+            logger.info("Resuming upload task ID '%s' from %s of %s bytes",
+                        upload_id, stored.loaded, stored.size)
+            upload_info['loaded'] = stored.loaded
+            upload_info['size'] = stored.size
+            upload_info['elapsed'] = stored.elapsed
+            proceed = (stored.loaded, stored.size - 1)
+        upload_info['tmp_fn'] = tmp_fn
 
         added_info, changed_info = self._get_download_info(
             upload_id, is_first_report=True)
@@ -350,13 +418,30 @@ class UploadTaskHandler(QObject):
             *self._empty_progress, [added_info, changed_info, []], {})
 
         self.working.emit()
+        if not self._checkpoint_timer.isActive():
+            self._checkpoint_timer.start()
 
-        # Generate filename to save file into
-        tmp_fn = self.download_tasks_info[upload_id]['tmp_fn'] = op.join(
-            get_patches_dir(self._cfg.sync_directory),
-            '.upload_' + str(upload_id))
+        self._download(upload_id, tmp_fn, proceed)
+
+    @staticmethod
+    def _has_ranges_state(tmp_fn):
+        """
+        Checks ranges downloaded are saved for the file, stored loaded size
+        is sum of ranges and can't be used as offset to resume from
+        """
+        from service.http_downloader import RangesState
+        return RangesState.exists(tmp_fn)
+
+    def _add_stored_upload(self, upload_id, upload_info, tmp_fn):
+        store = self._get_store()
+        if not store:
+            return None
 
-        self._download(upload_id, tmp_fn)
+        try:
+            return store.add(upload_id, upload_info, tmp_fn)
+        except Exception as e:
+            logger.error("Failed to save upload task data (%s)", e)
+            return None
 
     def _download(self, upload_id, path, proceed=None):
         """
@@ -367,7 +452,7 @@ class UploadTaskHandler(QObject):
         @param proceed None if new download or tuple (offset, size)
                        if resuming paused download
         """
-        self._downloader.download(
+        self._get_downloader().download(
             id=upload_id,
             url=API_EVENTS_URI.format(self._cfg.host),
             path=path, do_post_request=True,
@@ -426,23 +511,25 @@ class UploadTaskHandler(QObject):
             return
 
         self._upload_task_progress_signal.emit(
-            str(upload_id), str(loaded), str(total), elapsed)
+            upload_id, loaded, total, elapsed)
 
-    def _on_upload_task_progress(self, upload_id_str, loaded_str,
-                                 total_str, elapsed):
+    def _on_upload_task_progress(self, upload_id, loaded, total, elapsed):
         """
         Slot to obtain upload task download progress
 
-        @param upload_id_str ID of upload task [str]
-        @param loaded_str Amount of data downloaded already (in bytes) [str]
-        @param total_str Size of file being downloaded (in bytes) [str]
+        @param upload_id ID of upload task [int]
+        @param loaded Amount of data downloaded already (in bytes) [int]
+        @param total Size of file being downloaded (in bytes) [int]
         @param elapsed Time elapsed from download starting (in seconds) [float]
         """
 
-        upload_id, loaded, total = int(upload_id_str), int(loaded_str), \
-            int(total_str)
-        self.download_tasks_info[upload_id]['loaded'] = loaded
-        self.download_tasks_info[upload_id]['size'] = total
+        task_info = self.download_tasks_info.get(upload_id)
+        if not task_info:
+            return
+
+        task_info['loaded'] = loaded
+        task_info['size'] = total
+        self._not_saved.add(upload_id)
         if not total:
             return
 
@@ -479,16 +566,15 @@ class UploadTaskHandler(QObject):
         @param upload_id ID of upload task
         @param message Error description [string]
         """
-        self._upload_task_error_signal.emit(str(upload_id), message)
+        self._upload_task_error_signal.emit(upload_id, message)
 
-    def _on_upload_task_error(self, upload_id_str, message):
+    def _on_upload_task_error(self, upload_id, message):
         """
         Slot to be called on upload task download error
 
-        @param upload_id_str ID of upload task [string]
+        @param upload_id ID of upload task [int]
         @param message Error description [string]
         """
-        upload_id = int(upload_id_str)
         logger.error(
             "Upload task ID '%s' failed (%s)", upload_id, message)
 
@@ -506,19 +592,20 @@ class UploadTaskHandler(QObject):
         @param elapsed Time elapsed from download starting (in seconds) [float]
         @param total Size of file being downloaded (in bytes) [long]
         """
-        self._upload_task_completed_signal.emit(str(upload_id), elapsed,
-                                                str(total))
+        self._upload_task_completed_signal.emit(upload_id, elapsed, total)
 
-    def _on_upload_task_completed(self, upload_id_str, elapsed, total_str):
+    def _on_upload_task_completed(self, upload_id, elapsed, total):
         """
         Slot to be called on upload task download completion
 
-        @param upload_id_str ID of upload task [string]
+        @param upload_id ID of upload task [int]
         @param elapsed Time elapsed from download starting (in seconds) [float]
-        @param total_str Size of file being downloaded (in bytes) [string]
+        @param total Size of file being downloaded (in bytes) [int]
         """
 
-        upload_id = int(upload_id_str)
+        if upload_id not in self.download_tasks_info:
+            return
+
         state = self.download_tasks_info[upload_id]['state']
 
         upload_name = self.download_tasks_info[upload_id]['upload_name']
@@ -530,16 +617,17 @@ class UploadTaskHandler(QObject):
             return
         elif state == 'paused':
             self.download_tasks_info[upload_id]['elapsed'] += elapsed
+            self._not_saved.add(upload_id)
+            self._checkpoint()
             return
 
         elapsed += self.download_tasks_info[upload_id]['elapsed']
-        total = int(total_str)
         bps_avg = int(total / elapsed) if elapsed > 0 else 0
         bps_avg = "{:,}".format(bps_avg)
         logger.info(
             "Upload task ID '%s' complete (downloaded %s bytes in %s seconds"
             "(%s Bps))",
-            upload_id_str, total_str, elapsed, bps_avg)
+            upload_id, total, elapsed, bps_avg)
 
         # Calculate checksum
         tmp_fn = self.download_tasks_info[upload_id]['tmp_fn']
@@ -604,7 +692,7 @@ class UploadTaskHandler(QObject):
             return
 
         self.download_status.emit(
-            *self._empty_progress, [{}, {}, [upload_id_str]], {})
+            *self._empty_progress, [{}, {}, [str(upload_id)]], {})
         self._on_upload_complete(upload_id)
 
     def on_signal_server_connect_cb(self):
@@ -665,16 +753,21 @@ class UploadTaskHandler(QObject):
             path = None
         return path
 
+    def on_paths_changed(self):
+        """
+        Slot to be called on sync notifications about paths removed, moved
+        or excluded. Destination of each upload is checked again before
+        moving downloaded file, so this only stops useless downloads early
+        """
+        if self.download_tasks_info and not self._was_stopped and \
+                not self._check_upload_paths_timer.isActive():
+            self._check_upload_paths_timer.start()
+
     def _check_upload_paths(self):
-        running_count = 0
-        for upload_id in self.download_tasks_info:
+        for upload_id in list(self.download_tasks_info):
             path = self._check_upload_path(upload_id)
-            if path is None:
+            if path is None and upload_id in self.download_tasks_info:
                 self.download_tasks_info[upload_id]['state'] = 'cancelled'
-            else:
-                running_count += 1
-        if running_count:
-            self._check_upload_path_timer.start()
 
     def _get_download_info(self, upload_id, is_first_report=False):
         added_info = dict()
@@ -715,8 +808,9 @@ class UploadTaskHandler(QObject):
                 if cancel_downloads or \
                 not self.download_tasks_info[upload_id]['size'] \
                 else 'paused'
-        if self._check_upload_path_timer.isActive():
-            self._check_upload_path_timer.stop()
+        self._check_upload_paths_timer.stop()
+        self._checkpoint_timer.stop()
+        self._checkpoint()
 
         # deleted_list = [
         #     str(u) for u in self.download_tasks_info
@@ -738,12 +832,18 @@ class UploadTaskHandler(QObject):
                            (info['loaded'], info['size'] - 1))
         if self.download_tasks_info:
             self.working.emit()
-            self._check_upload_path_timer.start()
+            self._checkpoint_timer.start()
+            self._check_upload_paths_timer.start()
 
         self._uploads_deleted = \
             self._uploads_excluded = \
             self._uploads_not_synced = set()
 
     def exit(self):
-        self.stop(True)
-        self._downloader.close(immediately=False)
+        # partially downloaded uploads are kept in store to be resumed
+        self.stop()
+        if self._downloader:
+            self._downloader.close(immediately=False)
+        if self._store:
+            self._store.close()
+            self._store = None
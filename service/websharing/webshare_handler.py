@@ -23,7 +23,7 @@ import os.path as op
 import shutil
 import time
 import pickle
-from queue import Queue
+from queue import Queue, Empty
 from collections import defaultdict
 from threading import Event, Timer, RLock
 
@@ -47,7 +47,7 @@ from service.transport_setup import SERVER, PORT, get_server_addr_port
 from common.signal import Signal
 from common.utils import get_downloads_dir, get_next_name, get_data_dir, \
     create_empty_file, make_dirs, remove_dir, remove_file, ensure_unicode, \
-    get_copies_dir, copy_file, get_bases_filename
+    get_copies_dir, copy_file, clone_file, get_bases_filename
 from common.constants import DOWNLOAD_PRIORITY_FILE, DELETE, MOVE, \
     RETRY_DOWNLOAD_TIMEOUT, REGULAR_URI
 from common.file_path import FilePath
@@ -58,6 +58,8 @@ from .share_info_processor import ShareInfoProcessor, FileInfo
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+EMPTY_PROGRESS = ("", 0, 0)
+
 
 class WebshareHandlerSignals(object):
     """
@@ -112,9 +114,72 @@ class WebshareHandlerPathNotFoundError(WebshareHandlerError):
     pass
 
 
+class ShareDownload(object):
+    """
+    State of single share being downloaded
+    """
+
+    def __init__(self, share_hash, passwd, dest_dir, dest_uuid):
+        self.hash = share_hash
+        self.passwd = passwd
+        # Destination directory and its uuid (None for sync dir root,
+        # "" for directory outside sync dir)
+        self.dest_dir = dest_dir
+        self.dest_uuid = dest_uuid
+
+        # Name of share, known after share info obtained
+        self.name = None
+        self.is_folder = False
+        self.is_deleting = False
+        # Special (.download) file or folder shown to user
+        self.fullname = ""
+        self.in_data_dir = False
+
+        # Number of files not finished yet
+        self.num_files = 0
+        # event uuid <> file info for files not downloaded yet
+        self.tasks = dict()
+        self.cancelled_tasks = set()
+        self.downloaded_tasks = set()
+
+        self.failed_downloads = []
+        self.retry_download_timer = None
+
+        self.folder_uuid_ready = Event()
+        self.folder_uuid_ready.set()
+        self.special_event_no = 0
+        self.special_event_lock = RLock()
+
+        # ShareSession used to download the share
+        self.session = None
+
+
+class ShareSession(object):
+    """
+    Signalling server connection, connectivity service and download
+    manager used to download one share at a time
+    """
+
+    def __init__(self, index, ss_client):
+        self.index = index
+        self.ss_client = ss_client
+        self.connectivity_service = None
+        self.connectivity_service_thread = None
+        self.download_manager = None
+        self.connected_nodes = 0
+        self.idle = True
+        # Last download progress (text, percent, total) of the session
+        self.progress = EMPTY_PROGRESS
+
+        # ShareDownload being processed or None
+        self.share = None
+
+
 class WebshareHandler(object):
     """
-    Class incapsulating webshare downloading routines
+    Class incapsulating webshare downloading routines.
+    Several shares are downloaded concurrently, each one in its own
+    ShareSession, other queued shares wait for free session
     """
     signal_info_tx = Signal(tuple)
     signal_info_rx = Signal(tuple)
@@ -141,52 +206,27 @@ class WebshareHandler(object):
         self._tracker = tracker
 
         self._network_speed_calculator = network_speed_calculator
-        # Signalling server client instance
-        self._ss_client = SignalServerClient(parent, client_type='webshare')
         self._ss_addr = SERVER
         self._ss_port = PORT
+        # Data returned by API server on login, used for new sessions
+        self._login_data = None
 
         self._sync = sync
         self._db = db
         # Share processing queue
         self._queue = Queue()
+        # Incremented when queue is cleared
+        self._queue_generation = 0
 
-        # share_hash <> its object IDs
-        self._tasks = defaultdict(list)
-        self._cancelled_tasks = defaultdict(set)
-        self._downloaded_tasks = defaultdict(set)
+        # share_hash <> ShareDownload being processed
+        self._shares = dict()
+        # share_hash <> ShareDownload list waiting for share with the same
+        # hash to be finished
+        self._postponed_shares = defaultdict(list)
+        self._shares_lock = RLock()
 
-        self._failed_downloads = defaultdict(list)
-        self._retry_download_timer = None
         self._retry_download_timeout = RETRY_DOWNLOAD_TIMEOUT
 
-        # Start thread
-        self._share_processing_thread()
-        self._stop = False
-
-        # Hash of share being processed
-        self._current_share_hash = None
-
-        # Name of share being processed
-        self._current_share_name = None
-
-        self._is_folder = False
-        self._is_deleting = False
-        self._fullname = ""
-        self._in_data_dir = False
-
-        # Number of files
-        self._num_files = 0
-
-        # Destination directories dict
-        self._dest_dirs = {}
-        self._dest_uuids = {}
-
-        # Initialize signalling server client
-        self._connect_ss_slots()
-
-        self._init_connectivity()
-
         # Signals to be emitted for current class instance
         self.signals = WebshareHandlerSignals()
 
@@ -195,56 +235,107 @@ class WebshareHandler(object):
         self.signals.download_failure.connect(
             self._on_download_failure, Qt.QueuedConnection)
 
-        self._folder_uuid_ready = Event()
-        self._folder_uuid_ready.set()
-        self._special_event_no = 0
-        self._special_event_lock = RLock()
+        # Share sessions are created on demand up to max_sessions,
+        # free ones are in the queue
+        self._parent = parent
+        self._max_sessions = max(self._cfg.max_share_downloads, 1) \
+            if self._cfg else 1
+        self._sessions = []
+        self._free_sessions = Queue()
+        # Number of queued shares not having session yet
+        self._waiting_shares = 0
 
         self._filename = get_bases_filename(self._cfg.sync_directory, filename)
         self._spec_files = dict()
+        self._spec_files_lock = RLock()
         self._clean_spec_files()
 
-    def _init_connectivity(self):
-        self._connectivity_service = ConnectivityService(
-            self._ss_client, self._network_speed_calculator)
-        self._connectivity_service_thread = QThread()
-        self._connectivity_service.moveToThread(
-            self._connectivity_service_thread)
-        self._connectivity_service_thread.started.connect(
-            self._connectivity_service.init.emit)
-        self._connectivity_service.connected_nodes_outgoing_changed.connect(
-            self._on_connected_nodes_changed, Qt.QueuedConnection)
-        self._download_manager = DownloadManager(
-            connectivity_service=self._connectivity_service,
-            ss_client=self._ss_client,
+        # Start thread
+        self._stop = False
+        self._share_processing_thread()
+
+    def _add_sessions(self):
+        """
+        Creates sessions while there are less free sessions
+        than shares waiting for them. Called from the thread
+        the handler was created in, as sessions contain Qt objects
+        """
+        with self._shares_lock:
+            while len(self._sessions) < self._max_sessions and \
+                    self._free_sessions.qsize() < self._waiting_shares:
+                session = self._create_session(len(self._sessions))
+                self._sessions.append(session)
+                self._free_sessions.put(session)
+
+    def _create_session(self, index):
+        logger.debug("Creating share session %s", index)
+        # Signalling server client instance
+        ss_client = SignalServerClient(self._parent, client_type='webshare')
+        session = ShareSession(index, ss_client)
+
+        # Initialize signalling server client
+        self._connect_ss_slots(session)
+
+        self._init_connectivity(session)
+        return session
+
+    def _init_connectivity(self, session):
+        session.connectivity_service = ConnectivityService(
+            session.ss_client, self._network_speed_calculator)
+        if self._login_data:
+            # add STUN/TURN servers
+            get_server_addr_port(
+                self._login_data, session.connectivity_service)
+        session.connectivity_service_thread = QThread()
+        session.connectivity_service.moveToThread(
+            session.connectivity_service_thread)
+        session.connectivity_service_thread.started.connect(
+            session.connectivity_service.init.emit)
+        session.connectivity_service.connected_nodes_outgoing_changed.connect(
+            lambda nodes: self._on_connected_nodes_changed(session, nodes),
+            Qt.QueuedConnection)
+        session.download_manager = DownloadManager(
+            connectivity_service=session.connectivity_service,
+            ss_client=session.ss_client,
             upload_enabled=False,
             tracker=self._tracker)
-        self._download_manager.moveToThread(self._connectivity_service_thread)
+        download_manager = session.download_manager
+        download_manager.moveToThread(session.connectivity_service_thread)
         data_dir = self._cfg.sync_directory if self._cfg else get_data_dir()
         downloads_dir = get_downloads_dir(data_dir=data_dir, create=True)
-        self._connectivity_service_thread.started.connect(
-            lambda: self._download_manager.prepare_cleanup(
-                [downloads_dir]))
-        self._connectivity_service_thread.start()
-
-        self._download_manager.idle.connect(self._sync.on_share_idle)
-        self._download_manager.working.connect(self._sync.on_share_downloading)
-        self._download_manager.error.connect(
+        if session.index == 0:
+            session.connectivity_service_thread.started.connect(
+                lambda: download_manager.prepare_cleanup([downloads_dir]))
+        if self._download_limiter:
+            session.connectivity_service_thread.started.connect(
+                lambda: download_manager.set_download_limiter(
+                    self._download_limiter))
+        session.connectivity_service_thread.start()
+
+        download_manager.idle.connect(
+            lambda: self._on_session_idle(session))
+        download_manager.working.connect(
+            lambda: self._on_session_working(session))
+        download_manager.error.connect(
             self._sync.on_share_downloading_error)
-        self._download_manager.progress.connect(
+        download_manager.progress.connect(
             self._sync.send_download_progress)
-        self._download_manager.downloads_status.connect(
-            self._sync.send_downloads_status)
-        self._download_manager.signal_info_tx.connect(self._on_info_tx)
-        self._download_manager.signal_info_rx.connect(self._on_info_rx)
-
-    def _connect_ss_slots(self):
-        self._ss_client.get_connection_params.connect(
-            self.ss_connection_params_cb, Qt.QueuedConnection)
-        self._ss_client.share_info.connect(
-            self.on_share_info_cb, Qt.QueuedConnection)
-        self._ss_client.auth_failure.connect(
-            self._on_auth_failed, Qt.QueuedConnection)
+        download_manager.downloads_status.connect(
+            lambda text, percent, total, downloads_info, uploads_info:
+            self._on_downloads_status(
+                session, text, percent, total, downloads_info, uploads_info))
+        download_manager.signal_info_tx.connect(self._on_info_tx)
+        download_manager.signal_info_rx.connect(self._on_info_rx)
+
+    def _connect_ss_slots(self, session):
+        session.ss_client.get_connection_params.connect(
+            lambda: self.ss_connection_params_cb(session),
+            Qt.QueuedConnection)
+        session.ss_client.share_info.connect(
+            lambda share_info: self.on_share_info_cb(session, share_info),
+            Qt.QueuedConnection)
+        session.ss_client.auth_failure.connect(
+            lambda: self._on_auth_failed(session), Qt.QueuedConnection)
 
     def enable(self):
         """
@@ -262,15 +353,20 @@ class WebshareHandler(object):
     def set_config(self, cfg_data):
         # Setup transport and get signal server address/port
         logger.debug("set_config")
-        addr, port = get_server_addr_port(cfg_data, self._connectivity_service)
+        self._login_data = cfg_data
+        addr, port = get_server_addr_port(cfg_data, None)
         if addr:
             self._ss_addr = addr
         if port:
             self._ss_port = port
+        for session in self._sessions:
+            # add STUN/TURN servers
+            get_server_addr_port(cfg_data, session.connectivity_service)
 
     def set_download_limiter(self, download_limiter):
         self._download_limiter = download_limiter
-        self._download_manager.set_download_limiter(download_limiter)
+        for session in self._sessions:
+            session.download_manager.set_download_limiter(download_limiter)
 
     def download_by_hash(self, share_hash, passwd=None, dest_dir=None):
         """
@@ -288,7 +384,10 @@ class WebshareHandler(object):
             "Queueing share downloading (hash='%s')...", share_hash)
         logger.debug("Dest_dir %s", dest_dir)
         uuid = self._get_folder_uuid(dest_dir)
-        self._queue.put((share_hash, passwd, dest_dir, uuid))
+        with self._shares_lock:
+            self._waiting_shares += 1
+            self._queue.put(ShareDownload(share_hash, passwd, dest_dir, uuid))
+        self._add_sessions()
 
     def download_by_url(self, share_url, dest_dir=None):
         """
@@ -346,44 +445,91 @@ class WebshareHandler(object):
         logger.debug(
             "Starting share processing thread...")
 
-        count = 0
         while True:
             # Do not do anything until enabled
             self._enabled.wait()
             if self._stop:
                 break
             try:
-                share_hash, passwd, dest_dir, uuid = self._queue.get()
-                count += 1
-                if self._enabled.is_set() and self._current_share_name is None:
-                    count = 0
-                    self._process_share(share_hash, passwd, dest_dir, uuid)
-                else:
-                    if self._enabled.is_set() and count == 1:
-                        # emit signal only once while waiting not busy
-                        self.signals.share_download_busy.emit(
-                            FilePath(dest_dir), self._current_share_name)
-                    elif count == 1:
-                        count = 0
-                    self._queue.put((share_hash, passwd, dest_dir, uuid))
-                    time.sleep(0.1)
+                share = self._queue.get()
+                generation = self._queue_generation
+                with self._shares_lock:
+                    if share.hash in self._shares:
+                        # same share is being downloaded,
+                        # it will be queued again when finished
+                        self._postponed_shares[share.hash].append(share)
+                        self._waiting_shares -= 1
+                        continue
+
+                session = self._acquire_session(share)
+                with self._shares_lock:
+                    self._waiting_shares -= 1
+                # wait if disabled while waiting for session
+                self._enabled.wait()
+                if self._stop:
+                    break
+                if generation != self._queue_generation:
+                    # queue was cleared while waiting
+                    self._free_sessions.put(session)
+                    continue
+
+                self._process_share(share, session)
             except Exception:
                 logger.error(
                     "Unhandled exception", exc_info=True)
 
-    def ss_connection_params_cb(self):
-        params = dict()
-        if self._current_share_hash:
-            params["share_hash"] = self._current_share_hash
-        if self._current_passwd:
-            params["passwd"] = self._current_passwd
-        self._ss_client.connection_params.emit(params)
+    def _acquire_session(self, share):
+        try:
+            return self._free_sessions.get_nowait()
+        except Empty:
+            pass
+
+        if self._enabled.is_set():
+            # emit signal only once while waiting not busy
+            self.signals.share_download_busy.emit(
+                FilePath(share.dest_dir), ', '.join(self.get_share_names()))
+        return self._free_sessions.get()
+
+    def _release_session(self, share):
+        with self._shares_lock:
+            session = share.session
+            if not session:
+                return
 
-    def on_share_info_cb(self, share_info):
+            if share.retry_download_timer:
+                share.retry_download_timer.cancel()
+                share.retry_download_timer = None
+            share.session = None
+            session.share = None
+            if self._shares.get(share.hash) is share:
+                self._shares.pop(share.hash)
+            postponed = self._postponed_shares.pop(share.hash, [])
+
+            # freed session is used by first postponed share,
+            # others are postponed again as share hash is the same
+            self._waiting_shares += len(postponed)
+
+        # disconnect from nodes
+        session.ss_client.ss_disconnect()
+        self._free_sessions.put(session)
+        for postponed_share in postponed:
+            self._queue.put(postponed_share)
+
+    def ss_connection_params_cb(self, session):
+        params = dict()
+        share = session.share
+        if share:
+            params["share_hash"] = share.hash
+            if share.passwd:
+                params["passwd"] = share.passwd
+        session.ss_client.connection_params.emit(params)
+
+    def on_share_info_cb(self, session, share_info):
         if not share_info:
             return
 
-        if self._current_share_name:
+        share = session.share
+        if not share or share.name:
             return
 
         share_hash = share_info['share_hash']
@@ -393,45 +539,41 @@ class WebshareHandler(object):
         # Extract files info
         info_processor = ShareInfoProcessor(self._cfg)
         files_info = info_processor.process(share_info)
-        self._current_share_name = info_processor.get_name()
+        share.name = info_processor.get_name()
         if not files_info:
-            self._move()
-            self._ss_client.send_share_downloaded(share_hash)
-            self._tasks.pop(share_hash, None)
-            # disconnect from nodes
-            self._ss_client.ss_disconnect()
-
-            self._current_share_hash = None
-            self._current_share_name = None
-            self._sync.send_download_progress(None, None, None)
+            self._move(share)
+            session.ss_client.send_share_downloaded(share_hash)
+            self._release_session(share)
+            self._clear_download_progress(session)
             return
 
         self.signals.share_download_started.emit(share_hash)
-        self._is_folder = info_processor.is_folder(share_info)
+        share.is_folder = info_processor.is_folder(share_info)
         try:
-            self._create_empty_file_or_folder()
+            self._create_empty_file_or_folder(share)
         except Exception as e:
             logger.error("Error creating empty file or folder %s (%s)",
-                         self._current_share_name, e)
+                         share.name, e)
 
         # Start downloading of all files found
-        self._num_files = len(files_info)
+        share.num_files = len(files_info)
+        for fi in files_info:
+            share.tasks[fi.event_uuid] = fi
         for fi in files_info:
-            self._tasks[share_hash].append(fi.event_uuid)
-            self.start_file_download(fi)
+            self.start_file_download(share, fi)
 
-    def _on_special_file_event(self, path, event_type, new_path):
+    def _on_special_file_event(self, share, path, event_type, new_path):
         logger.debug("Special file event obtained for path %s, type %s",
                      path, event_type)
         special_dirname, special_filename = op.split(path)
         filename = special_filename.rsplit('.', 1)[0]   # cut off '.download'
-        if not self._is_deleting and self._current_share_name == filename and (
+        if not share.is_deleting and share.name == filename and (
                 event_type in (DELETE, MOVE) or not op.exists(path)):
             to_cancel = True
             special_dirname = ensure_unicode(special_dirname)
             rel_special_dir = self._relpath(special_dirname)
-            with self._special_event_lock:
-                self._special_event_no += 1
+            with share.special_event_lock:
+                share.special_event_no += 1
             if event_type == MOVE:
                 new_dir, new_file = op.split(new_path)
                 if special_filename == new_file:    # folder moved locally
@@ -439,83 +581,86 @@ class WebshareHandler(object):
                     rel_new_dir = self._relpath(new_dir)
                     self._sync.update_special_paths.emit(
                         rel_special_dir, rel_new_dir)
-                    self._change_folder_uuid_local(new_dir)
-                    self._update_spec_files(new_path, self._is_folder)
+                    self._change_folder_uuid_local(share, new_dir)
+                    self._update_spec_files(share, new_path, share.is_folder)
                     to_cancel = False
             if event_type == DELETE or to_cancel:
                 folder_deleted = not op.isdir(special_dirname)
                 folder_excluded = self._sync.is_dir_excluded(rel_special_dir)
-                self.cancel_share_download(filename,
-                                           folder_deleted=folder_deleted,
-                                           folder_excluded=folder_excluded)
+                self._cancel_share(share,
+                                   folder_deleted=folder_deleted,
+                                   folder_excluded=folder_excluded)
 
-    def _create_empty_file_or_folder(self):
-        self._fullname = FilePath(self._get_full_name())
-        if not self._fullname:
+    def _create_empty_file_or_folder(self, share):
+        share.fullname = FilePath(self._get_full_name(share))
+        if not share.fullname:
             return
 
         data_dir = self._cfg.sync_directory if self._cfg else get_data_dir()
-        self._in_data_dir = self._fullname in FilePath(data_dir)
-        logger.debug("Adding special file %s", self._fullname)
-        if self._in_data_dir:
-            self._sync.add_special_file(self._fullname,
-                                        self._on_special_file_event)
+        share.in_data_dir = share.fullname in FilePath(data_dir)
+        logger.debug("Adding special file %s", share.fullname)
+        on_special_file_event = \
+            lambda path, event_type, new_path: self._on_special_file_event(
+                share, path, event_type, new_path)
+        if share.in_data_dir:
+            self._sync.add_special_file(share.fullname,
+                                        on_special_file_event)
 
         special_file_created = False
         try:
-            if self._is_folder:
-                make_dirs(self._fullname, is_folder=True)
+            if share.is_folder:
+                make_dirs(share.fullname, is_folder=True)
             else:
-                create_empty_file(self._fullname)
+                create_empty_file(share.fullname)
             special_file_created = True
-            self._update_spec_files(self._fullname, self._is_folder)
+            self._update_spec_files(share, share.fullname, share.is_folder)
         except Exception as e:
             logger.warning("Can't create file or folder %s. Reason %s",
-                           self._fullname, e)
+                           share.fullname, e)
 
-        if not self._in_data_dir and special_file_created:
-            self._sync.add_special_file(self._fullname,
-                                        self._on_special_file_event)
-        elif self._in_data_dir and not special_file_created:
-            self._sync.remove_special_file(self._fullname)
+        if not share.in_data_dir and special_file_created:
+            self._sync.add_special_file(share.fullname,
+                                        on_special_file_event)
+        elif share.in_data_dir and not special_file_created:
+            self._sync.remove_special_file(share.fullname)
 
-    def _delete_empty_file_or_folder(self):
-        self._is_deleting = True
+    def _delete_empty_file_or_folder(self, share):
+        share.is_deleting = True
         fullname = self._get_full_name(
-            cancel=False, existing_file=True)
+            share, cancel=False, existing_file=True)
         if fullname:
-            self._fullname = fullname
+            share.fullname = fullname
 
-        if not self._fullname:
-            self._is_deleting = False
+        if not share.fullname:
+            share.is_deleting = False
             return
 
-        self._fullname = FilePath(self._fullname)
-        logger.debug("Removing special file %s", self._fullname)
-        if not self._in_data_dir:
-            self._sync.remove_special_file(self._fullname)
+        share.fullname = FilePath(share.fullname)
+        logger.debug("Removing special file %s", share.fullname)
+        if not share.in_data_dir:
+            self._sync.remove_special_file(share.fullname)
         try:
-            if self._is_folder:
-                remove_dir(self._fullname)
+            if share.is_folder:
+                remove_dir(share.fullname)
             else:
-                remove_file(self._fullname)
+                remove_file(share.fullname)
         except Exception as e:
             logger.warning("Can't delete file or folder %s. Reason %s",
-                           self._fullname, e)
-        self._update_spec_files()
-        if self._in_data_dir:
-            self._sync.remove_special_file(self._fullname)
-        self._fullname = ""
-        self._is_deleting = False
-
-    def _get_full_name(self, cancel=True, existing_file=False):
+                           share.fullname, e)
+        self._update_spec_files(share)
+        if share.in_data_dir:
+            self._sync.remove_special_file(share.fullname)
+        share.fullname = ""
+        share.is_deleting = False
+
+    def _get_full_name(self, share, cancel=True, existing_file=False):
         data_dir = self._cfg.sync_directory if self._cfg else get_data_dir()
-        dest_dir = self._dest_dirs.get(self._current_share_hash, data_dir)
+        dest_dir = share.dest_dir or data_dir
         if FilePath(dest_dir) in FilePath(data_dir):
-            if not self._renew_dest_dir(cancel, wait=False):
+            if not self._renew_dest_dir(share, cancel, wait=False):
                 return ""
-            dest_dir = self._dest_dirs.get(self._current_share_hash, data_dir)
-        fullname = op.join(dest_dir, self._current_share_name + '.download')
+            dest_dir = share.dest_dir or data_dir
+        fullname = op.join(dest_dir, share.name + '.download')
         fullname = FilePath(fullname).longpath
         if not existing_file:
             fullname = get_next_name(fullname)
@@ -560,7 +705,7 @@ class WebshareHandler(object):
             rel_path = ensure_unicode(rel_path)
         return rel_path
 
-    def _get_path_relative_to_share(self, file_info):
+    def _get_path_relative_to_share(self, share, file_info):
         data_path = self._cfg.sync_directory if self._cfg else get_data_dir()
         share_dir = get_downloads_dir(data_path)
         rel_path = FilePath(op.relpath(file_info.fullname, share_dir))
@@ -569,42 +714,42 @@ class WebshareHandler(object):
         assert rel_path_list, "Must have relative path for share"
 
         # replace share hash with share name in rel path
-        rel_path_list[0] = self._current_share_name
+        rel_path_list[0] = share.name
         rel_path = '/'.join(rel_path_list)
         logger.debug("Relative path for shared file %s is %s",
                      file_info, rel_path)
         return rel_path
 
     @run_daemon
-    def _change_folder_uuid_local(self, dest_dir):
-        event_no = self._special_event_no
-        self._folder_uuid_ready.clear()
+    def _change_folder_uuid_local(self, share, dest_dir):
+        event_no = share.special_event_no
+        share.folder_uuid_ready.clear()
         try:
             while True:
                 try:
                     folder_uuid = self._get_folder_uuid(dest_dir)
                     break
                 except WebshareHandlerPathNotFoundError:
-                    if event_no != self._special_event_no:
+                    if event_no != share.special_event_no:
                         break
                     time.sleep(0.1)
 
-            if event_no == self._special_event_no:
-                self._dest_uuids[self._current_share_hash] = folder_uuid
-                self._renew_dest_dir(wait=False)
+            if event_no == share.special_event_no:
+                share.dest_uuid = folder_uuid
+                self._renew_dest_dir(share, wait=False)
         except Exception as e:
             raise e
         finally:
-            with self._special_event_lock:
-                if event_no == self._special_event_no:
+            with share.special_event_lock:
+                if event_no == share.special_event_no:
                     # no new calls of _change_folder_uuid_local
-                    self._folder_uuid_ready.set()
+                    share.folder_uuid_ready.set()
 
-    def _renew_dest_dir(self, cancel=True, wait=True):
+    def _renew_dest_dir(self, share, cancel=True, wait=True):
         logger.debug("Waiting for folder uuid")
         if wait:
-            self._folder_uuid_ready.wait()
-        folder_uuid = self._dest_uuids[self._current_share_hash]
+            share.folder_uuid_ready.wait()
+        folder_uuid = share.dest_uuid
         logger.debug("Folder uuid got %s", folder_uuid)
         if not folder_uuid:
             return True
@@ -621,38 +766,42 @@ class WebshareHandler(object):
                 else 'deleted' if deleted else 'excluded'
             logger.warning("Can't download shared file '%s' because "
                            "dir %s is %s",
-                           self._current_share_name,
-                           self._dest_dirs[self._current_share_hash],
-                           reason_str)
+                           share.name, share.dest_dir, reason_str)
             if cancel:
                 if deleted:
-                    self.cancel_share_download(self._current_share_name,
-                                               folder_deleted=True)
+                    self._cancel_share(share, folder_deleted=True)
                 else:
-                    self.cancel_share_download(self._current_share_name,
-                                               folder_excluded=True)
+                    self._cancel_share(share, folder_excluded=True)
 
             return False
 
         data_dir = self._cfg.sync_directory if self._cfg else get_data_dir()
-        self._dest_dirs[self._current_share_hash] = op.join(data_dir, path)
+        share.dest_dir = op.join(data_dir, path)
         return True
 
-    def _redownload(self):
-        self._retry_download_timer = None
-        failed_downloads = self._failed_downloads.get(
-            self._current_share_hash, [])
-        if not failed_downloads:
+    def _redownload(self, share):
+        share.retry_download_timer = None
+        failed_downloads = share.failed_downloads
+        if not failed_downloads or not share.session:
             return
 
         logger.debug("Retry failed share file downloads")
-        self._failed_downloads.pop(self._current_share_hash)
+        share.failed_downloads = []
         for file_info in failed_downloads:
-            self.start_file_download(file_info)
+            self.start_file_download(share, file_info)
 
-    def start_file_download(self, file_info):
+    def _get_copy_path(self, file_hash):
         data_path = self._cfg.sync_directory if self._cfg else get_data_dir()
-        download_path = op.join(get_copies_dir(data_path), file_info.file_hash)
+        return op.join(get_copies_dir(data_path), file_hash)
+
+    def start_file_download(self, share, file_info):
+        # Existing copy is used as is. Otherwise file is downloaded
+        # to the path of its own task, so downloads of the same hash
+        # by other sessions or by sync never write the same files
+        download_path = self._get_copy_path(file_info.file_hash)
+        if not op.exists(download_path):
+            download_path = "{}.{}".format(
+                download_path, file_info.event_uuid)
 
         logger.info(
             "Initiating downloading of file '%s' to '%s'...",
@@ -667,20 +816,21 @@ class WebshareHandler(object):
 
         if not file_info.size:
             create_empty_file(file_info.fullname)
-            self._tasks[self._current_share_hash].remove(file_info.event_uuid)
-            self._finish_task_download()
+            share.tasks.pop(file_info.event_uuid, None)
+            self._finish_task_download(share)
             return
 
         elif not self._cfg.download_backups:
             self._sync.make_copy_from_existing_files(file_info.file_hash)
 
         files_info = [{
-            "target_file_path" : self._get_path_relative_to_share(file_info),
+            "target_file_path": self._get_path_relative_to_share(
+                share, file_info),
             "mtime": 0, # mtime == 0 => shared file
             "is_created": None,
             "is_deleted": None}]
 
-        self._download_manager.add_file_download(
+        share.session.download_manager.add_file_download(
             DOWNLOAD_PRIORITY_FILE,
             file_info.event_uuid,
             file_info.size,
@@ -691,102 +841,166 @@ class WebshareHandler(object):
             on_failure,
             files_info=files_info,)
 
-    def _finish_task_download(self):
-        self._num_files -= 1
+    def _finish_task_download(self, share):
+        share.num_files -= 1
         logger.debug("Current not downloaded: %s, num_files: %s",
-                     self._tasks[self._current_share_hash],
-                     self._num_files)
-
-        if not self._tasks[self._current_share_hash] \
-                and self._num_files == 0:
-            if self._cancelled_tasks[self._current_share_hash] and \
-                    not self._downloaded_tasks[self._current_share_hash]:
-                self.cancel_share_download(self._current_share_name)
+                     list(share.tasks), share.num_files)
+
+        if not share.tasks and share.num_files == 0:
+            if share.cancelled_tasks and not share.downloaded_tasks:
+                self._cancel_share(share)
                 return
 
             # all tasks successfully downloaded
-            self.signals.share_download_complete.emit(
-                self._current_share_name)
-            self._ss_client.send_share_downloaded(self._current_share_hash)
+            self.signals.share_download_complete.emit(share.name)
+            share.session.ss_client.send_share_downloaded(share.hash)
             try:
-                self._delete_empty_file_or_folder()
+                self._delete_empty_file_or_folder(share)
             except Exception as e:
                 logger.error("Error deleting empty file or folder %s (%s)",
-                             self._current_share_name, e)
-            self._move()
+                             share.name, e)
+            self._move(share)
+
+            session = share.session
+            self._release_session(share)
+            self._clear_download_progress(session)
+
+    def _find_share_by_task(self, task_id):
+        with self._shares_lock:
+            for share in self._shares.values():
+                if task_id in share.tasks:
+                    return share
+        return None
+
+    def _is_copy_needed(self, file_hash):
+        with self._shares_lock:
+            if any(fi.file_hash == file_hash
+                   for share in self._shares.values()
+                   for fi in share.tasks.values()):
+                return True
+        # copy is referenced or being downloaded by main sync
+        return self._sync.is_copy_needed(file_hash)
+
+    def _place_downloaded_file(self, share, download_path, file_info):
+        """
+        Puts downloaded file to share download dir.
+        File downloaded to task path is renamed to the destination,
+        if the share is saved outside sync dir and the copy is not needed
+        for other files, so sync would not use the copy later.
+        Otherwise it is moved to copies dir atomically and
+        copy-on-write clone or copy of it is used
+        """
+        copy_path = self._get_copy_path(file_info.file_hash)
+        if download_path != copy_path:
+            data_dir = self._cfg.sync_directory if self._cfg \
+                else get_data_dir()
+            dest_dir = share.dest_dir or data_dir
+            if FilePath(dest_dir) not in FilePath(data_dir) and \
+                    not op.exists(copy_path) and \
+                    not self._is_copy_needed(file_info.file_hash):
+                try:
+                    os.replace(download_path, file_info.fullname)
+                    return
+                except OSError as e:
+                    logger.debug("Can't rename '%s' to '%s' (%s)",
+                                 download_path, file_info.fullname, e)
 
-            # disconnect from nodes
-            self._ss_client.ss_disconnect()
+            self._publish_copy(download_path, copy_path)
 
-            self._clear_current_share_commons()
-            self._sync.send_download_progress(None, None, None)
+        if clone_file(copy_path, file_info.fullname):
+            return
+
+        copy_file(copy_path, file_info.fullname)
+
+    def _publish_copy(self, download_path, copy_path):
+        if op.exists(copy_path):
+            # same content is already there
+            remove_file(download_path)
+            return
+
+        try:
+            os.replace(download_path, copy_path)
+        except OSError as e:
+            logger.debug("Can't rename '%s' to '%s' (%s)",
+                         download_path, copy_path, e)
+            if not op.exists(copy_path):
+                raise
+            remove_file(download_path)
 
     def _on_download_success(self, task_id, file_info, download_path):
         logger.info("Download task SUCCESS obj_id='%s'", task_id)
 
+        share = self._find_share_by_task(task_id)
+        if not share:
+            logger.debug("No share for download task %s", task_id)
+            if download_path != self._get_copy_path(file_info.file_hash):
+                remove_file(download_path)
+            return
+
         # remove successful task
-        self._tasks[self._current_share_hash].remove(task_id)
-        self._downloaded_tasks[self._current_share_hash].add(task_id)
-        copy_file(download_path, file_info.fullname)
-        self._finish_task_download()
+        share.tasks.pop(task_id, None)
+        share.downloaded_tasks.add(task_id)
+        self._place_downloaded_file(share, download_path, file_info)
+        self._finish_task_download(share)
 
     def _on_download_failure(self, task_id, file_info):
         logger.info("Download task FAILURE obj_id='%s'", task_id)
-        if task_id in self._cancelled_tasks[self._current_share_hash]:
-            self._tasks[self._current_share_hash].remove(task_id)
-            self._finish_task_download()
+        share = self._find_share_by_task(task_id)
+        if not share:
+            logger.debug("No share for download task %s", task_id)
+            return
+
+        if task_id in share.cancelled_tasks:
+            share.tasks.pop(task_id, None)
+            self._finish_task_download(share)
         else:
-            if not self._retry_download_timer:
-                self._retry_download_timer = Timer(
+            if not share.retry_download_timer:
+                share.retry_download_timer = Timer(
                     self._retry_download_timeout,
-                    self._redownload)
-                self._retry_download_timer.start()
+                    lambda: self._redownload(share))
+                share.retry_download_timer.start()
 
-            self._failed_downloads[self._current_share_hash].append(
-                file_info)
+            share.failed_downloads.append(file_info)
 
-        self._sync.send_download_progress(None, None, None)
+        self._clear_download_progress(share.session)
 
-    def _process_share(self, share_hash, passwd=None, dest_dir=None,
-                       uuid=None):
+    def _process_share(self, share, session):
         logger.info(
-            "Processing share hash='%s'", share_hash)
-        self._current_share_hash = share_hash
-        self._dest_dirs[share_hash] = dest_dir
-        self._dest_uuids[share_hash] = uuid
-        self._current_passwd = passwd
+            "Processing share hash='%s' in session %s",
+            share.hash, session.index)
+        with self._shares_lock:
+            share.session = session
+            session.share = share
+            self._shares[share.hash] = share
 
         self_hosted = self._cfg.host != REGULAR_URI
         fingerprint = None if self_hosted else \
             "86025017022f6dcf9022d6fb867c3bb3bdc621103ddd8e9ed2c891a46d8dd856"
-        self._ss_client.ss_connect(
+        session.ss_client.ss_connect(
             self._ss_addr, self._ss_port, use_ssl=True, ssl_cert_verify=True,
             ssl_fingerprint=fingerprint,
             timeout=20)
 
-    def _on_auth_failed(self):
-        share_hash = self._current_share_hash
-        logger.info(
-            "Unable to process share hash='%s'", share_hash)
-        self._current_share_hash = None
-        self._dest_dirs.pop(share_hash, None)
-        self._dest_uuids.pop(share_hash, None)
-        self._current_passwd = None
+    def _on_auth_failed(self, session):
+        share = session.share
+        if not share:
+            return
 
-        self._ss_client.ss_disconnect()
+        logger.info(
+            "Unable to process share hash='%s'", share.hash)
+        self._release_session(share)
 
         self.signals.share_unavailable.emit()
 
-    def _move(self):
+    def _move(self, share):
         data_dir = self._cfg.sync_directory if self._cfg else get_data_dir()
         downloads_dir = get_downloads_dir(data_dir=data_dir, create=True)
-        download_name = op.join(downloads_dir,
-                                self._current_share_hash)
-        if not self._renew_dest_dir():
+        download_name = op.join(downloads_dir, share.hash)
+        if not self._renew_dest_dir(share):
             return
 
-        dest_dir = self._dest_dirs.get(self._current_share_hash, data_dir)
-        dest_name = op.join(dest_dir, self._current_share_name)
+        dest_dir = share.dest_dir or data_dir
+        dest_name = op.join(dest_dir, share.name)
         dest_name = FilePath(dest_name).longpath
         dest_name = get_next_name(dest_name)
         logger.debug("Move '%s' to '%s'", download_name, dest_name)
@@ -797,121 +1011,133 @@ class WebshareHandler(object):
         except IOError as e:
             logger.warning("Can't move downloaded shared file to %s. "
                            "Reason: %s", dest_name, e)
-            self.cancel_share_download(self._current_share_name,
-                                       folder_deleted=True)
+            self._cancel_share(share, folder_deleted=True)
 
-    def _clear_share_download(self):
+    def _clear_share_download(self, share):
         data_dir = self._cfg.sync_directory if self._cfg else get_data_dir()
         downloads_dir = get_downloads_dir(data_dir=data_dir, create=True)
-        download_name = op.join(downloads_dir,
-                                self._current_share_hash)
-        if self._is_folder:
+        download_name = op.join(downloads_dir, share.hash)
+        if share.is_folder:
             remove_dir(download_name)
         else:
             remove_file(download_name)
 
-    def get_share_name(self):
-        return self._current_share_name
+    def get_share_names(self):
+        with self._shares_lock:
+            return [share.name for share in self._shares.values()
+                    if share.name]
 
     def cancel_share_download(self, share_name, folder_deleted=False,
                               folder_excluded=False):
         logger.debug("Cancel share download %s", share_name)
-        if not self._current_share_name or \
-                self._current_share_name != share_name:
+        with self._shares_lock:
+            shares = [share for share in self._shares.values()
+                      if share.name and share.name == share_name]
+        for share in shares:
+            self._cancel_share(share, folder_deleted=folder_deleted,
+                               folder_excluded=folder_excluded)
+
+    def _cancel_share(self, share, folder_deleted=False,
+                      folder_excluded=False):
+        session = share.session
+        if not session or not share.name:
             return
 
-        enabled = self._enabled.is_set()
-        if enabled:
-            self.disable()
-        if self._download_manager:
-            self._download_manager.cancel_all_downloads()
+        logger.debug("Cancel share download %s", share.name)
+        session.download_manager.cancel_all_downloads()
         try:
-            self._delete_empty_file_or_folder()
-            self._clear_share_download()
+            self._delete_empty_file_or_folder(share)
+            self._clear_share_download(share)
         except Exception as e:
             logger.error("Error deleting empty file or folder %s (%s)",
-                         self._current_share_name, e)
+                         share.name, e)
 
-        self._ss_client.ss_disconnect()
+        self._release_session(share)
 
-        self.signals.share_download_failed.emit(self._current_share_name)
+        self.signals.share_download_failed.emit(share.name)
         if not folder_deleted and not folder_excluded:
-            self.signals.share_download_cancelled.emit(
-                self._current_share_name)
+            self.signals.share_download_cancelled.emit(share.name)
         elif folder_excluded:
-            self.signals.share_download_folder_excluded.emit(
-                self._current_share_name)
+            self.signals.share_download_folder_excluded.emit(share.name)
         else:
-            self.signals.share_download_folder_deleted.emit(
-                self._current_share_name)
-
-        self._clear_current_share_commons()
-        if enabled:
-            self.enable()
+            self.signals.share_download_folder_deleted.emit(share.name)
 
     def cancel_files_downloads(self, files):
         for obj_id in files:
             self._cancel_file_download(obj_id)
 
     def _cancel_file_download(self, obj_id):
-        if self._download_manager:
-            self._cancelled_tasks[self._current_share_hash].add(obj_id)
-            self._download_manager.cancel_download(obj_id)
-
-    def _clear_current_share_commons(self):
-        self._tasks.pop(self._current_share_hash, None)
-        self._failed_downloads.pop(self._current_share_hash, None)
-        self._dest_dirs.pop(self._current_share_hash, None)
-        self._dest_uuids.pop(self._current_share_hash, None)
-        self._cancelled_tasks.pop(self._current_share_hash, None)
-        self._downloaded_tasks.pop(self._current_share_hash, None)
-        self._current_share_hash = None
-        self._current_share_name = None
-
-    def _quit_connectivity(self):
-        self._connectivity_service.disconnect_ss_slots()
-        if self._download_manager:
-            self._download_manager.quit.emit()
-            self._download_manager = None
-        self._connectivity_service_thread.quit()
+        share = self._find_share_by_task(obj_id)
+        if share and share.session:
+            share.cancelled_tasks.add(obj_id)
+            share.session.download_manager.cancel_download(obj_id)
+
+    def _quit_connectivity(self, session):
+        session.connectivity_service.disconnect_ss_slots()
+        if session.download_manager:
+            session.download_manager.quit.emit()
+            session.download_manager = None
+        session.connectivity_service_thread.quit()
 
     def is_connectivity_alive(self):
-        return self._connectivity_service.is_alive()
+        return all(session.connectivity_service.is_alive()
+                   for session in self._sessions)
 
     def restart_connectivity(self):
         self.stop()
-        self._quit_connectivity()
-        self._init_connectivity()
+        for session in self._sessions:
+            self._quit_connectivity(session)
+            self._init_connectivity(session)
         self.start()
 
     def stop(self, cancel_downloads=False):
         self.disable()
-        if self._download_manager and not cancel_downloads:
-            self._download_manager.pause_all_downloads(
-                disconnect_callbacks=False)
-
-        if cancel_downloads:
-            self.cancel_share_download(self._current_share_name)
-            self._queue = Queue()
-            self._tasks.clear()
-            self._failed_downloads.clear()
-            self._dest_dirs.clear()
-            self._dest_uuids.clear()
+        if not cancel_downloads:
+            for session in self._sessions:
+                if session.download_manager:
+                    session.download_manager.pause_all_downloads(
+                        disconnect_callbacks=False)
+            return
+
+        with self._shares_lock:
+            shares = list(self._shares.values())
+            self._postponed_shares.clear()
+        for share in shares:
+            if share.name:
+                self._cancel_share(share)
+            else:
+                # share info is not obtained yet
+                self._release_session(share)
+        self._queue_generation += 1
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+            with self._shares_lock:
+                self._waiting_shares -= 1
 
     def start(self):
-        self._on_special_file_event(self._fullname, None, None)
-        if self._download_manager:
-                self._download_manager.resume_all_downloads()
+        with self._shares_lock:
+            shares = list(self._shares.values())
+        for share in shares:
+            self._on_special_file_event(share, share.fullname, None, None)
+        for session in self._sessions:
+            if session.download_manager:
+                session.download_manager.resume_all_downloads()
         self.enable()
 
     def exit(self):
         self.stop(cancel_downloads=True)
-        self._download_manager.quit.emit()
-        self._connectivity_service.quit.emit()
-        self._connectivity_service_thread.quit()
-        self._connectivity_service_thread.wait()
-        self._ss_client.ss_disconnect()
+        self._stop = True
+        for session in self._sessions:
+            session.download_manager.quit.emit()
+            session.connectivity_service.quit.emit()
+            session.connectivity_service_thread.quit()
+            session.connectivity_service_thread.wait()
+            session.ss_client.ss_disconnect()
         # stop running thread
+        self._enabled.set()
 
     def _on_info_tx(self, info_tx):
         self.signal_info_tx.emit(info_tx)
@@ -949,26 +1175,66 @@ class WebshareHandler(object):
         except Exception as e:
             logger.warning("Failed to save special files data (%s)", e)
 
-    def _update_spec_files(self, path=None, is_directory=False):
-        if not self._current_share_hash:
-            return
-
-        current_hash = self._current_share_hash
-        if path:
-            self._spec_files[current_hash] = (path, is_directory)
-        else:
-            self._spec_files.pop(current_hash, None)
-        try:
-            with open(self._filename, 'wb') as f:
-                pickle.dump(self._spec_files, f, protocol=2)
-            logger.debug("Saved special files data for hashes %s",
-                         list(self._spec_files.keys()))
-        except Exception as e:
-            logger.error("Failed to save special files data (%s)", e)
+    def _update_spec_files(self, share, path=None, is_directory=False):
+        with self._spec_files_lock:
+            if path:
+                self._spec_files[share.hash] = (path, is_directory)
+            else:
+                self._spec_files.pop(share.hash, None)
             try:
-                remove_file(self._filename)
-            except Exception:
-                pass
+                with open(self._filename, 'wb') as f:
+                    pickle.dump(self._spec_files, f, protocol=2)
+                logger.debug("Saved special files data for hashes %s",
+                             list(self._spec_files.keys()))
+            except Exception as e:
+                logger.error("Failed to save special files data (%s)", e)
+                try:
+                    remove_file(self._filename)
+                except Exception:
+                    pass
+
+    def _on_session_idle(self, session):
+        session.idle = True
+        if all(s.idle for s in self._sessions):
+            self._sync.on_share_idle()
+
+    def _on_session_working(self, session):
+        session.idle = False
+        self._sync.on_share_downloading()
+
+    def _on_downloads_status(self, session, text, percent, total,
+                             downloads_info, uploads_info):
+        session.progress = (text, percent, total)
+        self._sync.send_downloads_status(
+            *self._get_progress(), downloads_info, uploads_info)
+
+    def _get_progress(self):
+        """
+        Aggregates progress of all sessions: file being downloaded
+        in first downloading session and total files count in all sessions
+
+        @return (text, percent, total) [tuple]
+        """
+        progresses = [s.progress for s in self._sessions if s.progress[0]]
+        if not progresses:
+            return EMPTY_PROGRESS
+
+        text, percent, _ = progresses[0]
+        return text, percent, sum(p[2] for p in progresses)
+
+    def _clear_download_progress(self, session):
+        """
+        Clears session progress. Global progress is cleared only
+        when neither other sessions nor main sync are downloading
+        """
+        if session:
+            session.progress = EMPTY_PROGRESS
+        if any(s.progress[0] for s in self._sessions):
+            self._sync.send_download_progress(*self._get_progress())
+        elif not self._sync.is_downloading():
+            self._sync.send_download_progress(None, None, None)
 
-    def _on_connected_nodes_changed(self, nodes):
-        self.signals.connected_nodes_changed.emit(len(nodes))
+    def _on_connected_nodes_changed(self, session, nodes):
+        session.connected_nodes = len(nodes)
+        self.signals.connected_nodes_changed.emit(
+            sum(s.connected_nodes for s in self._sessions))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import os
+from os.path import exists
+
+import pytest
+
+from common.constants import SIGNATURE_BLOCK_SIZE
+from service.monitor.copies.chunk_store import ChunkStore
+from service.monitor.rsync import Rsync
+
+BLOCK = SIGNATURE_BLOCK_SIZE
+
+
+def blocks(*seeds):
+    return [bytes([seed]) * BLOCK for seed in seeds]
+
+
+def make_copy(tmp_path, name, data):
+    path = str(tmp_path / name)
+    with open(path, 'wb') as f:
+        f.write(b''.join(data))
+    return Rsync.hash_from_block_checksum(Rsync.block_checksum(path)), path
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkStore(str(tmp_path / 'chunks'))
+
+
+def test_put_and_get(tmp_path, store):
+    data = blocks(1, 2) + [b'tail']
+    hash, path = make_copy(tmp_path, 'a', data)
+
+    assert store.put(hash, path)
+    assert store.contains(hash)
+    assert store.get_size(hash) == 2 * BLOCK + 4
+
+    restored = str(tmp_path / 'restored')
+    assert store.get(hash, restored)
+    assert read(restored) == b''.join(data)
+    assert not store.get('0' * 32, restored)
+
+
+def test_put_rejects_hash_mismatch(tmp_path, store):
+    _, path = make_copy(tmp_path, 'a', blocks(1))
+
+    assert not store.put('0' * 32, path)
+    assert not store.contains('0' * 32)
+
+
+def test_blocks_deduplicated(tmp_path, store):
+    hash_a, path_a = make_copy(tmp_path, 'a', blocks(1, 2, 1))
+    hash_b, path_b = make_copy(tmp_path, 'b', blocks(2, 3))
+
+    assert store.put(hash_a, path_a)
+    assert store.put(hash_b, path_b)
+    assert store.put(hash_a, path_a)
+
+    copies_size, packs_size = store.get_stored_size()
+    assert copies_size == 5 * BLOCK
+    assert packs_size == 3 * BLOCK
+
+    restored = str(tmp_path / 'restored')
+    assert store.get(hash_b, restored)
+    assert read(restored) == read(path_b)
+
+
+def test_garbage_collection_rewrites_sparse_pack(
+        tmp_path, store, monkeypatch):
+    # append pack is switched once it is 3 blocks long
+    monkeypatch.setattr(ChunkStore, 'PACK_MAX_SIZE', 3 * BLOCK)
+    hash_a, path_a = make_copy(tmp_path, 'a', blocks(1, 2, 3))
+    hash_b, path_b = make_copy(tmp_path, 'b', blocks(1, 4))
+    assert store.put(hash_a, path_a)
+    assert store.put(hash_b, path_b)
+    first_pack = store._pack_path(0)
+    assert exists(first_pack)
+
+    store.remove([hash_a])
+    store.collect_garbage()
+
+    # only block 1 of first pack is used, so pack is rewritten
+    assert not exists(first_pack)
+    assert not store.contains(hash_a)
+    _, packs_size = store.get_stored_size()
+    assert packs_size == 2 * BLOCK
+    restored = str(tmp_path / 'restored')
+    assert store.get(hash_b, restored)
+    assert read(restored) == read(path_b)
+
+
+def test_garbage_collection_skips_pinned_pack(
+        tmp_path, store, monkeypatch):
+    monkeypatch.setattr(ChunkStore, 'PACK_MAX_SIZE', 3 * BLOCK)
+    hash_a, path_a = make_copy(tmp_path, 'a', blocks(1, 2, 3))
+    hash_b, path_b = make_copy(tmp_path, 'b', blocks(4))
+    assert store.put(hash_a, path_a)
+    assert store.put(hash_b, path_b)
+
+    store.remove([hash_a])
+    # pack is being read
+    store._pins[0] += 1
+    store.collect_garbage()
+    assert exists(store._pack_path(0))
+
+    store._unpin([0])
+    store.collect_garbage()
+    assert not exists(store._pack_path(0))
+
+
+def test_store_reopened(tmp_path, store):
+    hash, path = make_copy(tmp_path, 'a', blocks(1, 2))
+    assert store.put(hash, path)
+    os.remove(path)
+
+    store = ChunkStore(str(tmp_path / 'chunks'))
+    restored = str(tmp_path / 'restored')
+    assert store.get(hash, restored)
+    assert read(restored) == b''.join(blocks(1, 2))
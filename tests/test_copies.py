@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import os
+import sqlite3
+import time
+from os.path import exists, join
+
+import pytest
+
+from common.utils import get_copies_dir
+from service.monitor.copies.copies import Copies
+from service.monitor.rsync import Rsync
+
+HASH_A = 'a' * 32
+HASH_B = 'b' * 32
+
+
+@pytest.fixture
+def no_flush(monkeypatch):
+    # changes are kept in ledger and journal only, until explicit flush
+    monkeypatch.setattr(Copies, 'LEDGER_FLUSH_INTERVAL', 3600)
+    monkeypatch.setattr(Copies, 'LEDGER_FLUSH_SIZE', 10 ** 6)
+
+
+def create_copies(root):
+    return Copies(str(root), extended_logging=False)
+
+
+def db_counts(root):
+    connection = sqlite3.connect(join(get_copies_dir(str(root)), 'copies.db'))
+    try:
+        return dict(connection.execute("select hash, count from copies"))
+    finally:
+        connection.close()
+
+
+def journal(root):
+    with open(join(get_copies_dir(str(root)), 'copies.journal')) as f:
+        return f.read()
+
+
+def drop(copies):
+    # instance dropped without close, as on crash
+    if copies._flush_timer:
+        copies._flush_timer.cancel()
+
+
+def test_counts_saved_to_db_by_flush(tmp_path, no_flush):
+    copies = create_copies(tmp_path)
+    copies.add_copy_reference(HASH_A)
+    copies.add_copy_reference(HASH_A)
+    copies.add_copy_reference(HASH_B)
+    copies.remove_copy_reference(HASH_B)
+
+    assert db_counts(tmp_path) == {}
+    assert journal(tmp_path)
+
+    copies.flush_ledger()
+    assert db_counts(tmp_path) == {HASH_A: 2, HASH_B: 0}
+    assert journal(tmp_path) == ''
+    copies.close()
+
+
+def test_journal_replayed_after_crash(tmp_path, no_flush):
+    copies = create_copies(tmp_path)
+    copies.add_copy_reference(HASH_A)
+    copies.flush_ledger()
+    copies.add_copy_reference(HASH_A)
+    copies.add_copy_reference(HASH_B)
+    drop(copies)
+    assert db_counts(tmp_path) == {HASH_A: 1}
+
+    copies = create_copies(tmp_path)
+    assert copies.has_references(HASH_A)
+    assert copies.has_references(HASH_B)
+    assert db_counts(tmp_path) == {HASH_A: 2, HASH_B: 1}
+
+    # replayed records are kept till next flush and give same counts
+    copies.remove_copy_reference(HASH_B)
+    drop(copies)
+    copies = create_copies(tmp_path)
+    assert copies.has_references(HASH_A)
+    assert not copies.has_references(HASH_B)
+    assert db_counts(tmp_path) == {HASH_A: 2, HASH_B: 0}
+    copies.close()
+
+
+def test_incomplete_journal_record_ignored(tmp_path, no_flush):
+    copies = create_copies(tmp_path)
+    copies.add_copy_reference(HASH_A)
+    drop(copies)
+    with open(join(get_copies_dir(str(tmp_path)), 'copies.journal'),
+              'a') as f:
+        f.write(HASH_B[:10])
+
+    copies = create_copies(tmp_path)
+    assert copies.has_references(HASH_A)
+    assert not copies.has_references(HASH_B)
+    assert db_counts(tmp_path) == {HASH_A: 1}
+    copies.close()
+
+
+def test_flush_by_ledger_size(tmp_path, no_flush, monkeypatch):
+    monkeypatch.setattr(Copies, 'LEDGER_FLUSH_SIZE', 2)
+    copies = create_copies(tmp_path)
+    copies.add_copy_reference(HASH_A)
+    assert db_counts(tmp_path) == {}
+    copies.add_copy_reference(HASH_B)
+    assert db_counts(tmp_path) == {HASH_A: 1, HASH_B: 1}
+    copies.close()
+
+
+def test_postponed_changes_applied_on_commit(tmp_path, no_flush):
+    copies = create_copies(tmp_path)
+    copies.add_copy_reference(HASH_A, postponed=True)
+    copies.add_copy_reference(HASH_A, postponed=True)
+    copies.remove_copy_reference(HASH_A, postponed=True)
+    copies.commit_last_changes()
+    copies.close()
+
+    assert db_counts(tmp_path) == {HASH_A: 1}
+
+
+def test_close_saves_counts(tmp_path, no_flush):
+    copies = create_copies(tmp_path)
+    copies.add_copy_reference(HASH_A)
+    copies.close()
+    assert db_counts(tmp_path) == {HASH_A: 1}
+
+    # closed instance reloads ledger if still used
+    copies.remove_copy_reference(HASH_A)
+    copies.close()
+    assert db_counts(tmp_path) == {HASH_A: 0}
+
+
+def test_packed_copy_restored_on_use(tmp_path, no_flush, monkeypatch):
+    monkeypatch.setattr(Copies, 'PACK_MIN_AGE', 60)
+    copies = Copies(str(tmp_path), extended_logging=False, chunk_store=True)
+    data = os.urandom(3000)
+    path = str(tmp_path / 'file')
+    with open(path, 'wb') as f:
+        f.write(data)
+    hash = Rsync.hash_from_block_checksum(Rsync.block_checksum(path))
+    copy_path = copies.get_copy_file_path(hash)
+    os.replace(path, copy_path)
+    os.utime(copy_path, (time.time() - 120, time.time() - 120))
+    copies.add_copy_reference(hash)
+
+    copies.pack_copies()
+    assert not exists(copy_path)
+    assert copies.copy_exists(hash)
+    assert copies.get_copy_size(hash) == len(data)
+
+    assert copies.ensure_copy_file(hash)
+    with open(copy_path, 'rb') as f:
+        assert f.read() == data
+
+    # copy just used is not packed again
+    os.utime(copy_path, (time.time() - 120, time.time() - 120))
+    copies.pack_copies()
+    assert exists(copy_path)
+    copies.close()
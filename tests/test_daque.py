@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import threading
+
+import pytest
+
+from service.daque import Daque, Empty
+
+
+def is_io(item):
+    return item.startswith('io')
+
+
+def drain(daque):
+    items = []
+    while not daque.empty():
+        items.append(daque.get_nowait())
+    return items
+
+
+def test_order_with_putleft():
+    daque = Daque()
+    daque.put('a')
+    daque.put('b')
+    daque.putleft('c')
+    daque.putleft('d')
+    daque.put('e')
+
+    assert drain(daque) == ['d', 'c', 'a', 'b', 'e']
+    with pytest.raises(Empty):
+        daque.get_nowait()
+
+
+def test_lanes_keep_common_order():
+    daque = Daque(max_workers=2, max_io_workers=1, is_io=is_io)
+    daque.put('a')
+    daque.put('io1')
+    daque.putleft('io0')
+    daque.put('b')
+    daque.put('io2')
+
+    assert drain(daque) == ['io0', 'a', 'io1', 'b', 'io2']
+
+
+def test_workers_limited_per_lane():
+    daque = Daque(max_workers=1, max_io_workers=1, is_io=is_io)
+    for item in ('a', 'b', 'io1', 'io2'):
+        daque.put(item)
+
+    assert daque.get_nowait(to_process=True) == 'a'
+    # regular lane is busy, io item later in order is taken
+    assert daque.get_nowait(to_process=True) == 'io1'
+    with pytest.raises(Empty):
+        daque.get_nowait(to_process=True)
+    # items are still available when not taken for processing
+    assert daque.get_nowait() == 'b'
+
+    daque.task_done(None, 'io1')
+    assert daque.get_nowait(to_process=True) == 'io2'
+    daque.task_done(None, 'a')
+    daque.task_done(None, 'io2')
+    assert daque.empty()
+
+
+def test_postponed_and_disabled():
+    daque = Daque()
+    daque.put('a')
+    daque.set_postponed()
+    with pytest.raises(Empty):
+        daque.get(timeout=0.01)
+
+    daque.set_postponed(False)
+    daque.disable()
+    daque.put('b')
+    daque.putleft('c')
+    daque.enable()
+    assert drain(daque) == ['a']
+
+
+def test_blocking_get_woken_by_put():
+    daque = Daque(max_workers=1, max_io_workers=1, is_io=is_io)
+    daque.put('a')
+    assert daque.get(to_process=True) == 'a'
+    daque.put('b')
+
+    got = []
+    getter = threading.Thread(
+        target=lambda: got.append(daque.get(timeout=5, to_process=True)))
+    getter.start()
+    # get waits until worker of regular lane is released
+    daque.task_done(None, 'a')
+    getter.join()
+    assert got == ['b']
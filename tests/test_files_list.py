@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+from collections import namedtuple
+from unittest.mock import Mock
+
+import pytest
+
+from common.constants import FILE_LIST_COUNT_LIMIT
+from service.monitor.files_list import FilesList
+
+StoredFile = namedtuple(
+    'StoredFile', 'relative_path is_folder mtime was_updated')
+
+
+def paths(files):
+    return [file[0] for file in files]
+
+
+@pytest.fixture
+def storage():
+    storage = Mock()
+    storage.get_last_files.return_value = []
+    return storage
+
+
+@pytest.fixture
+def files_list(storage):
+    files_list = FilesList(storage, '/root')
+    files_list.start()
+    return files_list
+
+
+def test_newest_files_first(files_list):
+    files_list.on_file_added('a', False, 10)
+    files_list.on_file_added('b', False, 30)
+    files_list.on_file_added('c', False, 20)
+    files_list.on_file_added('dir', True, 40)
+
+    assert paths(files_list.get()) == ['b', 'c', 'a']
+    # unchanged list is not sent again
+    assert files_list.get() is None
+
+    files_list.on_file_modified('a', 35)
+    files_list.on_file_modified('c', 100)
+    files = files_list.get()
+    assert paths(files) == ['c', 'a', 'b']
+    # modification long after previous one marks file updated
+    assert files[0][3] and not files[1][3]
+
+
+def test_index_bounded_by_store_limit(files_list):
+    limit = files_list._store_limit
+    for i in range(limit + 10):
+        files_list.on_file_added('f{}'.format(i), False, i)
+
+    assert len(files_list._files_dict) == limit
+    assert 'f9' not in files_list._files_dict
+    files = files_list.get()
+    assert len(files) == FILE_LIST_COUNT_LIMIT
+    assert files[0][0] == 'f{}'.format(limit + 9)
+
+    # file older than all indexed ones is not kept
+    changed = Mock()
+    files_list.file_list_changed.connect(changed)
+    files_list.on_file_added('old', False, -1)
+    assert 'old' not in files_list._files_dict
+    assert not changed.called
+
+
+def test_folder_deleted_and_moved(files_list):
+    files_list.on_file_added('d/a', False, 1)
+    files_list.on_file_added('d/e/b', False, 2)
+    files_list.on_file_added('dx', False, 3)
+    files_list.on_file_added('c', False, 4)
+
+    files_list.on_file_moved('d', 'n')
+    assert paths(files_list.get()) == ['c', 'dx', 'n/e/b', 'n/a']
+
+    files_list.on_file_deleted('n/e')
+    assert paths(files_list.get()) == ['c', 'dx', 'n/a']
+    files_list.on_file_deleted('dx')
+    assert paths(files_list.get()) == ['c', 'n/a']
+
+
+def test_loaded_from_storage(storage):
+    storage.get_last_files.return_value = [
+        StoredFile('s1', False, 5, True), StoredFile('s2', False, 50, False)]
+    files_list = FilesList(storage, '/root')
+    files_list.start()
+    files_list.on_file_added('s1', False, 60)
+
+    files = files_list.get()
+    assert paths(files) == ['s1', 's2']
+    # file event is newer than stored state
+    assert files[0] == ('s1', False, 60, False)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock
+
+import pytest
+
+from service.http_downloader import HttpDownloader, HttpDownloadTask, \
+    RangesState
+
+RANGE_SIZE = 64 * 1024
+DATA = os.urandom(20 * RANGE_SIZE + 1000)
+
+
+def test_ranges_merged_and_counted_once(tmp_path):
+    state = RangesState(str(tmp_path / 'file'))
+    state.reset(100)
+    state.add(10, 20)
+    state.add(30, 40)
+    state.add(15, 35)
+    state.add(0, 5)
+    state.add(0, 5)
+
+    assert state.done == [[0, 5], [10, 40]]
+    assert state.loaded == 35
+    assert state.first_missing() == 5
+    assert state.gaps() == [[5, 10], [40, 100]]
+
+    state.add(5, 100)
+    assert state.done == [[0, 100]]
+    assert state.loaded == 100
+    assert state.gaps() == []
+
+
+def test_ranges_saved_and_loaded(tmp_path):
+    path = str(tmp_path / 'file')
+    state = RangesState(path)
+    state.reset(100)
+    state.add(20, 50)
+    state.save()
+    assert RangesState.exists(path)
+
+    loaded = RangesState(path)
+    assert loaded.load()
+    assert (loaded.size, loaded.done, loaded.loaded) == (100, [[20, 50]], 30)
+    assert loaded.gaps() == [[0, 20], [50, 100]]
+
+    with open(path + RangesState.suffix, 'w') as f:
+        f.write('{"size": 100, "do')
+    assert not RangesState(path).load()
+
+    loaded.remove()
+    assert not RangesState.exists(path)
+
+
+class RangeServer(object):
+    """
+    Local http server stub serving DATA by byte ranges
+    """
+
+    def __init__(self):
+        self.ranges = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                match = re.match(r'bytes=(\d+)-(\d*)',
+                                 self.headers.get('Range', ''))
+                start = int(match.group(1))
+                end = int(match.group(2)) + 1 if match.group(2) \
+                    else len(DATA)
+                end = min(end, len(DATA))
+                stub.ranges.append((start, end))
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, end - 1, len(DATA)))
+                self.send_header('Content-Length', str(end - start))
+                self.end_headers()
+                self.wfile.write(DATA[start:end])
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}/file'.format(
+            self._server.server_port)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+@pytest.fixture
+def server():
+    server = RangeServer()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def downloader():
+    downloader = HttpDownloader(network_speed_calculator=Mock())
+    params = downloader._params._params
+    params['range_size'] = RANGE_SIZE
+    params['parallel_min_size'] = 2 * RANGE_SIZE
+    params['chunksize'] = 16 * 1024
+    yield downloader
+    downloader.close()
+
+
+def run_task(downloader, server, path, proceed):
+    task = HttpDownloadTask(
+        downloader, 'upload_id', server.url, path,
+        do_post_request=False, timeout=5, proceed=proceed)
+    return task.run()
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_download_resumed_from_saved_ranges(tmp_path, server, downloader):
+    path = str(tmp_path / 'file')
+    done = [[0, 3 * RANGE_SIZE], [8 * RANGE_SIZE, 10 * RANGE_SIZE + 10]]
+    with open(path, 'wb') as f:
+        f.write(bytes(len(DATA)))
+        for start, end in done:
+            f.seek(start)
+            f.write(DATA[start:end])
+    state = RangesState(path)
+    state.reset(len(DATA))
+    for start, end in done:
+        state.add(start, end)
+    state.save()
+
+    _, total = run_task(downloader, server, path, proceed=True)
+
+    assert total == len(DATA)
+    assert read(path) == DATA
+    assert not RangesState.exists(path)
+    # ranges loaded before are not requested again
+    for start, end in server.ranges:
+        for done_start, done_end in done:
+            assert end <= done_start or start >= done_end
+    assert server.ranges[0][0] == 3 * RANGE_SIZE
+
+
+def test_paused_download_keeps_ranges(tmp_path, server, downloader):
+    path = str(tmp_path / 'file')
+    calls = []
+
+    def get_upload_state(upload_id):
+        calls.append(upload_id)
+        return 'paused' if len(calls) > 20 else 'running'
+
+    downloader._params._params['get_upload_state_cb'] = get_upload_state
+    run_task(downloader, server, path, proceed=None)
+
+    state = RangesState(path)
+    assert state.load()
+    assert 0 < state.loaded < len(DATA)
+    content = read(path)
+    for start, end in state.done:
+        assert content[start:end] == DATA[start:end]
+
+    downloader._params._params['get_upload_state_cb'] = None
+    server.ranges = []
+    run_task(downloader, server, path, proceed=True)
+    assert read(path) == DATA
+    assert sum(end - start for start, end in server.ranges) <= \
+        len(DATA) - state.loaded
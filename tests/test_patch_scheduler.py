@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import threading
+import time
+
+import pytest
+
+from service.monitor.patches.patch_scheduler import PatchScheduler
+
+
+class Jobs(object):
+    """
+    Patch jobs recording order; job 'block' holds its worker
+    until released, job 'wait' runs until cancelled
+    """
+
+    def __init__(self):
+        self.done = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.scheduler = None
+
+    def process(self, job):
+        if job in ('block', 'wait'):
+            self.started.set()
+        if job == 'block':
+            self.release.wait(5)
+        while job == 'wait' and not self.scheduler.is_cancelled(job):
+            self.release.wait(0.01)
+        self.done.append((job, self.scheduler.is_cancelled(job)))
+
+
+@pytest.fixture
+def jobs():
+    jobs = Jobs()
+    jobs.scheduler = PatchScheduler(
+        jobs.process, small_workers=1, big_workers=1, big_size=100)
+    jobs.scheduler.start()
+    yield jobs
+    jobs.release.set()
+    jobs.scheduler.stop()
+
+
+def wait_done(jobs, count):
+    for _ in range(500):
+        if len(jobs.done) >= count:
+            break
+        time.sleep(0.01)
+
+
+def finish(jobs, count):
+    jobs.release.set()
+    wait_done(jobs, count)
+
+
+def test_smaller_jobs_first_in_lane(jobs):
+    jobs.scheduler.put('block', 'block', 1)
+    assert jobs.started.wait(5)
+    jobs.scheduler.put('s3', 's3', 3)
+    jobs.scheduler.put('s1', 's1', 1)
+    jobs.scheduler.put('s2', 's2', 2)
+    # big file goes to own lane and is not queued behind small ones
+    jobs.scheduler.put('big', 'big', 1000)
+    wait_done(jobs, 1)
+    assert jobs.done == [('big', False)]
+
+    finish(jobs, 5)
+    assert [job for job, _ in jobs.done] == ['big', 'block', 's1', 's2', 's3']
+
+
+def test_queued_jobs_of_superseded_version_cancelled(jobs):
+    jobs.scheduler.put('block', 'block', 1)
+    assert jobs.started.wait(5)
+    jobs.scheduler.put('direct1', 'direct1', 1, key='file', version='v1')
+    jobs.scheduler.put('reverse1', 'reverse1', 1, key='file', version='v1')
+    jobs.scheduler.put('other', 'other', 1, key='other', version='v1')
+    jobs.scheduler.put('direct2', 'direct2', 1, key='file', version='v2')
+
+    finish(jobs, 3)
+    assert sorted(job for job, _ in jobs.done) == \
+        ['block', 'direct2', 'other']
+    assert not jobs.scheduler._versions
+    assert not jobs.scheduler._uuid_keys
+
+
+def test_running_job_of_superseded_version_cancelled(jobs):
+    jobs.scheduler.put('wait', 'wait', 1, key='file', version='v1')
+    assert jobs.started.wait(5)
+    jobs.scheduler.put('next', 'next', 1, key='file', version='v2')
+
+    finish(jobs, 2)
+    assert jobs.done == [('wait', True), ('next', False)]
+
+
+def test_job_queued_again_while_running_is_rerun(jobs):
+    jobs.scheduler.put('block', 'block', 1)
+    assert jobs.started.wait(5)
+    jobs.scheduler.put('block', 'block', 1)
+
+    finish(jobs, 2)
+    assert jobs.done == [('block', False), ('block', False)]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import pytest
+
+from service.network.leakybucket import TokenBucket
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_exact_wait_time(clock):
+    bucket = TokenBucket(1000, 500, time_provider=clock)
+
+    assert bucket.consume(500) == 0
+    assert bucket.consume(100) == pytest.approx(0.1)
+    # tokens are not taken by failed consume
+    assert bucket.get_wait_time(200) == pytest.approx(0.2)
+
+    clock.now += 0.1
+    assert bucket.consume(100) == 0
+    assert bucket.consume(1) > 0
+
+
+def test_capacity_bounds_refill_and_amount(clock):
+    bucket = TokenBucket(1000, 500, time_provider=clock)
+    clock.now += 60
+
+    assert bucket.consume(500) == 0
+    assert bucket.consume(1) > 0
+
+    clock.now += 0.5
+    # amount above capacity is allowed on full bucket
+    assert bucket.consume(2000) == 0
+    assert bucket.get_wait_time(500) == pytest.approx(2.)
+
+
+def test_zero_rate_does_not_limit(clock):
+    bucket = TokenBucket(0, 0, time_provider=clock)
+
+    for _ in range(10):
+        assert bucket.consume(10 ** 9) == 0
+
+
+def test_child_limited_by_parent(clock):
+    parent = TokenBucket(1000, 1000, time_provider=clock)
+    first = parent.child(rate=400, capacity=400)
+    second = parent.child()
+
+    assert first.consume(400) == 0
+    assert first.consume(100) == pytest.approx(0.25)
+    assert second.consume(600) == 0
+    # parent is empty, child without own rate waits for parent
+    assert second.consume(100) == pytest.approx(0.1)
+    assert first.get_wait_time(100) == pytest.approx(0.25)
+
+
+def test_achieved_rate(clock):
+    rate = 1024 * 1024
+    bucket = TokenBucket(rate, 64 * 1024, time_provider=clock)
+    start = clock.now
+    consumed = 0
+    wakeups = 0
+    while consumed < 10 * rate:
+        wait = bucket.consume(16 * 1024)
+        if wait:
+            clock.now += wait
+            wakeups += 1
+        else:
+            consumed += 16 * 1024
+
+    elapsed = clock.now - start
+    # first capacity is sent at once, rest at bucket rate
+    assert (consumed - 64 * 1024) / elapsed == pytest.approx(rate, rel=0.002)
+    # each wait is exact, so waiter is woken up once per chunk at most
+    assert wakeups <= consumed // (16 * 1024)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-#
+
+###############################################################################
+#   
+#   Pvtbox. Fast and secure file transfer & sync directly across your devices. 
+#   Copyright © 2020  Pb Private Cloud Solutions Ltd. 
+#   
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#   
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#   
+###############################################################################
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from service.stat_tracking.tracking import Sender, TrackingSession
+
+
+class StatServer(object):
+    """
+    Local stat server stub recording requests
+    """
+
+    def __init__(self, confirm_batches):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(('GET', self.path, None, self.headers))
+                self._reply()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.requests.append(('POST', self.path, body, self.headers))
+                accepted = len(gzip.decompress(body).splitlines()) \
+                    if confirm_batches else None
+                self._reply(accepted)
+
+            def _reply(self, accepted=None):
+                self.send_response(200)
+                if accepted is not None:
+                    self.send_header(Sender.batch_accepted_header,
+                                     str(accepted))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.address = 'http://127.0.0.1:{}/1/'.format(
+            self._server.server_port)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def methods(self):
+        return [request[0] for request in self.requests]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+@pytest.fixture
+def server():
+    server = StatServer(confirm_batches=True)
+    yield server
+    server.stop()
+
+
+def send(sender, batch_key, events):
+    results = []
+    sender._on_events_sent_cb = lambda *args: results.append(args)
+    # send is run in Qt thread pool, call it synchronously
+    Sender.send.__wrapped__(sender, batch_key, events)
+    return results
+
+
+EVENTS = [(1, 'e=start&t=1'), (2, 'e=login&t=2'), (3, 'e=sync&t=3')]
+
+
+def test_events_sent_one_by_one_by_default(server):
+    sender = Sender(server.address, TrackingSession('ua'), None)
+
+    assert send(sender, 'key', EVENTS) == [(1, 3, True)]
+    assert server.methods() == ['GET'] * 3
+    assert server.requests[1][1].endswith('&e=login&t=2')
+
+
+def test_batch_sent_with_idempotency_key(server):
+    sender = Sender(server.address, TrackingSession('ua'), None,
+                    batches=True)
+
+    assert send(sender, 'key', EVENTS) == [(1, 3, True)]
+    method, _, body, headers = server.requests[0]
+    assert method == 'POST'
+    assert headers['Idempotency-Key'] == 'key'
+    assert headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(body).decode().splitlines()
+    assert [line.split('&', 3)[3] for line in lines] == \
+        [event_str for _, event_str in EVENTS]
+
+
+def test_unconfirmed_batch_falls_back_to_single_events():
+    server = StatServer(confirm_batches=False)
+    try:
+        sender = Sender(server.address, TrackingSession('ua'), None,
+                        batches=True)
+
+        assert send(sender, 'key', EVENTS) == [(1, 3, True)]
+        assert server.methods() == ['POST'] + ['GET'] * 3
+
+        # batches stay disabled for next events
+        assert send(sender, 'key2', EVENTS[:1]) == [(1, 1, True)]
+        assert server.methods() == ['POST'] + ['GET'] * 4
+    finally:
+        server.stop()
+
+
+def test_failed_batch_is_not_acknowledged():
+    server = StatServer(confirm_batches=True)
+    address = server.address
+    server.stop()
+    sender = Sender(address, TrackingSession('ua'), None, batches=True)
+    sender.request_timeout = 1
+
+    assert send(sender, 'key', EVENTS) == [(1, 0, False)]